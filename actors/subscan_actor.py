@@ -1,10 +1,9 @@
-import requests
+import httpx
+import asyncio
 import os
-import time
-from time import (
-    sleep,
-)
 import logging
+from tools.loop_client import LoopClient
+from tools.rate_limiter import subscan_limiter
 import tools.log_config as log_config
 
 logger = logging.getLogger(__name__)
@@ -12,25 +11,59 @@ logger = logging.getLogger(__name__)
 
 class SubscanActor:
     @property
-    def get_session(
+    def get_client(
         self,
     ):
-        return self.session
+        return self.client
 
     def __init__(
         self,
-        session=None,
+        client=None,
+        limiter=None,
+        transport=None,
     ):
         self.subscan_rest_endpoint = "https://polkadot.api.subscan.io/api/"
         self.subscan_rest_headers = {
             "Accept": "*/*",
             "x-api-key": os.environ["SUBSCAN_API_KEY"],
         }
-        self.session = session
-        if not self.session:
-            self.session = requests.Session()
+        # Bounded keep-alive pool shared by every request made through this actor
+        self.subscan_limits = httpx.Limits(
+            max_connections=int(os.environ.get("SUBSCAN_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(os.environ.get("SUBSCAN_MAX_KEEPALIVE_CONNECTIONS", 20)),
+            keepalive_expiry=30,
+        )
+        self.subscan_timeout = httpx.Timeout(30.0, connect=10.0)
+        self.client = client
+        # Without a client of the caller, every event loop gets one of its own
+        self._loop_clients = None
+        if client is None:
+            self._loop_clients = LoopClient(
+                lambda: httpx.AsyncClient(
+                    http2=True,
+                    limits=self.subscan_limits,
+                    timeout=self.subscan_timeout,
+                    transport=transport,
+                )
+            )
+        # Process-wide bucket sized to our Subscan plan, shared by every widget's actor
+        self.limiter = limiter or subscan_limiter()
+
+    def _get_client(
+        self,
+    ):
+        if self._loop_clients is not None:
+            self.client = self._loop_clients.get()
+        return self.client
+
+    async def aclose(
+        self,
+    ):
+        if self._loop_clients is not None:
+            await self._loop_clients.aclose()
+            self.client = None
 
-    def subscan_rest_make_request(
+    async def subscan_rest_make_request(
         self,
         url,
         variables=None,
@@ -40,15 +73,17 @@ class SubscanActor:
         url = f"{self.subscan_rest_endpoint}{url}"
         logger.info(f". [=] Fetching data from REST API from {url}")
 
+        client = self._get_client()
         result = []
         current_fetch_count = 0
         while url and (current_fetch_count < max_page_fetch):
             logger.info(f". page {current_fetch_count + 1}/{max_page_fetch} of {url}")
-            self.session.headers.update(self.subscan_rest_headers)
-            response = self.session.post(
+            await self.limiter.acquire()
+            response = await client.post(
                 url,
                 params=variables,
                 json=data,
+                headers=self.subscan_rest_headers,
             )
 
             if response.status_code == 200:
@@ -92,18 +127,17 @@ class SubscanActor:
 
             elif response.status_code == 429:  # Too many requests
                 logger.warning(f" [-] Rate limit exceeded.")
-                # get retry-after header
+                # get retry-after header, fall back to a short pause so we never spin on 429s
                 retry_after = response.headers.get(
                     "retry-after",
                     None,
                 )
                 try:
-                    if retry_after is not None:
-                        retry_after = int(retry_after)
-                        self.rate_limit_wait(retry_after)
-                        continue
-                except:
-                    pass
+                    retry_after = int(retry_after)
+                except (TypeError, ValueError):
+                    retry_after = 1
+                self.rate_limit_wait(retry_after)
+                continue
 
             elif response.status_code in [
                 500,
@@ -128,4 +162,5 @@ class SubscanActor:
         retry_after,
     ):
         logger.warning(f". [-] Waiting for {retry_after} seconds which is {round(retry_after / 60, 2)} minutes.")
-        time.sleep(retry_after)
+        # Every caller queues on the shared bucket instead of sleeping on its own
+        self.limiter.defer(retry_after)
@@ -1,10 +1,9 @@
-import requests
+import httpx
+import asyncio
 import os
-import time
-from time import (
-    sleep,
-)
 import logging
+from tools.loop_client import LoopClient
+from tools.rate_limiter import subsquid_limiter
 import tools.log_config as log_config
 
 logger = logging.getLogger(__name__)
@@ -12,14 +11,16 @@ logger = logging.getLogger(__name__)
 
 class SubSquidActor:
     @property
-    def get_session(
+    def get_client(
         self,
     ):
-        return self.session
+        return self.client
 
     def __init__(
         self,
-        session=None,
+        client=None,
+        limiters=None,
+        transport=None,
     ):
         self.subsquid_explorer_endpoint = "https://squid.subsquid.io/gs-explorer-polkadot/graphql"
         self.subsquid_stats_endpoint = "https://squid.subsquid.io/gs-stats-polkadot/graphql"
@@ -28,37 +29,113 @@ class SubSquidActor:
         self.subsquid_graphql_headers = {
             "Accept": "*/*",
         }
-        self.session = session
-        if not self.session:
-            self.session = requests.Session()
+        # Maximum number of queries in flight per endpoint
+        self.subsquid_max_concurrency = int(os.environ.get("SUBSQUID_MAX_CONCURRENCY", 4))
+        self.subsquid_limits = httpx.Limits(
+            max_connections=int(os.environ.get("SUBSQUID_MAX_CONNECTIONS", 50)),
+            max_keepalive_connections=int(os.environ.get("SUBSQUID_MAX_KEEPALIVE_CONNECTIONS", 10)),
+            keepalive_expiry=30,
+        )
+        # 50k row pages take a while to be served
+        self.subsquid_timeout = httpx.Timeout(120.0, connect=10.0)
+        self.client = client
+        # Without a client of the caller, every event loop gets one of its own
+        self._loop_clients = None
+        if client is None:
+            self._loop_clients = LoopClient(
+                lambda: httpx.AsyncClient(
+                    http2=True,
+                    limits=self.subsquid_limits,
+                    timeout=self.subsquid_timeout,
+                    transport=transport,
+                )
+            )
+        self._semaphore_loop = None
+        self._semaphores = {}
+        # Process-wide bucket per endpoint, shared by every widget's actor
+        self.limiters = limiters or {
+            endpoint: subsquid_limiter(endpoint)
+            for endpoint in (
+                self.subsquid_explorer_endpoint,
+                self.subsquid_stats_endpoint,
+                self.subsquid_main_endpoint,
+            )
+        }
+
+    def _get_client(
+        self,
+    ):
+        # asyncio semaphores are bound to the event loop that created them, like the connections
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphores = {}
+            self._semaphore_loop = loop
+        if self._loop_clients is not None:
+            self.client = self._loop_clients.get()
+        return self.client
+
+    def _get_semaphore(
+        self,
+        endpoint,
+    ):
+        if endpoint not in self._semaphores:
+            self._semaphores[endpoint] = asyncio.Semaphore(self.subsquid_max_concurrency)
+        return self._semaphores[endpoint]
+
+    async def aclose(
+        self,
+    ):
+        if self._loop_clients is not None:
+            await self._loop_clients.aclose()
+            self.client = None
 
-    def _subscan_graphql_make_query(
+    async def _subscan_graphql_make_query(
         self,
         endpoint,
         query,
         variables=None,
     ):
-        logger.info(f". [=] Fetching data from Graphql API from {endpoint}")
-        self.session.headers.update(self.subsquid_graphql_headers)
-        response = self.session.post(
-            endpoint,
-            json={
-                "query": query,
-                "variables": variables,
-            },
-        )
+        client = self._get_client()
+        limiter = self.limiters[endpoint]
+        async with self._get_semaphore(endpoint):
+            while True:
+                await limiter.acquire()
+                logger.info(f". [=] Fetching data from Graphql API from {endpoint}")
+                response = await client.post(
+                    endpoint,
+                    json={
+                        "query": query,
+                        "variables": variables,
+                    },
+                    headers=self.subsquid_graphql_headers,
+                )
 
-        if response.status_code in (
-            301,
-            302,
-        ):
-            response = self.session.post(
-                response.headers["location"],
-                json={
-                    "query": query,
-                    "variables": variables,
-                },
-            )
+                if response.status_code in (
+                    301,
+                    302,
+                ):
+                    response = await client.post(
+                        response.headers["location"],
+                        json={
+                            "query": query,
+                            "variables": variables,
+                        },
+                        headers=self.subsquid_graphql_headers,
+                    )
+
+                if response.status_code != 429:  # Too many requests
+                    break
+
+                retry_after = response.headers.get(
+                    "retry-after",
+                    None,
+                )
+                try:
+                    retry_after = int(retry_after)
+                except (TypeError, ValueError):
+                    retry_after = 1
+                logger.warning(f". [-] Rate limit exceeded on {endpoint}, backing off for {retry_after} seconds.")
+                limiter.defer(retry_after)
 
         if response.status_code != 200:
             logger.error(f". [-] Failed to retrieve from API. Status code: {response.status_code} - {response.text}")
@@ -70,35 +147,128 @@ class SubSquidActor:
 
         return response.json()
 
-    def subscan_explorer_graphql(
+    async def _subscan_graphql_paginate(
+        self,
+        endpoint,
+        query,
+        entity,
+        where,
+        page_size=50000,
+        max_rows=None,
+        after=None,
+        newest_first=False,
+    ):
+        # Keyset pagination: every page continues from the last id of the previous one, so deep pages
+        # cost the same as the first and no totalCount round-trip is needed. The query must accept
+        # $where, $limit and $orderBy and return the rows under `entity`.
+        cursor_filter = "id_lt" if newest_first else "id_gt"
+        order_by = ["id_DESC" if newest_first else "id_ASC"]
+
+        async def fetch_page(
+            cursor,
+            limit,
+        ):
+            page_where = dict(where)
+            if cursor is not None:
+                page_where[cursor_filter] = cursor
+            result = await self._subscan_graphql_make_query(
+                endpoint=endpoint,
+                query=query,
+                variables={
+                    "where": page_where,
+                    "limit": limit,
+                    "orderBy": order_by,
+                },
+            )
+            return (
+                (result or {})
+                .get("data", {})
+                .get(
+                    entity,
+                    [],
+                )
+            )
+
+        fetched = 0
+        limit = page_size if max_rows is None else min(page_size, max_rows)
+        next_page = asyncio.ensure_future(fetch_page(after, limit))
+        try:
+            while next_page is not None:
+                page = await next_page
+                next_page = None
+                if not page:
+                    return
+
+                fetched += len(page)
+                if len(page) == limit and (max_rows is None or fetched < max_rows):
+                    limit = page_size if max_rows is None else min(page_size, max_rows - fetched)
+                    # Request the next page before handing this one over, so it downloads while the caller works
+                    next_page = asyncio.ensure_future(fetch_page(page[-1]["id"], limit))
+
+                yield page
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    async def subscan_explorer_graphql(
         self,
         _query,
         variables=None,
     ):
-        return self._subscan_graphql_make_query(
+        return await self._subscan_graphql_make_query(
             endpoint=self.subsquid_explorer_endpoint,
             query=_query,
             variables=variables,
         )
 
-    def subscan_stats_graphql(
+    async def subscan_stats_graphql(
         self,
         _query,
         variables=None,
     ):
-        return self._subscan_graphql_make_query(
+        return await self._subscan_graphql_make_query(
             endpoint=self.subsquid_stats_endpoint,
             query=_query,
             variables=variables,
         )
 
-    def subscan_main_graphql(
+    async def subscan_main_graphql(
         self,
         _query,
         variables=None,
     ):
-        return self._subscan_graphql_make_query(
+        return await self._subscan_graphql_make_query(
             endpoint=self.subsquid_main_endpoint,
             query=_query,
             variables=variables,
         )
+
+    def subscan_explorer_graphql_paginate(
+        self,
+        _query,
+        entity,
+        where,
+        **kwargs,
+    ):
+        return self._subscan_graphql_paginate(
+            endpoint=self.subsquid_explorer_endpoint,
+            query=_query,
+            entity=entity,
+            where=where,
+            **kwargs,
+        )
+
+    def subscan_main_graphql_paginate(
+        self,
+        _query,
+        entity,
+        where,
+        **kwargs,
+    ):
+        return self._subscan_graphql_paginate(
+            endpoint=self.subsquid_main_endpoint,
+            query=_query,
+            entity=entity,
+            where=where,
+            **kwargs,
+        )
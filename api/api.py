@@ -50,6 +50,8 @@ from fastapi import (
     HTTPException,
     status,
 )
+from tools.rate_limiter import limiter_stats
+from tools.cache import cache_stats, close_widget_store
 import tools.log_config as log_config
 import os
 import logging
@@ -160,6 +162,10 @@ tags_metadata = [
         "name": "Badges",
         "description": "Badges related endpoints for account",
     },
+    {
+        "name": "Monitoring",
+        "description": "Upstream usage and cache related endpoints",
+    },
 ]
 
 from widgets.extrinsics import (
@@ -201,6 +207,25 @@ BADGES_CONTEXT = Badges()
 app = FastAPI(openapi_tags=tags_metadata)
 
 
+@app.on_event("shutdown")
+async def close_actors():
+    for context in (
+        OVERVIEW_CONTEXT,
+        EXTRINSICS_CONTEXT,
+        REWARDS_CONTEXT,
+        STATS_CONTEXT,
+        BADGES_CONTEXT,
+    ):
+        await context.subscan_actor.aclose()
+        await context.subsquid_actor.aclose()
+
+
+@app.on_event("shutdown")
+def close_widget_cache():
+    # Pending writes to a shared cache backend are not lost on restart
+    close_widget_store()
+
+
 from api.routers import (
     overview,
     stats,
@@ -368,6 +393,30 @@ async def login_for_access_token(
     )
 
 
+@app.get(
+    "/rate-limits",
+    dependencies=[Depends(get_current_user)],
+    tags=["Monitoring"],
+)
+async def rate_limits():
+    """
+    Queue depth and wait time of the shared upstream rate limiters.
+    """
+    return limiter_stats()
+
+
+@app.get(
+    "/cache-stats",
+    dependencies=[Depends(get_current_user)],
+    tags=["Monitoring"],
+)
+async def cache_usage():
+    """
+    Size, hit rate and evictions of the shared widget cache.
+    """
+    return cache_stats()
+
+
 @app.get(
     "/test-auth",
     dependencies=[Depends(get_current_user)],
@@ -6,7 +6,9 @@ from fastapi import (
     HTTPException,
     Query,
     Depends,
+    Response,
 )
+from fastapi.responses import StreamingResponse
 from ..api import (
     db,
 )
@@ -21,7 +23,6 @@ from datetime import (
 from collections import (
     defaultdict,
 )
-import pandas as pd
 from collections import (
     Counter,
 )
@@ -33,6 +34,7 @@ from datetime import (
     timedelta,
 )
 from api.api import BADGES_CONTEXT, StatsType, get_current_user
+import json
 import tools.log_config as log_config
 import os
 import logging
@@ -50,8 +52,25 @@ router = APIRouter()
     dependencies=[Depends(get_current_user)],
     responses={
         200: {
-            "description": "Check Badges",
-            "content": {"application/json": {"example": None}},
+            "description": "Check Badges, sources that missed the time budget are listed in the X-Timed-Out-Sources header",
+            "content": {
+                "application/json": {
+                    "example": [
+                        {
+                            "name": "Join the party!",
+                            "description": "Sent a token transfer.",
+                            "success": True,
+                            "status": "earned",
+                        },
+                        {
+                            "name": "Identity Pioneer",
+                            "description": "Established an identity on any network.",
+                            "success": None,
+                            "status": "unknown",
+                        },
+                    ]
+                }
+            },
         },
         204: {
             "description": "No content found.",
@@ -63,14 +82,65 @@ router = APIRouter()
         },
     },
 )
-def check_badges(
+async def check_badges(
+    response: Response,
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
-    )
+    ),
 ):
-    data = BADGES_CONTEXT.check_badges(public_key=public_key)
+    data = await BADGES_CONTEXT.check_badges(public_key=public_key)
     if data is None:
         raise HTTPException(status_code=404, detail="Check for public key!")
-    return data
+    (
+        user_badges,
+        timed_out,
+    ) = data
+    if timed_out:
+        response.headers["X-Timed-Out-Sources"] = ",".join(timed_out)
+    return user_badges
+
+
+@router.get(
+    "/stream",
+    dependencies=[Depends(get_current_user)],
+    responses={
+        200: {
+            "description": "Server-Sent Events with every badge as soon as it is decided, the done event lists the sources that missed the time budget",
+            "content": {
+                "text/event-stream": {
+                    "example": "event: badge\n"
+                    'data: {"name": "Identity Pioneer", "description": "Established an identity on any network.", '
+                    '"success": true, "status": "earned"}\n\n'
+                    "event: done\n"
+                    'data: {"timed_out": []}\n\n'
+                }
+            },
+        },
+        404: {
+            "description": "Not found",
+            "content": {"application/json": {"example": {"error": "Error description"}}},
+        },
+    },
+)
+async def stream_badges(
+    public_key: str = Query(
+        ...,
+        title="Public Key",
+        description="Public Key of the account to query",
+    ),
+):
+    stream = BADGES_CONTEXT.stream_badges(public_key=public_key)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Check for public key!")
+
+    async def events():
+        async for event, data in stream:
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
@@ -16,7 +16,6 @@ from datetime import (
 from collections import (
     defaultdict,
 )
-import pandas as pd
 from collections import (
     Counter,
 )
@@ -27,7 +26,8 @@ from datetime import (
     datetime,
     timedelta,
 )
-import pandas as pd
+import numpy as np
+from tools import bucketing
 from api.api import EXTRINSICS_CONTEXT, ExtrinsicsType, get_current_user
 import tools.log_config as log_config
 import os
@@ -88,7 +88,7 @@ class CallActivityInterval(
         },
     },
 )
-def extrinsics_activity(
+async def extrinsics_activity(
     public_key: str = Query(
         ...,
         title="Public Key",
@@ -100,8 +100,8 @@ def extrinsics_activity(
         description="Interval to group the data",
     ),
 ):
-    data = EXTRINSICS_CONTEXT.extrinsics(public_key)
-    if not data:
+    data = await EXTRINSICS_CONTEXT.activity(public_key)
+    if data is None:
         raise HTTPException(
             status_code=204,
             detail="No content found.",
@@ -115,40 +115,32 @@ def extrinsics_activity(
             detail=f"Invalid interval: {interval}. Valid values are: {', '.join([e.value for e in ActivityInterval])}",
         )
 
-    df = pd.DataFrame(data)
-    df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.date
-    df.set_index(pd.DatetimeIndex(df["timestamp"]), inplace=True)
-
-    # Determine resampling frequency
-    freq_map = {
-        ActivityInterval.DAY: "D",
-        ActivityInterval.WEEK: "W-MON",
-        ActivityInterval.MONTH: "M",
-        ActivityInterval.YEAR: "Y",
-    }
-    freq = freq_map[interval_enum]
-
-    # Group the data
-    grouped_data = df.resample(freq).size()
-
-    # For non-year intervals, reindex to fill missing dates up to today
-    if interval_enum != ActivityInterval.YEAR:
-        today = datetime.utcnow().date()
-        full_date_range = pd.date_range(start=grouped_data.index.min(), end=today, freq=freq)
-        grouped_data = grouped_data.reindex(full_date_range, fill_value=0)
+    # Daily buckets kept by the widget, coarser intervals are summed from them
+    (
+        days,
+        counts,
+    ) = data
+    # Group the data, non-year intervals are filled with zeros up to today
+    (
+        labels,
+        totals,
+    ) = bucketing.resample(
+        days,
+        counts,
+        interval_enum.value,
+        end=None if interval_enum == ActivityInterval.YEAR else np.datetime64(datetime.utcnow().date()),
+    )
 
     echarts_data = {
         "title": {"text": f"Activity for {interval_enum.value}"},
         "xAxis": {
             "type": "category",
-            "data": grouped_data.index.strftime(
-                "%Y-%m-%d" if interval_enum != ActivityInterval.YEAR else "%Y"
-            ).tolist(),
+            "data": bucketing.format_labels(labels, interval_enum.value),
         },
         "yAxis": {"type": "value"},
         "series": [
             {
-                "data": grouped_data.tolist(),
+                "data": totals.tolist(),
                 "type": "line",
             }
         ],
@@ -199,14 +191,14 @@ def extrinsics_activity(
         },
     },
 )
-def extrinsics_distribution(
+async def extrinsics_distribution(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = EXTRINSICS_CONTEXT.distribution(public_key)
+    data = await EXTRINSICS_CONTEXT.distribution(public_key)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -237,14 +229,14 @@ def extrinsics_distribution(
         },
     },
 )
-def extrinsics_success_rate(
+async def extrinsics_success_rate(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = EXTRINSICS_CONTEXT.extrinsics(public_key)
+    data = await EXTRINSICS_CONTEXT.success_count(public_key)
 
     if not data:
         raise HTTPException(
@@ -253,8 +245,8 @@ def extrinsics_success_rate(
         )
 
     # Counting the number of successful and failed extrinsics
-    successful_extrinsics = sum(1 for entry in data if entry["success"])
-    failed_extrinsics = len(data) - successful_extrinsics
+    successful_extrinsics = data["success"]
+    failed_extrinsics = data["total"] - successful_extrinsics
 
     # Preparing data for pie chart
     echarts_data = {
@@ -304,57 +296,54 @@ def extrinsics_success_rate(
         },
     },
 )
-def extrinsics_call_activity(
+async def extrinsics_call_activity(
     public_key: str = Query(..., title="Public Key", description="Public Key of the account to query"),
     call_name: str = Query(..., title="Call Name", description="Call name to filter the data"),
+    pallet_name: str = Query(None, title="Pallet Name", description="Pallet of the call, when its name is ambiguous"),
     interval: CallActivityInterval = Query(..., title="Interval", description="Interval to group the data"),
 ):
-    data = EXTRINSICS_CONTEXT.extrinsics(public_key)
+    data = await EXTRINSICS_CONTEXT.activity(
+        public_key,
+        call_name=call_name,
+        pallet_name=pallet_name,
+    )
 
-    if not data:
+    if data is None:
         raise HTTPException(
             status_code=204,
             detail="No content found.",
         )
-    # Filtering data by the specified call name
-    filtered_data = [entry for entry in data if entry["mainCall"]["callName"] == call_name]
-    if len(filtered_data) == 0:
+    # The daily buckets of the specified call name
+    (
+        days,
+        counts,
+    ) = data
+    if len(days) == 0:
         raise HTTPException(
             status_code=204,
             detail=f"No content found for call name: {call_name}",
         )
-    df = pd.DataFrame(data)
-    df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.date
-    df.set_index(pd.DatetimeIndex(df["timestamp"]), inplace=True)
-
-    # Determine resampling frequency
-    freq_map = {
-        CallActivityInterval.DAY: "D",
-        CallActivityInterval.WEEK: "W-MON",
-        CallActivityInterval.MONTH: "M",
-        CallActivityInterval.YEAR: "Y",
-    }
-    freq = freq_map[interval]
-
-    # Group the data
-    grouped_data = df.resample(freq).size()
-
-    # For non-year intervals, reindex to fill missing dates up to today
-    if interval != CallActivityInterval.YEAR:
-        today = datetime.utcnow().date()
-        full_date_range = pd.date_range(start=grouped_data.index.min(), end=today, freq=freq)
-        grouped_data = grouped_data.reindex(full_date_range, fill_value=0)
+    # Group the data, non-year intervals are filled with zeros up to today
+    (
+        labels,
+        totals,
+    ) = bucketing.resample(
+        days,
+        counts,
+        interval.value,
+        end=None if interval == CallActivityInterval.YEAR else np.datetime64(datetime.utcnow().date()),
+    )
 
     echarts_data = {
         "title": {"text": f"Activity for {interval.value}"},
         "xAxis": {
             "type": "category",
-            "data": grouped_data.index.strftime("%Y-%m-%d" if interval != CallActivityInterval.YEAR else "%Y").tolist(),
+            "data": bucketing.format_labels(labels, interval.value),
         },
         "yAxis": {"type": "value"},
         "series": [
             {
-                "data": grouped_data.tolist(),
+                "data": totals.tolist(),
                 "type": "line",
             }
         ],
@@ -380,14 +369,14 @@ def extrinsics_call_activity(
         },
     },
 )
-def weekly_transaction_rate(
+async def weekly_transaction_rate(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = EXTRINSICS_CONTEXT.weekly_transaction_rate(public_key=public_key)
+    data = await EXTRINSICS_CONTEXT.weekly_transaction_rate(public_key=public_key)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -411,14 +400,14 @@ def weekly_transaction_rate(
         },
     },
 )
-def total_extrinsics(
+async def total_extrinsics(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = EXTRINSICS_CONTEXT.total_extrinsics(public_key=public_key)
+    data = await EXTRINSICS_CONTEXT.total_extrinsics(public_key=public_key)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -453,14 +442,14 @@ def total_extrinsics(
         },
     },
 )
-def recent_extrinsics(
+async def recent_extrinsics(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = EXTRINSICS_CONTEXT.recent_extrinsics(public_key=public_key)
+    data = await EXTRINSICS_CONTEXT.recent_extrinsics(public_key=public_key)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
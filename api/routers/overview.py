@@ -7,7 +7,6 @@ from ..api import (
 )
 
 from enum import Enum
-import pandas as pd
 from api.api import OVERVIEW_CONTEXT, StatsType, get_current_user
 from tools.helpers import encode
 import tools.log_config as log_config
@@ -96,7 +95,7 @@ router = APIRouter()
         },
     },
 )
-def account(
+async def account(
     public_key: str = Query(
         ...,
         title="Public Key",
@@ -109,7 +108,7 @@ def account(
     except:
         raise HTTPException(status_code=404, detail="Invalid public key which cannot be encoded to address")
 
-    data = OVERVIEW_CONTEXT.account(public_key=public_key, address=address)
+    data = await OVERVIEW_CONTEXT.account(public_key=public_key, address=address)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
 
@@ -156,7 +155,7 @@ def account(
         },
     },
 )
-def balance_distribution(
+async def balance_distribution(
     public_key: str = Query(
         ...,
         title="Public Key",
@@ -169,7 +168,7 @@ def balance_distribution(
     except:
         raise HTTPException(status_code=404, detail="Invalid public key which cannot be encoded to address")
 
-    data = OVERVIEW_CONTEXT.balance_distribution(public_key=public_key, address=address)
+    data = await OVERVIEW_CONTEXT.balance_distribution(public_key=public_key, address=address)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -208,7 +207,7 @@ def balance_distribution(
         },
     },
 )
-def identity(
+async def identity(
     public_key: str = Query(
         ...,
         title="Public Key",
@@ -221,7 +220,7 @@ def identity(
     except:
         raise HTTPException(status_code=404, detail="Invalid public key which cannot be encoded to address")
 
-    data = OVERVIEW_CONTEXT.identity(public_key=public_key, address=address)
+    data = await OVERVIEW_CONTEXT.identity(public_key=public_key, address=address)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -260,7 +259,7 @@ def identity(
         },
     },
 )
-def balance_stats(
+async def balance_stats(
     public_key: str = Query(
         ...,
         title="Public Key",
@@ -273,7 +272,7 @@ def balance_stats(
     except:
         raise HTTPException(status_code=404, detail="Invalid public key which cannot be encoded to address")
 
-    data = OVERVIEW_CONTEXT.balance_stats(public_key=public_key, address=address)
+    data = await OVERVIEW_CONTEXT.balance_stats(public_key=public_key, address=address)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -297,7 +296,7 @@ def balance_stats(
         },
     },
 )
-def balance_history(
+async def balance_history(
     public_key: str = Query(
         ...,
         title="Public Key",
@@ -310,7 +309,7 @@ def balance_history(
     except:
         raise HTTPException(status_code=404, detail="Invalid public key which cannot be encoded to address")
 
-    data = OVERVIEW_CONTEXT.balance_history(public_key=public_key, address=address)
+    data = await OVERVIEW_CONTEXT.balance_history(public_key=public_key, address=address)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -7,9 +7,10 @@ from ..api import (
 )
 
 from enum import Enum
-import pandas as pd
 from datetime import date
 from datetime import datetime
+import numpy as np
+from tools import bucketing
 from api.api import REWARDS_CONTEXT, StatsType, get_current_user
 import tools.log_config as log_config
 import os
@@ -50,14 +51,14 @@ class HistoryInterval(
         },
     },
 )
-def total_rewards(
+async def total_rewards(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = REWARDS_CONTEXT.total_rewards(public_key=public_key)
+    data = await REWARDS_CONTEXT.total_rewards(public_key=public_key)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -93,14 +94,14 @@ def total_rewards(
         },
     },
 )
-def recent_rewards(
+async def recent_rewards(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = REWARDS_CONTEXT.recent_rewards(public_key=public_key)
+    data = await REWARDS_CONTEXT.recent_rewards(public_key=public_key)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -133,7 +134,7 @@ def recent_rewards(
         },
     },
 )
-def reward_history(
+async def reward_history(
     public_key: str = Query(
         ...,
         title="Public Key",
@@ -145,8 +146,8 @@ def reward_history(
         description="Interval to group the data",
     ),
 ):
-    data = REWARDS_CONTEXT.rewards(public_key=public_key)
-    if not data:
+    data = await REWARDS_CONTEXT.reward_history(public_key=public_key)
+    if data is None:
         raise HTTPException(
             status_code=204,
             detail="No content found.",
@@ -160,39 +161,32 @@ def reward_history(
             detail=f"Invalid interval: {interval}. Valid values are: {', '.join([e.value for e in HistoryInterval])}",
         )
 
-    df = pd.DataFrame(data)
-    # Extract date from the timestamp and set as index
-    df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.date
-    df.set_index(pd.DatetimeIndex(df["timestamp"]), inplace=True)
-
-    # Determine resampling frequency
-    freq_map = {
-        HistoryInterval.DAY: "D",
-        HistoryInterval.WEEK: "W-MON",
-        HistoryInterval.MONTH: "M",
-        HistoryInterval.YEAR: "Y",
-    }
-    freq = freq_map[interval_enum]
-
-    # Group the data
-    grouped_data = df.resample(freq).size()
-
-    # For non-year intervals, reindex to fill missing dates up to today
-    if interval_enum != HistoryInterval.YEAR:
-        today = datetime.utcnow().date()
-        full_date_range = pd.date_range(start=grouped_data.index.min(), end=today, freq=freq)
-        grouped_data = grouped_data.reindex(full_date_range, fill_value=0)
+    # The widget groups the payouts per day, index them by date
+    (
+        days,
+        counts,
+    ) = data
+    # Group the data, non-year intervals are filled with zeros up to today
+    (
+        labels,
+        totals,
+    ) = bucketing.resample(
+        days,
+        counts,
+        interval_enum.value,
+        end=None if interval_enum == HistoryInterval.YEAR else np.datetime64(datetime.utcnow().date()),
+    )
 
     echarts_data = {
         "title": {"text": f"Activity for {interval.value}"},
         "xAxis": {
             "type": "category",
-            "data": grouped_data.index.strftime("%Y-%m-%d" if interval_enum != HistoryInterval.YEAR else "%Y").tolist(),
+            "data": bucketing.format_labels(labels, interval_enum.value),
         },
         "yAxis": {"type": "value"},
         "series": [
             {
-                "data": grouped_data.tolist(),
+                "data": totals.tolist(),
                 "type": "line",
             }
         ],
@@ -236,14 +230,14 @@ def reward_history(
         },
     },
 )
-def reward_relationship(
+async def reward_relationship(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = REWARDS_CONTEXT.reward_relationship(public_key=public_key)
+    data = await REWARDS_CONTEXT.reward_relationship(public_key=public_key)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -7,7 +7,7 @@ from ..api import (
 )
 
 from enum import Enum
-import pandas as pd
+from tools import bucketing
 from api.api import STATS_CONTEXT, get_current_user
 import tools.log_config as log_config
 import os
@@ -81,14 +81,14 @@ class TransferInterval(
         },
     },
 )
-def transfer_relationship(
+async def transfer_relationship(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = STATS_CONTEXT.transfer_relationship(public_key=public_key)
+    data = await STATS_CONTEXT.transfer_relationship(public_key=public_key)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -134,14 +134,14 @@ def transfer_relationship(
         },
     },
 )
-def recent_transfers(
+async def recent_transfers(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = STATS_CONTEXT.recent_transfers(public_key=public_key)
+    data = await STATS_CONTEXT.recent_transfers(public_key=public_key)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -176,7 +176,7 @@ def recent_transfers(
         },
     },
 )
-def transfer_history(
+async def transfer_history(
     public_key: str = Query(
         ...,
         title="Public Key",
@@ -188,7 +188,7 @@ def transfer_history(
         description="Interval to group the data",
     ),
 ):
-    data = STATS_CONTEXT.transfer_history(public_key=public_key)
+    data = await STATS_CONTEXT.transfer_history(public_key=public_key)
     if not data:
         raise HTTPException(
             status_code=204,
@@ -203,41 +203,44 @@ def transfer_history(
             detail=f"Invalid interval: {interval}. Valid values are: {', '.join([e.value for e in TransferInterval])}",
         )
 
-    # Create a DataFrame directly from Series without having to convert or map
-    df = pd.DataFrame(
-        {
-            "transfer_date": data["timestamps"],
-            "Incoming Transfers": data["incoming_counts"],
-            "Outgoing Transfers": data["outgoing_counts"],
-        }
-    )
-    df["transfer_date"] = pd.to_datetime(df["transfer_date"])
-    df.set_index("transfer_date", inplace=True)
-
-    # Resample based on interval
-    if interval_enum == TransferInterval.WEEK:
-        df = df.resample("W-MON").sum()
-    elif interval_enum == TransferInterval.MONTH:
-        df = df.resample("M").sum()
-    elif interval_enum == TransferInterval.YEAR:
-        df = df.resample("Y").sum()
+    # Daily buckets from the widget up to today, coarser intervals are summed from them
+    labels = data["timestamps"]
+    incoming = data["incoming_counts"]
+    outgoing = data["outgoing_counts"]
+    if interval_enum != TransferInterval.DAY:
+        (
+            _,
+            incoming,
+        ) = bucketing.resample(
+            labels,
+            incoming,
+            interval_enum.value,
+        )
+        (
+            labels,
+            outgoing,
+        ) = bucketing.resample(
+            labels,
+            outgoing,
+            interval_enum.value,
+        )
 
     chart_data = {
         "xAxis": {
             "type": "category",
-            "data": df.index.strftime("%Y-%m-%d").tolist(),
+            "data": bucketing.format_labels(labels),
         },
         "yAxis": {"type": "value"},
         "series": [
             {
                 "name": "Incoming Transfers",
                 "type": "line",
-                "data": df["Incoming Transfers"].tolist(),
+                "data": incoming.tolist(),
             },
             {
                 "name": "Outgoing Transfers",
                 "type": "line",
-                "data": df["Outgoing Transfers"].tolist(),
+                "data": outgoing.tolist(),
             },
         ],
     }
@@ -263,14 +266,14 @@ def transfer_history(
         },
     },
 )
-def total_transfers(
+async def total_transfers(
     public_key: str = Query(
         ...,
         title="Public Key",
         description="Public Key of the account to query",
     )
 ):
-    data = STATS_CONTEXT.total_transfers(public_key=public_key)
+    data = await STATS_CONTEXT.total_transfers(public_key=public_key)
     if data is None:
         raise HTTPException(status_code=204, detail="No content found.")
     return data
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import sys
+import time
+
+from api.api import BADGES_CONTEXT, EXTRINSICS_CONTEXT, OVERVIEW_CONTEXT, REWARDS_CONTEXT, STATS_CONTEXT
+from tools.badge_store import BadgeStore
+from tools.cache import close_widget_store
+from widgets.badges import BADGE_RULES, FEATURES
+
+
+def parse_args(
+    argv=None,
+):
+    # Checks the badges of every public key in a file, one per line or - for stdin, and stores the results
+    parser = argparse.ArgumentParser(description="Check the badges of many accounts")
+    parser.add_argument("keys", help="File with one public key per line, - reads stdin")
+    parser.add_argument("--store", default="badges.sqlite", help="SQLite file the results are written to")
+    parser.add_argument("--concurrency", type=int, default=8, help="Accounts loaded at the same time")
+    parser.add_argument("--time-budget", type=float, default=None, help="Seconds each account waits for its sources")
+    return parser.parse_args(argv)
+
+
+async def check(
+    public_keys,
+    concurrency,
+    time_budget,
+):
+    try:
+        return await BADGES_CONTEXT.check_many(
+            public_keys,
+            concurrency=concurrency,
+            time_budget=time_budget,
+        )
+    finally:
+        for context in (
+            OVERVIEW_CONTEXT,
+            EXTRINSICS_CONTEXT,
+            REWARDS_CONTEXT,
+            STATS_CONTEXT,
+            BADGES_CONTEXT,
+        ):
+            await context.subscan_actor.aclose()
+            await context.subsquid_actor.aclose()
+
+
+def main(
+    argv=None,
+):
+    args = parse_args(argv)
+    with sys.stdin if args.keys == "-" else open(args.keys) as keys_file:
+        public_keys = list(dict.fromkeys(line.strip() for line in keys_file if line.strip()))
+
+    started = time.perf_counter()
+    (
+        checked,
+        features,
+        missing,
+        earned,
+        unknown,
+    ) = asyncio.run(
+        check(
+            public_keys,
+            args.concurrency,
+            args.time_budget,
+        )
+    )
+    elapsed = time.perf_counter() - started
+    close_widget_store()
+
+    store = BadgeStore(
+        args.store,
+        FEATURES,
+        BADGE_RULES.names,
+    )
+    store.write(
+        checked,
+        features,
+        earned,
+        unknown,
+        missing,
+    )
+    store.close()
+
+    print(f"{len(checked)} of {len(public_keys)} accounts in {elapsed:.1f}s, {len(checked) / elapsed:.1f} accounts/sec")
+    for i, name in enumerate(BADGE_RULES.names):
+        print(f"{int(earned[:, i].sum()):>8} earned {int(unknown[:, i].sum()):>8} unknown  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from widgets.badge_rules import BadgeRules
+
+import numpy as np
+import pytest
+
+FEATURES = {
+    "extrinsics": np.int64,
+    "monthly_activity": (np.int64, (6,)),
+}
+RULES = [
+    ("Explorer", "Over 10 extrinsics", "extrinsics", ">", 10, None),
+    ("Emperor", "Over 200 extrinsics", "extrinsics", ">", 200, None),
+    ("Conductor", "Active 3 months in a row", "monthly_activity", ">", 0, "3M"),
+    ("Creator", "5 extrinsics in each of the last 2 months", "monthly_activity", ">=", 5, "last 2M"),
+]
+
+
+def test_thresholds_on_one_metric_are_compiled_into_one_group():
+    rules = BadgeRules(RULES, FEATURES)
+
+    assert len(rules.groups) == 3
+    assert rules.mask.tolist() == [[True, False], [True, False], [False, True], [False, True]]
+
+
+def test_rules_are_evaluated_for_every_account():
+    rules = BadgeRules(RULES, FEATURES)
+    features = np.zeros(3, dtype=list(FEATURES.items()))
+    features["extrinsics"] = [0, 50, 300]
+    features["monthly_activity"] = [
+        [1, 1, 0, 1, 1, 0],
+        [0, 2, 3, 4, 0, 0],
+        [0, 0, 0, 0, 5, 9],
+    ]
+
+    assert rules.evaluate(features).tolist() == [
+        [False, False, False, False],
+        [True, False, True, False],
+        [True, True, False, True],
+    ]
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        ("Unknown", "", "transfers", ">", 0, None),
+        ("Operator", "", "extrinsics", "!=", 0, None),
+        ("Scalar window", "", "extrinsics", ">", 0, "3M"),
+        ("Series without window", "", "monthly_activity", ">", 0, None),
+        ("Too long", "", "monthly_activity", ">", 0, "7M"),
+    ],
+)
+def test_invalid_rules_are_rejected(rule):
+    with pytest.raises(ValueError):
+        BadgeRules([rule], FEATURES)
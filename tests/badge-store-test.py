@@ -0,0 +1,55 @@
+from tools import badge_store
+from tools.badge_store import BadgeStore
+
+import numpy as np
+import sqlite3
+
+FEATURES = {
+    "sent": np.int64,
+    "identity": np.bool_,
+}
+BADGES = ["Join the party!", "Identity Pioneer"]
+
+
+def test_results_are_written_per_account_and_badge(tmp_path):
+    path = str(tmp_path / "badges.sqlite")
+    features = np.array([(3, True), (0, False)], dtype=list(FEATURES.items()))
+    store = BadgeStore(path, FEATURES, BADGES)
+    store.write(
+        ["a", "b"],
+        features,
+        np.array([[True, True], [False, False]]),
+        np.array([[False, False], [False, True]]),
+        np.array([[False, False], [False, True]]),
+    )
+
+    assert store.earned_counts() == {"Join the party!": 1, "Identity Pioneer": 1}
+    store.close()
+
+    connection = sqlite3.connect(path)
+    assert connection.execute("SELECT public_key, sent, identity FROM features ORDER BY public_key").fetchall() == [
+        ("a", 3, 1),
+        ("b", 0, None),
+    ]
+    assert connection.execute("SELECT status FROM badges WHERE public_key = 'b' ORDER BY badge").fetchall() == [
+        ("unknown",),
+        ("not_earned",),
+    ]
+
+
+def test_outdated_store_is_dropped(tmp_path, monkeypatch):
+    path = str(tmp_path / "badges.sqlite")
+    store = BadgeStore(path, FEATURES, BADGES)
+    store.write(
+        ["a"],
+        np.zeros(1, dtype=list(FEATURES.items())),
+        np.ones((1, 2), bool),
+        np.zeros((1, 2), bool),
+        np.zeros((1, 2), bool),
+    )
+    store.close()
+
+    monkeypatch.setattr(badge_store, "STORE_VERSION", badge_store.STORE_VERSION + 1)
+    store = BadgeStore(path, FEATURES, BADGES)
+    assert store.earned_counts() == {}
+    store.close()
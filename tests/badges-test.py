@@ -2,10 +2,18 @@ from fastapi.testclient import TestClient
 from api.api import app
 from .key import PUBLIC_KEY, BEARER_TOKEN, headers
 from unittest.mock import patch
+from datetime import date, timedelta
+from api.api import BADGES_CONTEXT, EXTRINSICS_CONTEXT, OVERVIEW_CONTEXT, REWARDS_CONTEXT, STATS_CONTEXT
+from api.api import OverviewType
+from widgets.badges import BADGE_RULES, FEATURE_DTYPE, SOURCES, BadgesType, badge_states, missing_features
+from tools.cache import LRUCache, WidgetCache
 
 client = TestClient(app)
 
+import asyncio
+import numpy as np
 import pytest
+import sqlite3
 
 
 def test_check_badges_successful_request():
@@ -42,3 +50,306 @@ def test_check_badges_with_unauthorized_user():
 
     # Check for unauthorized response
     assert response.status_code == 403
+
+
+def test_badges_are_evaluated_from_the_features():
+    features = np.zeros((), dtype=FEATURE_DTYPE)
+    features["sent"] = 120
+    features["received"] = 40
+    features["transfers"] = 160
+    features["pallets"] = 5
+
+    earned = {badge["name"] for badge in BADGES_CONTEXT.evaluate(features) if badge["success"]}
+    assert earned == {
+        "Join the party!",
+        "Is this gift for me?",
+        "Trailblazer!",
+        "Chatterbox Chieftain",
+        "Transfer Titan",
+    }
+
+
+def test_badges_of_timed_out_sources_are_unknown():
+    features = np.zeros((), dtype=FEATURE_DTYPE)
+    features["sent"] = 1
+
+    user_badges = {badge["name"]: badge for badge in BADGES_CONTEXT.evaluate(features, ["identity"])}
+    assert user_badges["Join the party!"]["status"] == "earned"
+    assert user_badges["Magnet Mogul"]["status"] == "not_earned"
+    assert user_badges["Webmaster"]["status"] == "unknown"
+    assert user_badges["Webmaster"]["success"] is None
+
+
+def test_many_accounts_are_evaluated_at_once():
+    features = np.zeros(3, dtype=FEATURE_DTYPE)
+    features["extrinsics"] = [0, 60, 250]
+
+    (
+        earned,
+        unknown,
+    ) = badge_states(features, missing_features([[], [], ["extrinsics"]]))
+    names = BADGE_RULES.names
+    assert earned[:, names.index("Extrinsics Enthusiast")].tolist() == [False, True, False]
+    assert unknown[:, names.index("Extrinsics Emperor")].tolist() == [False, False, True]
+
+
+async def fast_source(public_key, address):
+    return {}
+
+
+@pytest.mark.parametrize(
+    "values, growing, steady",
+    [
+        ([], True, True),
+        ([100], True, True),
+        ([100, 105, 108], True, True),
+        ([100, 150, 140], False, False),
+    ],
+)
+def test_balance_history_features(monkeypatch, values, growing, steady):
+    today = date.today()
+    balance_history = [
+        {"date": (today - timedelta(days=len(values) - i)).isoformat(), "value": str(value)}
+        for i, value in enumerate(values)
+    ]
+    # Older than three months, left out of both
+    balance_history.insert(0, {"date": (today - timedelta(days=200)).isoformat(), "value": "1000"})
+
+    async def history(public_key, address):
+        return balance_history
+
+    monkeypatch.setattr("widgets.badges.OVERVIEW_CONTEXT.balance_history", history)
+
+    features = asyncio.run(BADGES_CONTEXT._balance_history_features(PUBLIC_KEY, "address"))
+    assert features == {"balance_growing": growing, "balance_steady": steady}
+
+
+def test_overview_watermark_is_the_time_the_overview_was_written(monkeypatch):
+    cache = WidgetCache("overview", store=LRUCache(1024 * 1024), ttls={OverviewType.MULTI_CHAIN_IDENTITY: 3600})
+    monkeypatch.setattr(OVERVIEW_CONTEXT, "cache", cache)
+
+    def watermark():
+        return asyncio.run(BADGES_CONTEXT.watermark_sources["identity"](PUBLIC_KEY, "address"))
+
+    assert watermark() is None
+
+    cache.set(PUBLIC_KEY, OverviewType.MULTI_CHAIN_IDENTITY, [{"identity": True}])
+    first = watermark()
+    assert first == [cache.written_at(PUBLIC_KEY, OverviewType.MULTI_CHAIN_IDENTITY)]
+    assert watermark() == first
+
+    # A new identity is written by the overview, the badges see it with its next write
+    cache.set(PUBLIC_KEY, OverviewType.MULTI_CHAIN_IDENTITY, [{"identity": True, "web": True}])
+    assert watermark() != first
+
+    # Expired, the source has to be loaded again
+    cache.ttls[OverviewType.MULTI_CHAIN_IDENTITY] = -1
+    assert watermark() is None
+
+
+def test_overview_that_could_not_be_loaded_is_read_again_next_time(monkeypatch):
+    async def unavailable(public_key, address):
+        return None
+
+    async def fixed_watermark(public_key, address):
+        return ["fixed"]
+
+    monkeypatch.setattr(BADGES_CONTEXT, "cache", WidgetCache("badges", store=LRUCache(1024 * 1024)))
+    monkeypatch.setattr(OVERVIEW_CONTEXT, "identity", unavailable)
+    monkeypatch.setattr(
+        BADGES_CONTEXT,
+        "sources",
+        {name: BADGES_CONTEXT._identity_features if name == "identity" else fast_source for name in SOURCES},
+    )
+    monkeypatch.setattr(BADGES_CONTEXT, "watermark_sources", {name: fixed_watermark for name in SOURCES})
+
+    asyncio.run(BADGES_CONTEXT.check_badges(PUBLIC_KEY))
+
+    watermarks = BADGES_CONTEXT.cache.get(PUBLIC_KEY, BadgesType.WATERMARKS)
+    assert watermarks["identity"] is None
+    assert watermarks["transfers"] == ["fixed"]
+
+
+def test_only_sources_with_a_new_watermark_are_loaded_again(monkeypatch):
+    loads = []
+    sent = {"count": 1}
+
+    def source(name):
+        async def load(public_key, address):
+            loads.append(name)
+            return {"sent": sent["count"]} if name == "transfers" else {}
+
+        return load
+
+    async def transfer_watermark(public_key, address):
+        return [sent["count"]]
+
+    async def fixed_watermark(public_key, address):
+        return ["fixed"]
+
+    monkeypatch.setattr(BADGES_CONTEXT, "cache", WidgetCache("badges", store=LRUCache(1024 * 1024)))
+    monkeypatch.setattr(BADGES_CONTEXT, "sources", {name: source(name) for name in SOURCES})
+    monkeypatch.setattr(
+        BADGES_CONTEXT,
+        "watermark_sources",
+        {name: transfer_watermark if name == "transfers" else fixed_watermark for name in SOURCES},
+    )
+
+    (
+        first,
+        timed_out,
+    ) = asyncio.run(BADGES_CONTEXT.check_badges(PUBLIC_KEY))
+    assert sorted(loads) == sorted(SOURCES)
+
+    loads.clear()
+    (
+        second,
+        timed_out,
+    ) = asyncio.run(BADGES_CONTEXT.check_badges(PUBLIC_KEY))
+    assert loads == []
+    assert second == first
+
+    sent["count"] = 60
+    (
+        third,
+        timed_out,
+    ) = asyncio.run(BADGES_CONTEXT.check_badges(PUBLIC_KEY))
+    assert loads == ["transfers"]
+    assert {badge["name"]: badge["success"] for badge in third}["Chatterbox Chieftain"]
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    # Every source loads an entry of the account into each widget cache, like the real loads do
+    contexts = (
+        STATS_CONTEXT,
+        EXTRINSICS_CONTEXT,
+        REWARDS_CONTEXT,
+        OVERVIEW_CONTEXT,
+    )
+    for context in contexts:
+        monkeypatch.setattr(context, "cache", WidgetCache(context.cache.namespace, store=LRUCache(1024 * 1024)))
+
+    async def source(public_key, address):
+        for context in contexts:
+            context.cache.set(public_key, "loaded", True)
+        return {"sent": 60}
+
+    monkeypatch.setattr(BADGES_CONTEXT, "sources", {name: source for name in SOURCES})
+    return contexts
+
+
+def test_many_accounts_are_checked_without_keeping_their_loads(batch):
+    other_key = "0x" + "11" * 32
+    # Looked at by a user before the batch, it stays in memory
+    STATS_CONTEXT.cache.set(PUBLIC_KEY, "loaded", True)
+
+    (
+        checked,
+        features,
+        missing,
+        earned,
+        unknown,
+    ) = asyncio.run(BADGES_CONTEXT.check_many([PUBLIC_KEY, "invalid", other_key], concurrency=2))
+
+    assert checked == [PUBLIC_KEY, other_key]
+    assert features["sent"].tolist() == [60, 60]
+    assert not missing.any() and not unknown.any()
+    assert earned[:, BADGE_RULES.names.index("Chatterbox Chieftain")].tolist() == [True, True]
+
+    assert STATS_CONTEXT.cache.is_local(PUBLIC_KEY)
+    for context in batch:
+        assert not context.cache.is_local(other_key)
+        if context is not STATS_CONTEXT:
+            assert not context.cache.is_local(PUBLIC_KEY)
+
+
+def test_late_loads_of_a_batch_are_cancelled_before_the_next_account(batch, monkeypatch):
+    loading = {"now": 0, "most": 0, "cancelled": 0}
+
+    async def slow(public_key, address):
+        loading["now"] += 1
+        loading["most"] = max(loading["most"], loading["now"])
+        try:
+            await asyncio.sleep(10)
+            STATS_CONTEXT.cache.set(public_key, "loaded", True)
+        except asyncio.CancelledError:
+            loading["cancelled"] += 1
+            raise
+        finally:
+            loading["now"] -= 1
+        return {}
+
+    async def fast(public_key, address):
+        return {"sent": 60}
+
+    monkeypatch.setattr(BADGES_CONTEXT, "sources", {name: slow if name == "identity" else fast for name in SOURCES})
+    public_keys = ["0x" + f"{i:02x}" * 32 for i in range(1, 5)]
+
+    (
+        checked,
+        features,
+        missing,
+        earned,
+        unknown,
+    ) = asyncio.run(BADGES_CONTEXT.check_many(public_keys, concurrency=1, time_budget=0.05))
+
+    assert checked == public_keys
+    assert unknown[:, BADGE_RULES.names.index("Identity Pioneer")].all()
+    assert loading == {"now": 0, "most": 1, "cancelled": 4}
+    assert not BADGES_CONTEXT._late_loads
+    assert not any(STATS_CONTEXT.cache.is_local(public_key) for public_key in public_keys)
+
+
+def test_check_badges_script_stores_the_results(batch, tmp_path):
+    import check_badges
+
+    keys = tmp_path / "keys.txt"
+    keys.write_text(f"{PUBLIC_KEY}\n\n{PUBLIC_KEY}\ninvalid\n")
+    store = tmp_path / "badges.sqlite"
+
+    check_badges.main([str(keys), "--store", str(store), "--concurrency", "1"])
+
+    connection = sqlite3.connect(store)
+    assert connection.execute("SELECT public_key, sent FROM features").fetchall() == [(PUBLIC_KEY, 60)]
+    assert connection.execute(
+        "SELECT status FROM badges WHERE badge = 'Chatterbox Chieftain'",
+    ).fetchall() == [("earned",)]
+
+
+def test_stream_badges_invalid_public_key():
+    response = client.get("badges/stream?public_key=not_found_key", headers=headers)
+
+    # Check for not found response
+    assert response.status_code == 404
+
+
+def test_badges_are_streamed_as_their_sources_load(monkeypatch):
+    async def fast(public_key, address):
+        return {"sent": 60}
+
+    async def slow(public_key, address):
+        await asyncio.sleep(10)
+        return {}
+
+    monkeypatch.setattr(BADGES_CONTEXT, "cache", WidgetCache("badges", store=LRUCache(1024 * 1024)))
+    monkeypatch.setattr(BADGES_CONTEXT, "time_budget", 0.2)
+    monkeypatch.setattr(BADGES_CONTEXT, "sources", {name: slow if name == "identity" else fast for name in SOURCES})
+
+    async def watermark(public_key, address):
+        return ["fixed"]
+
+    monkeypatch.setattr(BADGES_CONTEXT, "watermark_sources", {name: watermark for name in SOURCES})
+
+    async def collect():
+        return [event async for event in BADGES_CONTEXT.stream_badges(PUBLIC_KEY)]
+
+    events = asyncio.run(collect())
+    badges = [data for event, data in events if event == "badge"]
+    assert len(badges) == len(BADGE_RULES)
+    assert events[-1] == ("done", {"timed_out": ["identity"]})
+    # Badges of the late source come last, once the time budget is spent
+    identity_badges = {"Identity Pioneer", "Webmaster", "TweetHeart", "Judgement Joker"}
+    assert {badge["name"] for badge in badges[-len(identity_badges) :]} == identity_badges
+    assert all(badge["status"] == "unknown" for badge in badges if badge["name"] in identity_badges)
+    assert {badge["name"]: badge["success"] for badge in badges}["Chatterbox Chieftain"]
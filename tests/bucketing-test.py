@@ -0,0 +1,56 @@
+from tools import bucketing
+
+import numpy as np
+
+DAYS = np.array(["2023-01-30", "2023-01-31", "2023-02-06", "2023-03-01"], dtype="datetime64[D]")
+COUNTS = np.array([1, 2, 3, 4])
+
+
+def test_weeks_end_on_monday():
+    (
+        labels,
+        totals,
+    ) = bucketing.resample(DAYS, COUNTS, bucketing.WEEK)
+
+    assert bucketing.format_labels(labels) == [
+        "2023-01-30",
+        "2023-02-06",
+        "2023-02-13",
+        "2023-02-20",
+        "2023-02-27",
+        "2023-03-06",
+    ]
+    assert totals.tolist() == [1, 5, 0, 0, 0, 4]
+
+
+def test_months_and_years_end_on_their_last_day():
+    (
+        labels,
+        totals,
+    ) = bucketing.resample(DAYS, COUNTS, bucketing.MONTH)
+    assert bucketing.format_labels(labels) == ["2023-01-31", "2023-02-28", "2023-03-31"]
+    assert totals.tolist() == [3, 3, 4]
+
+    (
+        labels,
+        totals,
+    ) = bucketing.resample(DAYS, COUNTS, bucketing.YEAR)
+    assert bucketing.format_labels(labels, bucketing.YEAR) == ["2023"]
+    assert totals.tolist() == [10]
+
+
+def test_end_keeps_only_closed_buckets():
+    # Like a reindex up to the end day: the running week and month are left out
+    (
+        labels,
+        totals,
+    ) = bucketing.resample(DAYS, COUNTS, bucketing.WEEK, end=np.datetime64("2023-02-08"))
+    assert bucketing.format_labels(labels) == ["2023-01-30", "2023-02-06"]
+    assert totals.tolist() == [1, 5]
+
+    (
+        labels,
+        totals,
+    ) = bucketing.resample(DAYS, COUNTS, bucketing.DAY, end=np.datetime64("2023-03-03"))
+    assert len(labels) == 33
+    assert totals[-3:].tolist() == [4, 0, 0]
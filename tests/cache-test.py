@@ -0,0 +1,96 @@
+from tools.cache import CacheBackend, LRUCache, WidgetCache, estimate_size
+
+import asyncio
+import pytest
+
+
+def test_estimate_size_grows_with_content():
+    small = [{"id": str(i), "amount": i} for i in range(10)]
+    large = [{"id": str(i), "amount": i} for i in range(10000)]
+
+    assert estimate_size(small) > 0
+    assert estimate_size(large) > 500 * estimate_size(small) / 10
+
+
+def test_lru_evicts_least_recently_used():
+    store = LRUCache(max_bytes=1024 * 1024)
+    cache = WidgetCache("test", store=store)
+
+    cache.set("a", "data", "x" * 1000)
+    store.max_bytes = 3 * store.stats()["current_bytes"]
+    cache.set("b", "data", "x" * 1000)
+    assert cache.contains("a", "data")
+    cache.set("c", "data", "x" * 1000)
+    cache.set("d", "data", "x" * 1000)
+
+    assert cache.contains("a", "data")
+    assert not cache.contains("b", "data")
+    assert store.stats()["evictions"] >= 1
+    assert store.stats()["current_bytes"] <= store.max_bytes
+
+
+def test_backend_without_every_operation_cannot_be_created():
+    class ReadOnly(CacheBackend):
+        def get(self, key):
+            return None
+
+        def peek(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnly()
+
+
+def test_lru_keeps_pinned_entries():
+    store = LRUCache(max_bytes=1)
+    cache = WidgetCache("test", store=store)
+
+    async def load():
+        async with cache.lock("a"):
+            cache.set("a", "data", "x" * 1000)
+            cache.set("b", "data", "x" * 1000)
+            assert cache.get("a", "data") is not None
+
+    asyncio.run(load())
+    cache.set("c", "data", "x" * 1000)
+
+    assert cache.get("a", "data") is None
+    assert cache.get("c", "data") is not None
+    assert store.stats()["pinned"] == 0
+
+
+def test_widget_namespaces_do_not_collide():
+    store = LRUCache(max_bytes=1024 * 1024)
+    stats = WidgetCache("stats", store=store)
+    rewards = WidgetCache("rewards", store=store)
+
+    stats.set("a", "TOTAL", 1)
+    rewards.set("a", "TOTAL", 2)
+
+    assert stats.get("a", "TOTAL") == 1
+    assert rewards.get("a", "TOTAL") == 2
+
+
+def test_stale_value_is_served_while_one_refresh_runs():
+    cache = WidgetCache("test", store=LRUCache(max_bytes=1024 * 1024), default_ttl=0)
+    refreshes = []
+
+    async def refresh():
+        refreshes.append(1)
+        await asyncio.sleep(0.01)
+        cache.set("a", "data", "new")
+
+    async def read():
+        cache.set("a", "data", "old")
+        await asyncio.sleep(0.01)
+        values = []
+        for _ in range(3):
+            assert cache.is_stale("a", "data")
+            cache.revalidate("a", refresh)
+            values.append(cache.get("a", "data"))
+        await asyncio.sleep(0.05)
+        return values
+
+    assert asyncio.run(read()) == ["old", "old", "old"]
+    assert len(refreshes) == 1
+    assert cache.get("a", "data") == "new"
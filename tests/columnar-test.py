@@ -0,0 +1,188 @@
+from tools.codec import pack, unpack
+from tools.columnar import CodeTotals, DailyRollup, Dictionary, join_u128, parse_timestamps, split_u128, u128_limbs
+from widgets.extrinsics import ExtrinsicsColumns, call_group
+from widgets.rewards import RewardsColumns
+
+import numpy as np
+
+
+def extrinsic(i, pallet="Balances", call="transfer", success=True):
+    return {
+        "id": f"{i:010d}-000002-aaaaa",
+        "success": success,
+        "timestamp": f"2023-01-{1 + i // 3:02d}T0{i % 3}:00:00.000000Z",
+        "mainCall": {"callName": call, "palletName": pallet},
+    }
+
+
+def test_parse_timestamps():
+    timestamps = parse_timestamps(["1970-01-02T00:00:00.000000Z", "1970-01-01T00:00:00.123Z"])
+
+    assert timestamps.dtype == np.int64
+    assert timestamps.tolist() == [24 * 3600 * 1000, 123]
+
+
+def test_dictionary_reuses_codes():
+    dictionary = Dictionary()
+
+    assert dictionary.encode(["a", "b", "a"]).tolist() == [0, 1, 0]
+    assert dictionary.encode(["b", "c"]).tolist() == [1, 2]
+    assert dictionary.code("missing") == -1
+
+
+def test_daily_rollup_adds_and_removes_rows():
+    rollup = DailyRollup(("count", "amount"))
+    timestamps = parse_timestamps([extrinsic(i)["timestamp"] for i in range(7)])
+
+    rollup.add(timestamps, count=np.ones(7), amount=np.arange(7), groups=np.array([0, 0, 0, 0, 0, 0, 1]))
+    (
+        days,
+        counts,
+    ) = rollup.series("count")
+    assert days.astype(str).tolist() == ["2023-01-01", "2023-01-02"]
+    assert counts.tolist() == [3, 3]
+    assert rollup.series("amount", group=1)[1].tolist() == [6]
+
+    rollup.add(timestamps[:3], sign=-1, count=np.ones(3), amount=np.arange(3))
+    assert rollup.series("count")[0].astype(str).tolist() == ["2023-01-02"]
+    assert unpack(pack(rollup)).series("amount")[1].tolist() == [12]
+
+
+def test_u128_sums_are_exact():
+    amounts = [2**127 + 1, 2**64 - 1, 2**64, 1, 10**30]
+    codes = np.array([0, 1, 1, 0, 2])
+
+    (
+        hi,
+        lo,
+    ) = split_u128([str(amount) for amount in amounts])
+    limbs = {f"amount_{i}": limb for i, limb in enumerate(u128_limbs(hi, lo))}
+    totals = CodeTotals({name: np.uint64 for name in limbs})
+    totals.add(codes, np.arange(5), **limbs)
+
+    assert totals.keys.tolist() == [0, 1, 2]
+    assert join_u128([totals.totals[name] for name in limbs]).tolist() == [2**127 + 2, 2**65 - 1, 10**30]
+
+
+def test_code_totals_take_rows_out_again():
+    totals = CodeTotals({"count": np.int64})
+    totals.add(np.array([3, 1, 3, 2]), np.array([10, 20, 30, 40]), count=np.ones(4))
+    totals.add(np.array([1, 3]), np.array([10, 20]), sign=-1, count=np.ones(2))
+
+    assert totals.keys.tolist() == [2, 3]
+    assert totals.totals["count"].tolist() == [1, 1]
+    # Equal counts, the most recently seen code first
+    assert totals.top(totals.totals["count"], 5) == [0, 1]
+    assert unpack(pack(totals)).top(totals.totals["count"], 1) == [0]
+
+
+def test_extrinsics_distribution_and_drop():
+    table = ExtrinsicsColumns()
+    table.extend(
+        [
+            extrinsic(0, "Staking", "bond"),
+            extrinsic(1, "Balances", "transfer"),
+            extrinsic(2, "Balances", "transfer_keep_alive", success=False),
+            extrinsic(3, "Balances", "transfer_keep_alive"),
+        ]
+    )
+
+    calls = CodeTotals({"count": np.int64})
+    table.count_into(calls)
+
+    assert table.distribution(calls) == {
+        "pallets": {"Balances": 3, "Staking": 1},
+        "calls": {"Balances": {"transfer_keep_alive": 2, "transfer": 1}, "Staking": {"bond": 1}},
+    }
+    assert np.count_nonzero(table.success) == 3
+
+    table.drop_head(1).count_into(calls, sign=-1)
+    assert len(table) == 3
+    assert table.distribution(calls)["pallets"] == {"Balances": 3}
+
+
+def test_call_series_per_pallet():
+    table = ExtrinsicsColumns()
+    table.extend(
+        [
+            extrinsic(0, "ElectionsPhragmen", "vote"),
+            extrinsic(1, "PhragmenElection", "vote"),
+            extrinsic(4, "PhragmenElection", "vote"),
+            extrinsic(5, "Balances", "transfer"),
+        ]
+    )
+    daily_activity = DailyRollup(("count", "success"))
+    table.roll_up(daily_activity)
+
+    vote = table.calls.code("vote")
+    one_pallet = call_group(table.pallets.code("PhragmenElection"), vote)
+    both_pallets = [
+        call_group(table.pallets.code(pallet), vote) for pallet in ("ElectionsPhragmen", "PhragmenElection")
+    ]
+
+    assert daily_activity.series("count", one_pallet)[1].tolist() == [1, 1]
+    (
+        days,
+        counts,
+    ) = daily_activity.series("count", both_pallets)
+    assert days.astype(str).tolist() == ["2023-01-01", "2023-01-02"]
+    assert counts.tolist() == [2, 1]
+    assert daily_activity.series("count", [])[1].tolist() == []
+
+
+def test_columns_codec_roundtrip():
+    table = ExtrinsicsColumns()
+    table.extend([extrinsic(i, call=f"call_{i % 4}", success=i % 2 == 0) for i in range(90)])
+
+    calls = CodeTotals({"count": np.int64})
+    table.count_into(calls)
+
+    entry = unpack(pack({"rows": table, "calls": calls}))
+    decoded = entry["rows"]
+
+    assert isinstance(decoded, ExtrinsicsColumns)
+    assert (decoded.timestamp == table.timestamp).all()
+    assert (decoded.success == table.success).all()
+    assert decoded.distribution(entry["calls"]) == table.distribution(calls)
+    # The decoded table keeps growing with the same codes
+    decoded.extend([extrinsic(0, call="call_1")])
+    assert decoded.call[-1] == table.calls.code("call_1")
+
+
+def test_rewards_totals_in_planck():
+    table = RewardsColumns()
+    table.extend(
+        [
+            {
+                "id": "1",
+                "timestamp": "2023-01-01T00:00:00.000000Z",
+                "amount": "15000000000",
+                "validatorId": "a",
+                "era": 1,
+            },
+            {
+                "id": "2",
+                "timestamp": "2023-01-02T00:00:00.000000Z",
+                "amount": "5000000000",
+                "validatorId": "b",
+                "era": 2,
+            },
+            {
+                "id": "3",
+                "timestamp": "2023-01-02T00:00:00.000000Z",
+                "amount": "10000000000",
+                "validatorId": "a",
+                "era": 3,
+            },
+        ]
+    )
+
+    validators = CodeTotals({"count": np.int64, "amount": np.int64})
+    table.count_into(validators)
+
+    assert validators.keys.tolist() == [table.validators.code("a"), table.validators.code("b")]
+    assert validators.totals["count"].tolist() == [2, 1]
+    assert validators.totals["amount"].tolist() == [25000000000, 5000000000]
+
+    table.drop_head(1).count_into(validators, sign=-1)
+    assert validators.totals["amount"].tolist() == [10000000000, 5000000000]
@@ -0,0 +1,25 @@
+from tools.cache import LRUCache, WidgetCache
+from .fake_subsquid import FakeSubSquid
+
+import pytest
+
+
+@pytest.fixture
+def widget(monkeypatch):
+    monkeypatch.setenv("SUBSCAN_API_KEY", "test")
+
+    def make(cls, rows, page_size=None):
+        # A history widget over the given indexer rows with a cache of its own, in smaller pages if given
+        widget = cls()
+        widget.cache = WidgetCache(
+            widget.cache.namespace,
+            store=LRUCache(64 * 1024 * 1024),
+            ttls=widget.cache.ttls,
+            default_ttl=widget.cache.default_ttl,
+        )
+        widget.subsquid_actor = FakeSubSquid(rows)
+        if page_size is not None:
+            widget.page_size = page_size
+        return widget
+
+    return make
@@ -0,0 +1,98 @@
+from widgets.extrinsics import Extrinsics, ExtrinsicsType
+
+import asyncio
+
+PUBLIC_KEY = "0x" + "ab" * 32
+# Pages of 4 and a cap of 12 extrinsics
+PAGE_SIZE = 4
+CALLS = [
+    ("Balances", "transfer"),
+    ("Staking", "bond"),
+    ("Utility", "batch"),
+    ("Staking", "transfer"),
+]
+
+
+def extrinsic(i):
+    (
+        pallet,
+        call,
+    ) = CALLS[i % len(CALLS)]
+    return {
+        "id": f"{i:010d}-000002-aaaaa",
+        "success": i % 5 != 0,
+        "timestamp": f"2023-01-{1 + i // 3:02d}T0{i % 3}:00:00.000000Z",
+        "mainCall": {"callName": call, "palletName": pallet},
+    }
+
+
+async def snapshot(extrinsics):
+    table = await extrinsics.extrinsics(PUBLIC_KEY)
+    return {
+        "rows": list(
+            zip(
+                table.timestamp.tolist(),
+                table.success.tolist(),
+                table.pallets.decode(table.pallet),
+                table.calls.decode(table.call),
+            )
+        ),
+        "distribution": await extrinsics.distribution(PUBLIC_KEY),
+        "activity": [values.tolist() for values in await extrinsics.activity(PUBLIC_KEY)],
+        "call_activity": [values.tolist() for values in await extrinsics.activity(PUBLIC_KEY, call_name="transfer")],
+        "success_count": await extrinsics.success_count(PUBLIC_KEY),
+        "recent": await extrinsics.recent_extrinsics(PUBLIC_KEY),
+        "total": await extrinsics.total_extrinsics(PUBLIC_KEY),
+        "cursor": extrinsics.cache.get(PUBLIC_KEY, ExtrinsicsType.CURSOR),
+    }
+
+
+def refreshed(extrinsics, count):
+    # Extrinsics up to count arrive upstream and the cached account is refreshed
+    extrinsics.subsquid_actor.rows = [extrinsic(i) for i in range(count)]
+    asyncio.run(extrinsics.refresh(PUBLIC_KEY))
+    return asyncio.run(snapshot(extrinsics))
+
+
+def test_cold_load_keeps_every_extrinsic(widget):
+    cold = asyncio.run(snapshot(widget(Extrinsics, [extrinsic(i) for i in range(7)], page_size=PAGE_SIZE)))
+
+    assert len(cold["rows"]) == 7
+    assert cold["total"] == {"total_count": 7}
+    assert cold["success_count"] == {"success": 5, "total": 7}
+    assert cold["distribution"]["pallets"] == {"Balances": 2, "Staking": 3, "Utility": 2}
+    assert [row["id"] for row in cold["recent"]] == [extrinsic(i)["id"] for i in reversed(range(7))]
+    assert cold["cursor"] == {"id": extrinsic(6)["id"], "timestamp": extrinsic(6)["timestamp"]}
+
+
+def test_refresh_merges_new_extrinsics_after_the_cursor(widget):
+    extrinsics = widget(Extrinsics, [extrinsic(i) for i in range(5)], page_size=PAGE_SIZE)
+    asyncio.run(snapshot(extrinsics))
+    pages = extrinsics.subsquid_actor.pages
+
+    assert refreshed(extrinsics, 9) == asyncio.run(
+        snapshot(widget(Extrinsics, [extrinsic(i) for i in range(9)], page_size=PAGE_SIZE))
+    )
+    # Only the page after the cursor was fetched
+    assert extrinsics.subsquid_actor.pages == pages + 1
+
+
+def test_refresh_without_new_extrinsics_changes_nothing(widget):
+    extrinsics = widget(Extrinsics, [extrinsic(i) for i in range(5)], page_size=PAGE_SIZE)
+    cold = asyncio.run(snapshot(extrinsics))
+
+    assert refreshed(extrinsics, 5) == cold
+
+
+def test_refresh_past_the_cap_drops_the_oldest_extrinsics(widget):
+    extrinsics = widget(Extrinsics, [extrinsic(i) for i in range(10)], page_size=PAGE_SIZE)
+    asyncio.run(snapshot(extrinsics))
+
+    capped = refreshed(extrinsics, 17)
+    assert len(capped["rows"]) == 12
+    assert capped["total"] == {"total_count": 17}
+    assert capped == asyncio.run(snapshot(widget(Extrinsics, [extrinsic(i) for i in range(17)], page_size=PAGE_SIZE)))
+
+    assert refreshed(extrinsics, 28) == asyncio.run(
+        snapshot(widget(Extrinsics, [extrinsic(i) for i in range(28)], page_size=PAGE_SIZE))
+    )
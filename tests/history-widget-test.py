@@ -0,0 +1,177 @@
+from widgets.extrinsics import Extrinsics, ExtrinsicsType
+from widgets.history_widget import HistoryWidget
+from widgets.rewards import Rewards, RewardsType
+from datetime import datetime, timedelta, timezone
+
+import asyncio
+import pytest
+
+PUBLIC_KEY = "0x" + "ab" * 32
+
+
+def extrinsic(i):
+    return {
+        "id": f"{i:010d}-000002-aaaaa",
+        "success": True,
+        "timestamp": f"2023-01-{1 + i // 3:02d}T0{i % 3}:00:00.000000Z",
+        "mainCall": {"callName": "transfer", "palletName": "Balances"},
+    }
+
+
+def reward(i):
+    return {
+        "id": f"{i:010d}-000003-ccccc",
+        "timestamp": f"2023-03-{1 + i // 4:02d}T0{i % 4}:00:00.000000Z",
+        "amount": str(10**10),
+        "validatorId": "validator",
+        "era": 1000 + i,
+    }
+
+
+async def revalidated(widget):
+    # Waits for the background refreshes started by stale reads
+    await asyncio.gather(*list(widget.cache._revalidating.values()))
+
+
+def test_widget_without_its_row_mapping_cannot_be_created():
+    class WithoutCursor(Extrinsics):
+        _cursor = HistoryWidget._cursor
+
+    with pytest.raises(TypeError):
+        WithoutCursor()
+
+
+def test_metric_is_served_without_loading_the_history(widget):
+    extrinsics = widget(Extrinsics, [extrinsic(i) for i in range(7)])
+
+    assert asyncio.run(extrinsics.total_extrinsics(PUBLIC_KEY)) == {"total_count": 7}
+    assert extrinsics.subsquid_actor.queries == 1
+    assert extrinsics.subsquid_actor.pages == 0
+    assert not extrinsics.cache.contains(PUBLIC_KEY, ExtrinsicsType.CURSOR)
+
+
+def test_concurrent_metric_requests_share_one_query(widget):
+    extrinsics = widget(Extrinsics, [extrinsic(i) for i in range(7)])
+
+    async def requests():
+        return await asyncio.gather(*(extrinsics.total_extrinsics(PUBLIC_KEY) for _ in range(5)))
+
+    assert asyncio.run(requests()) == [{"total_count": 7}] * 5
+    assert extrinsics.subsquid_actor.queries == 1
+
+
+def test_stale_metric_without_history_is_queried_again(widget):
+    extrinsics = widget(Extrinsics, [extrinsic(i) for i in range(7)])
+    extrinsics.cache.ttls[ExtrinsicsType.TOTAL_EXTRINSICS] = -1
+
+    async def stale_read():
+        await extrinsics.total_extrinsics(PUBLIC_KEY)
+        extrinsics.subsquid_actor.rows.append(extrinsic(7))
+        # The stale value is served while it is revalidated
+        stale = await extrinsics.total_extrinsics(PUBLIC_KEY)
+        await revalidated(extrinsics)
+        return stale, await extrinsics.total_extrinsics(PUBLIC_KEY)
+
+    (
+        stale,
+        current,
+    ) = asyncio.run(stale_read())
+    assert stale == {"total_count": 7}
+    assert current == {"total_count": 8}
+    assert extrinsics.subsquid_actor.pages == 0
+
+
+def test_metric_follows_the_refresh_once_the_history_is_cached(widget):
+    extrinsics = widget(Extrinsics, [extrinsic(i) for i in range(7)])
+    extrinsics.cache.ttls[ExtrinsicsType.TOTAL_EXTRINSICS] = -1
+
+    async def stale_read():
+        await extrinsics.extrinsics(PUBLIC_KEY)
+        extrinsics.subsquid_actor.rows.extend(extrinsic(i) for i in range(7, 10))
+        await extrinsics.total_extrinsics(PUBLIC_KEY)
+        await revalidated(extrinsics)
+        return await extrinsics.total_extrinsics(PUBLIC_KEY)
+
+    assert asyncio.run(stale_read()) == {"total_count": 10}
+    # Counted from the merged rows, not queried
+    assert extrinsics.subsquid_actor.queries == 0
+    assert len(extrinsics.cache.get(PUBLIC_KEY, ExtrinsicsType.EXTRINSICS)) == 10
+
+
+def test_last_era_is_queried_alone_and_then_taken_from_the_cursor(widget):
+    rewards = widget(Rewards, [reward(i) for i in range(5)])
+
+    assert asyncio.run(rewards.last_era(PUBLIC_KEY)) == 1004
+    assert rewards.subsquid_actor.pages == 0
+
+    rewards.subsquid_actor.rows.append(reward(5))
+    asyncio.run(rewards.rewards(PUBLIC_KEY))
+    assert asyncio.run(rewards.last_era(PUBLIC_KEY)) == 1005
+    assert rewards.cache.get(PUBLIC_KEY, RewardsType.CURSOR)["era"] == 1005
+
+
+def test_last_era_of_a_cached_history_is_served_without_upstream_requests(widget):
+    rewards = widget(Rewards, [reward(i) for i in range(5)])
+    asyncio.run(rewards.rewards(PUBLIC_KEY))
+    (
+        pages,
+        queries,
+    ) = (
+        rewards.subsquid_actor.pages,
+        rewards.subsquid_actor.queries,
+    )
+
+    assert asyncio.run(rewards.last_era(PUBLIC_KEY)) == 1004
+    assert asyncio.run(rewards.last_era(PUBLIC_KEY)) == 1004
+    assert rewards.subsquid_actor.pages == pages
+    assert rewards.subsquid_actor.queries == queries
+    assert not rewards.cache._revalidating
+
+
+def test_stale_last_era_is_refreshed_in_the_background(widget):
+    rewards = widget(Rewards, [reward(i) for i in range(5)])
+    rewards.cache.default_ttl = -1
+
+    async def stale_read():
+        await rewards.rewards(PUBLIC_KEY)
+        rewards.subsquid_actor.rows.append(reward(5))
+        stale = await rewards.last_era(PUBLIC_KEY)
+        await revalidated(rewards)
+        return stale, await rewards.last_era(PUBLIC_KEY)
+
+    assert asyncio.run(stale_read())[0] == 1004
+    assert rewards.cache.get(PUBLIC_KEY, RewardsType.CURSOR)["era"] == 1005
+
+
+def recent_extrinsic(i, days_ago):
+    timestamp = datetime.now(timezone.utc) - timedelta(days=days_ago)
+    return {
+        **extrinsic(i),
+        "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%S.000000Z"),
+    }
+
+
+def test_weekly_transaction_rate_is_counted_upstream_without_the_history(widget):
+    extrinsics = widget(Extrinsics, [recent_extrinsic(i, days_ago) for i, days_ago in enumerate((30, 8, 6, 1))])
+
+    assert asyncio.run(extrinsics.weekly_transaction_rate(PUBLIC_KEY)) == {"last_week_transaction_count": 2}
+    assert extrinsics.subsquid_actor.queries == 1
+    assert extrinsics.subsquid_actor.pages == 0
+
+
+def test_weekly_transaction_rate_of_a_cached_history_follows_its_refresh(widget):
+    extrinsics = widget(Extrinsics, [recent_extrinsic(i, days_ago) for i, days_ago in enumerate((30, 8, 6))])
+    extrinsics.cache.ttls[ExtrinsicsType.WEEKLY_TRANSACTION_RATE] = -1
+
+    async def stale_read():
+        await extrinsics.extrinsics(PUBLIC_KEY)
+        extrinsics.subsquid_actor.rows.append(recent_extrinsic(3, 1))
+        stale = await extrinsics.weekly_transaction_rate(PUBLIC_KEY)
+        await revalidated(extrinsics)
+        return stale, await extrinsics.weekly_transaction_rate(PUBLIC_KEY)
+
+    assert asyncio.run(stale_read()) == (
+        {"last_week_transaction_count": 1},
+        {"last_week_transaction_count": 2},
+    )
+    assert extrinsics.subsquid_actor.queries == 0
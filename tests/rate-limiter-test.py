@@ -0,0 +1,104 @@
+from tools.rate_limiter import TokenBucket
+
+import asyncio
+import pytest
+import time
+
+
+def timed(coroutine):
+    started = time.monotonic()
+    result = asyncio.run(coroutine)
+    return result, time.monotonic() - started
+
+
+def test_burst_goes_through_without_waiting():
+    bucket = TokenBucket("burst", rate=10, burst=3)
+
+    async def acquire_burst():
+        for _ in range(3):
+            await bucket.acquire()
+
+    (
+        _,
+        elapsed,
+    ) = timed(acquire_burst())
+    assert elapsed < 0.05
+    assert bucket.stats()["acquired"] == 3
+    assert bucket.stats()["throttled"] == 0
+
+
+def test_callers_beyond_the_burst_queue_in_turn():
+    bucket = TokenBucket("queue", rate=50, burst=1)
+    finished = []
+
+    async def caller(i):
+        await bucket.acquire()
+        finished.append(i)
+
+    async def callers():
+        await asyncio.gather(*(caller(i) for i in range(5)))
+
+    (
+        _,
+        elapsed,
+    ) = timed(callers())
+    # One token every 20ms after the first
+    assert elapsed >= 0.08
+    assert finished == [0, 1, 2, 3, 4]
+
+    stats = bucket.stats()
+    assert stats["acquired"] == 5
+    assert stats["throttled"] == 4
+    assert stats["max_queue_depth"] == 4
+    assert stats["queue_depth"] == 0
+    assert stats["max_wait"] == pytest.approx(0.08, abs=0.01)
+    assert stats["total_wait"] == pytest.approx(0.02 + 0.04 + 0.06 + 0.08, abs=0.02)
+    assert stats["avg_wait"] == pytest.approx(stats["total_wait"] / 4, abs=0.001)
+
+
+def test_defer_holds_callers_that_come_after_it():
+    bucket = TokenBucket("defer", rate=100, burst=5)
+    bucket.defer(0.2)
+
+    (
+        _,
+        elapsed,
+    ) = timed(bucket.acquire())
+    assert elapsed >= 0.2
+    assert bucket.stats()["deferred"] == 1
+
+
+def test_defer_holds_callers_already_waiting():
+    bucket = TokenBucket("defer-queued", rate=100, burst=1)
+
+    async def deferred_while_waiting():
+        await bucket.acquire()
+        # Queued for 10ms when upstream asks for a longer pause
+        waiting = asyncio.ensure_future(bucket.acquire())
+        await asyncio.sleep(0)
+        bucket.defer(0.2)
+        started = time.monotonic()
+        await waiting
+        return time.monotonic() - started
+
+    held, _ = timed(deferred_while_waiting())
+    assert held >= 0.19
+    stats = bucket.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["max_wait"] >= 0.19
+
+
+def test_cancelled_caller_leaves_the_queue():
+    bucket = TokenBucket("cancel", rate=10, burst=1)
+
+    async def cancelled():
+        await bucket.acquire()
+        waiting = asyncio.ensure_future(bucket.acquire())
+        await asyncio.sleep(0)
+        assert bucket.stats()["queue_depth"] == 1
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(cancelled())
+    assert bucket.stats()["queue_depth"] == 0
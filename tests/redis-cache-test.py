@@ -0,0 +1,161 @@
+from tools.cache import LRUCache, WidgetCache
+from tools.codec import SCHEMA_VERSION, pack, unpack, register_enum
+from tools.redis_cache import RedisBackend
+from enum import Enum
+
+import asyncio
+import fakeredis
+import threading
+import time
+import pytest
+
+
+@register_enum
+class ExampleType(Enum):
+    TOTAL = "TOTAL"
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def workers():
+    # Two workers of one deployment sharing one Redis
+    server = fakeredis.FakeServer()
+    backends = [
+        RedisBackend(
+            fakeredis.FakeRedis(server=server),
+            local=LRUCache(max_bytes=1024 * 1024),
+        )
+        for _ in range(2)
+    ]
+    yield backends
+    for backend in backends:
+        backend.close()
+
+
+def test_codec_roundtrip():
+    value = {
+        ExampleType.TOTAL: {"amount": 2**100, "rows": [{"id": "1"}] * 1000},
+        "days": {"2023-01-01": [1, 0]},
+    }
+
+    assert unpack(pack(value)) == value
+    assert len(pack(value)) < len(pack({"rows": "x"}) * 1000)
+
+
+def test_invalidations_go_over_a_channel_of_the_prefix(workers):
+    assert workers[0].channel == f"dotly:widget:v{SCHEMA_VERSION}:invalidate"
+    assert wait_for(lambda: workers[0].channel.encode() in workers[0].client.pubsub_channels())
+
+    backend = RedisBackend(
+        fakeredis.FakeRedis(),
+        local=LRUCache(max_bytes=1024 * 1024),
+        prefix="staging",
+    )
+    try:
+        assert backend.channel == "staging:invalidate"
+    finally:
+        backend.close()
+
+
+def test_worker_reads_entry_stored_by_another_worker(workers):
+    first = WidgetCache("stats", store=workers[0])
+    second = WidgetCache("stats", store=workers[1])
+
+    first.set("a", ExampleType.TOTAL, {"total_count": 3})
+    workers[0].flush()
+
+    assert second.get("a", ExampleType.TOTAL) == {"total_count": 3}
+    assert workers[1].stats()["redis_hits"] == 1
+
+
+def test_write_invalidates_other_workers(workers):
+    first = WidgetCache("stats", store=workers[0])
+    second = WidgetCache("stats", store=workers[1])
+
+    first.set("a", ExampleType.TOTAL, 1)
+    workers[0].flush()
+    assert second.get("a", ExampleType.TOTAL) == 1
+
+    first.set("a", ExampleType.TOTAL, 2)
+    workers[0].flush()
+
+    assert wait_for(lambda: workers[1].stats()["redis_invalidations_received"] >= 2)
+    assert second.get("a", ExampleType.TOTAL) == 2
+
+
+def test_pinned_entry_is_written_once_unpinned(workers):
+    first = WidgetCache("stats", store=workers[0])
+
+    first.pin("a")
+    first.set("a", ExampleType.TOTAL, 1)
+    first.set("a", "other", 2)
+    workers[0].flush()
+    assert workers[0].stats()["redis_writes"] == 0
+
+    first.unpin("a")
+    workers[0].flush()
+    assert workers[0].stats()["redis_writes"] == 1
+
+
+def test_missing_entry_is_looked_up_once(workers):
+    cache = WidgetCache("stats", store=workers[0])
+
+    assert not cache.contains("a", ExampleType.TOTAL)
+    assert cache.get("a", ExampleType.TOTAL) is None
+    assert not cache.contains("a", ExampleType.TOTAL)
+    stats = workers[0].stats()
+    assert stats["redis_misses"] == 1
+    assert stats["redis_absent_hits"] == 2
+
+    # Once written here, it is read from Redis again after the local copy is gone
+    cache.set("a", ExampleType.TOTAL, 1)
+    workers[0].flush()
+    cache.release("a")
+    assert cache.get("a", ExampleType.TOTAL) == 1
+    assert workers[0].stats()["redis_hits"] == 1
+
+
+def test_entry_written_by_another_worker_is_found_after_a_miss(workers):
+    first = WidgetCache("stats", store=workers[0])
+    second = WidgetCache("stats", store=workers[1])
+
+    assert second.get("a", ExampleType.TOTAL) is None
+    first.set("a", ExampleType.TOTAL, 1)
+    workers[0].flush()
+
+    assert wait_for(lambda: workers[1].stats()["redis_invalidations_received"] >= 1)
+    assert second.get("a", ExampleType.TOTAL) == 1
+
+
+def test_load_reads_the_shared_tier_off_the_event_loop(workers):
+    first = WidgetCache("stats", store=workers[0])
+    second = WidgetCache("stats", store=workers[1])
+    first.set("a", ExampleType.TOTAL, 1)
+    workers[0].flush()
+
+    threads = []
+    read = workers[1]._read
+
+    def record(key):
+        threads.append(threading.current_thread())
+        return read(key)
+
+    workers[1]._read = record
+
+    async def request():
+        await second.load("a")
+        return second.get("a", ExampleType.TOTAL)
+
+    assert asyncio.run(request()) == 1
+    assert len(threads) == 1
+    assert threads[0] is not threading.main_thread()
+
+    # Already local, nothing to read
+    asyncio.run(second.load("a"))
+    assert len(threads) == 1
@@ -0,0 +1,95 @@
+from widgets.rewards import Rewards, RewardsType
+
+import asyncio
+
+PUBLIC_KEY = "0x" + "ab" * 32
+# Pages of 4 and a cap of 12 rewards
+PAGE_SIZE = 4
+VALIDATORS = [f"validator_{i}" for i in range(4)]
+
+
+def reward(i, era=None):
+    return {
+        "id": f"{i:010d}-000003-ccccc",
+        "timestamp": f"2023-03-{1 + i // 4:02d}T0{i % 4}:00:00.000000Z",
+        "amount": str((i % 7 + 1) * 10**9),
+        "validatorId": VALIDATORS[i * 3 % len(VALIDATORS)],
+        "era": 1000 + i // 2 if era is None else era,
+    }
+
+
+async def snapshot(rewards):
+    reward_history = await rewards.reward_history(PUBLIC_KEY)
+    return {
+        "recent": await rewards.recent_rewards(PUBLIC_KEY),
+        "history": [values.tolist() for values in reward_history],
+        "relationship": await rewards.reward_relationship(PUBLIC_KEY),
+        "total": await rewards.total_rewards(PUBLIC_KEY),
+        "cursor": rewards.cache.get(PUBLIC_KEY, RewardsType.CURSOR),
+        "last_era": await rewards.last_era(PUBLIC_KEY),
+    }
+
+
+def refreshed(rewards, rows):
+    # The rows arrive upstream and the cached account is refreshed
+    rewards.subsquid_actor.rows = rows
+    asyncio.run(rewards.refresh(PUBLIC_KEY))
+    return asyncio.run(snapshot(rewards))
+
+
+def test_cold_load_totals_every_reward(widget):
+    rows = [reward(i) for i in range(9)]
+    cold = asyncio.run(snapshot(widget(Rewards, rows, page_size=PAGE_SIZE)))
+
+    assert cold["total"] == {
+        "total_amount": sum(int(row["amount"]) for row in rows) / 10**10,
+        "total_count": 9,
+    }
+    assert sum(validator["count"] for validator in cold["relationship"]["count"]) == 9
+    assert cold["cursor"] == {"id": rows[-1]["id"], "era": 1004, "timestamp": rows[-1]["timestamp"]}
+    assert cold["last_era"] == 1004
+
+
+def test_refresh_applies_new_rewards_after_the_cursor(widget):
+    rewards = widget(Rewards, [reward(i) for i in range(5)], page_size=PAGE_SIZE)
+    asyncio.run(snapshot(rewards))
+
+    rows = [reward(i) for i in range(11)]
+    assert refreshed(rewards, rows) == asyncio.run(snapshot(widget(Rewards, rows, page_size=PAGE_SIZE)))
+
+
+def test_late_claim_for_an_older_era_is_merged_without_moving_the_era_back(widget):
+    rows = [reward(i) for i in range(8)]
+    rewards = widget(Rewards, rows, page_size=PAGE_SIZE)
+    asyncio.run(snapshot(rewards))
+
+    # Claimed after the cursor for an era well before it, but still within the history depth
+    rows = rows + [reward(8, era=950)]
+    late = refreshed(rewards, rows)
+    assert late["total"]["total_count"] == 9
+    assert late["cursor"] == {"id": rows[-1]["id"], "era": 1003, "timestamp": rows[-1]["timestamp"]}
+    assert late == asyncio.run(snapshot(widget(Rewards, rows, page_size=PAGE_SIZE)))
+
+
+def test_refresh_only_asks_for_eras_within_the_history_depth(widget):
+    rewards = widget(Rewards, [reward(i) for i in range(4)], page_size=PAGE_SIZE)
+    asyncio.run(snapshot(rewards))
+
+    # Too old to still be claimable, the era bound keeps it out
+    refreshed(rewards, [reward(i) for i in range(4)] + [reward(4, era=1001 - rewards.history_depth)])
+    assert asyncio.run(rewards.total_rewards(PUBLIC_KEY))["total_count"] == 4
+
+
+def test_refresh_past_the_cap_takes_trimmed_rewards_out_of_the_totals(widget):
+    rewards = widget(Rewards, [reward(i) for i in range(10)], page_size=PAGE_SIZE)
+    asyncio.run(snapshot(rewards))
+
+    rows = [reward(i) for i in range(19)]
+    capped = refreshed(rewards, rows)
+    assert capped["total"]["total_count"] == 19
+    # The amount is the one of the rewards that are kept
+    assert capped["total"]["total_amount"] == sum(int(row["amount"]) for row in rows[-12:]) / 10**10
+    assert capped == asyncio.run(snapshot(widget(Rewards, rows, page_size=PAGE_SIZE)))
+
+    rows = [reward(i) for i in range(30)]
+    assert refreshed(rewards, rows) == asyncio.run(snapshot(widget(Rewards, rows, page_size=PAGE_SIZE)))
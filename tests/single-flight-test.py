@@ -0,0 +1,68 @@
+from tools.single_flight import SingleFlight
+
+import asyncio
+import pytest
+
+
+def test_concurrent_async_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "data"
+
+    async def run():
+        return await asyncio.gather(*[flight.do("key", fetch) for _ in range(10)])
+
+    assert asyncio.run(run()) == ["data"] * 10
+    assert len(calls) == 1
+    assert flight.stats()["coalesced"] == 9
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def ok():
+        return "data"
+
+    async def run():
+        results = await asyncio.gather(*[flight.do("key", fail) for _ in range(3)], return_exceptions=True)
+        return results, await flight.do("key", ok)
+
+    (
+        results,
+        retry,
+    ) = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert retry == "data"
+
+
+def test_cancelled_follower_leaves_the_others_waiting():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "data"
+
+    async def run():
+        leader = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(flight.do("key", fetch)) for _ in range(2)]
+        await asyncio.sleep(0)
+        followers[0].cancel()
+        return await asyncio.gather(leader, *followers, return_exceptions=True)
+
+    (
+        leader,
+        cancelled,
+        follower,
+    ) = asyncio.run(run())
+    assert leader == "data"
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert follower == "data"
@@ -0,0 +1,78 @@
+from tools.cache import LRUCache, WidgetCache
+from tools.codec import register_enum
+from tools import sqlite_cache
+from tools.sqlite_cache import SqliteBackend
+from tools.tiered_cache import TieredBackend
+from enum import Enum
+
+import sqlite3
+import pytest
+
+
+@register_enum
+class ExampleType(Enum):
+    TRANSFERS = "TRANSFERS"
+    CURSOR = "CURSOR"
+
+
+def open_backend(path):
+    return SqliteBackend(
+        str(path),
+        local=LRUCache(max_bytes=1024 * 1024),
+    )
+
+
+def test_entries_survive_a_restart(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    backend = open_backend(path)
+    cache = WidgetCache("stats", store=backend)
+    cache.set("a", ExampleType.TRANSFERS, [{"id": "1"}, {"id": "2"}])
+    cache.set("a", ExampleType.CURSOR, {"id": "2"})
+    backend.close()
+
+    backend = open_backend(path)
+    cache = WidgetCache("stats", store=backend)
+
+    assert cache.contains("a", ExampleType.CURSOR)
+    assert cache.get("a", ExampleType.TRANSFERS) == [{"id": "1"}, {"id": "2"}]
+    assert backend.stats()["disk_hits"] == 1
+    assert not cache.is_stale("a", ExampleType.CURSOR)
+    backend.close()
+
+
+def test_tier_without_its_storage_cannot_be_created():
+    class WriteOnly(TieredBackend):
+        def _write(self, key, data):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnly()
+
+
+def test_outdated_schema_is_dropped(tmp_path, monkeypatch):
+    path = tmp_path / "cache.sqlite"
+    backend = open_backend(path)
+    WidgetCache("stats", store=backend).set("a", ExampleType.CURSOR, {"id": "2"})
+    backend.close()
+
+    monkeypatch.setattr(sqlite_cache, "SCHEMA_VERSION", sqlite_cache.SCHEMA_VERSION + 1)
+    backend = open_backend(path)
+
+    assert not WidgetCache("stats", store=backend).contains("a", ExampleType.CURSOR)
+    assert sqlite3.connect(str(path)).execute("SELECT value FROM meta").fetchone()[0] == str(
+        sqlite_cache.SCHEMA_VERSION
+    )
+    backend.close()
+
+
+def test_deleted_entries_are_gone_after_restart(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    backend = open_backend(path)
+    cache = WidgetCache("stats", store=backend)
+    cache.set("a", ExampleType.CURSOR, {"id": "2"})
+    cache.delete("a")
+    backend.close()
+
+    backend = open_backend(path)
+    assert not WidgetCache("stats", store=backend).contains("a", ExampleType.CURSOR)
+    backend.close()
@@ -0,0 +1,86 @@
+from widgets.stats import Stats, StatsType
+
+import asyncio
+
+PUBLIC_KEY = "0x" + "ab" * 32
+# Pages of 4 and a cap of 12 transfers
+PAGE_SIZE = 4
+COUNTERPARTIES = ["0x" + f"{i:02x}" * 32 for i in range(1, 6)]
+
+
+def transfer(i):
+    incoming = i % 3 != 0
+    counterparty = {"publicKey": COUNTERPARTIES[i * 7 % len(COUNTERPARTIES)]}
+    account = {"publicKey": PUBLIC_KEY}
+    return {
+        "id": f"{i:010d}-000001-bbbbb",
+        "transfer": {
+            "blockNumber": 1000 + i,
+            "timestamp": f"2023-02-{1 + i // 4:02d}T0{i % 4}:00:00.000000Z",
+            "extrinsicHash": f"0x{i:064x}",
+            "from": counterparty if incoming else account,
+            # Amounts beyond 64 bits
+            "amount": str((i + 1) * 10**20 + i),
+            "success": True,
+            "to": account if incoming else counterparty,
+        },
+        "direction": "To" if incoming else "From",
+    }
+
+
+async def snapshot(stats):
+    history = await stats.transfer_history(PUBLIC_KEY)
+    return {
+        "relationship": await stats.transfer_relationship(PUBLIC_KEY),
+        "recent": await stats.recent_transfers(PUBLIC_KEY),
+        "history": {name: values.tolist() for name, values in history.items()},
+        "total": await stats.total_transfers(PUBLIC_KEY),
+        "cursor": stats.cache.get(PUBLIC_KEY, StatsType.CURSOR),
+    }
+
+
+def refreshed(stats, count):
+    # Transfers up to count arrive upstream and the cached account is refreshed
+    stats.subsquid_actor.rows = [transfer(i) for i in range(count)]
+    asyncio.run(stats.refresh(PUBLIC_KEY))
+    return asyncio.run(snapshot(stats))
+
+
+def test_cold_load_aggregates_every_transfer(widget):
+    cold = asyncio.run(snapshot(widget(Stats, [transfer(i) for i in range(9)], page_size=PAGE_SIZE)))
+
+    assert cold["total"] == {"total_count": 9, "received": 6, "sent": 3}
+    assert sum(cold["history"]["incoming_counts"]) == 6
+    assert sum(cold["history"]["outgoing_counts"]) == 3
+    assert [row["id"] for row in cold["recent"]] == [transfer(i)["id"] for i in reversed(range(9))]
+    assert sum(sender["count"] for sender in cold["relationship"]["count"]["senders"]) == 6
+    assert cold["cursor"] == {"id": transfer(8)["id"], "timestamp": transfer(8)["transfer"]["timestamp"]}
+
+
+def test_refresh_applies_new_transfers_as_deltas(widget):
+    stats = widget(Stats, [transfer(i) for i in range(5)], page_size=PAGE_SIZE)
+    asyncio.run(snapshot(stats))
+
+    assert refreshed(stats, 11) == asyncio.run(
+        snapshot(widget(Stats, [transfer(i) for i in range(11)], page_size=PAGE_SIZE))
+    )
+
+
+def test_refresh_without_new_transfers_changes_nothing(widget):
+    stats = widget(Stats, [transfer(i) for i in range(5)], page_size=PAGE_SIZE)
+    cold = asyncio.run(snapshot(stats))
+
+    assert refreshed(stats, 5) == cold
+
+
+def test_refresh_past_the_cap_takes_trimmed_transfers_out_of_the_aggregates(widget):
+    stats = widget(Stats, [transfer(i) for i in range(10)], page_size=PAGE_SIZE)
+    asyncio.run(snapshot(stats))
+
+    capped = refreshed(stats, 19)
+    assert capped["total"]["total_count"] == 19
+    assert capped == asyncio.run(snapshot(widget(Stats, [transfer(i) for i in range(19)], page_size=PAGE_SIZE)))
+
+    assert refreshed(stats, 30) == asyncio.run(
+        snapshot(widget(Stats, [transfer(i) for i in range(30)], page_size=PAGE_SIZE))
+    )
@@ -0,0 +1,116 @@
+from actors.subscan_actor import SubscanActor
+from tools.rate_limiter import TokenBucket
+
+import asyncio
+import httpx
+import pytest
+import threading
+
+
+@pytest.fixture
+def actor(monkeypatch):
+    monkeypatch.setenv("SUBSCAN_API_KEY", "test")
+
+    def make(handler):
+        return SubscanActor(
+            limiter=TokenBucket("subscan-test", rate=1000),
+            transport=httpx.MockTransport(handler),
+        )
+
+    return make
+
+
+def ok(request):
+    return httpx.Response(200, json={"path": request.url.path})
+
+
+def test_each_event_loop_gets_its_own_client_and_closes_it_on_shutdown(actor):
+    subscan = actor(ok)
+
+    async def request():
+        await subscan.subscan_rest_make_request("scan/account")
+        return subscan.client
+
+    first = asyncio.run(request())
+    assert first.is_closed
+
+    second = asyncio.run(request())
+    assert second is not first
+    assert second.is_closed
+
+
+def test_client_of_a_loop_still_running_elsewhere_is_closed_on_that_loop(actor):
+    subscan = actor(ok)
+    other = asyncio.new_event_loop()
+    thread = threading.Thread(target=other.run_forever)
+    thread.start()
+    try:
+        asyncio.run_coroutine_threadsafe(subscan.subscan_rest_make_request("scan/account"), other).result()
+        first = subscan.client
+
+        asyncio.run(subscan.subscan_rest_make_request("scan/account"))
+        # Closed on its own loop, which needs a moment to get to it
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), other).result()
+        assert first.is_closed
+    finally:
+        other.call_soon_threadsafe(other.stop)
+        thread.join()
+        other.close()
+
+
+def test_aclose_closes_the_client_of_the_running_loop(actor):
+    subscan = actor(ok)
+
+    async def request_and_close():
+        await subscan.subscan_rest_make_request("scan/account")
+        client = subscan.client
+        await subscan.aclose()
+        return client
+
+    client = asyncio.run(request_and_close())
+    assert client.is_closed
+    assert subscan.client is None
+
+
+def test_client_of_the_caller_is_left_open(actor):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(ok))
+    subscan = SubscanActor(
+        client=client,
+        limiter=TokenBucket("subscan-test", rate=1000),
+    )
+
+    async def request_and_close():
+        result = await subscan.subscan_rest_make_request("scan/account")
+        await subscan.aclose()
+        return result
+
+    assert asyncio.run(request_and_close()) == {"path": "/api/scan/account"}
+    assert not client.is_closed
+
+
+def test_rate_limited_request_is_deferred_and_retried(actor):
+    responses = iter(
+        [
+            httpx.Response(429, headers={"retry-after": "0"}),
+            httpx.Response(200, json={"code": 0}),
+        ]
+    )
+    subscan = actor(lambda request: next(responses))
+
+    assert asyncio.run(subscan.subscan_rest_make_request("scan/account")) == {"code": 0}
+    assert subscan.limiter.deferred == 1
+    assert subscan.limiter.acquired == 2
+
+
+def test_pages_follow_the_next_link(actor):
+    def handler(request):
+        page = int(request.url.params.get("page", 0))
+        headers = {}
+        if page < 2:
+            headers["link"] = f'<https://polkadot.api.subscan.io/api/scan/list?page={page + 1}>; rel="next"'
+        return httpx.Response(200, json=[page], headers=headers)
+
+    subscan = actor(handler)
+
+    assert asyncio.run(subscan.subscan_rest_make_request("scan/list")) == [0, 1, 2]
+    assert asyncio.run(subscan.subscan_rest_make_request("scan/list", max_page_fetch=2)) == [0, 1]
@@ -0,0 +1,213 @@
+from actors.subsquid_actor import SubSquidActor
+from tools.rate_limiter import TokenBucket
+
+import asyncio
+import httpx
+import json
+
+
+def make_actor(handler):
+    actor = SubSquidActor(
+        limiters={},
+        transport=httpx.MockTransport(handler),
+    )
+    for endpoint in (
+        actor.subsquid_explorer_endpoint,
+        actor.subsquid_stats_endpoint,
+        actor.subsquid_main_endpoint,
+    ):
+        actor.limiters[endpoint] = TokenBucket(endpoint, rate=1000)
+    return actor
+
+
+def answer(request):
+    return httpx.Response(200, json={"data": json.loads(request.content)["variables"]})
+
+
+def test_each_event_loop_gets_its_own_client_and_semaphores():
+    actor = make_actor(answer)
+
+    async def query():
+        result = await actor.subscan_main_graphql("query", {"n": 1})
+        return result, actor.client, actor._get_semaphore(actor.subsquid_main_endpoint)
+
+    first, first_client, first_semaphore = asyncio.run(query())
+    second, second_client, second_semaphore = asyncio.run(query())
+
+    assert first == second == {"data": {"n": 1}}
+    assert first_client.is_closed and second_client.is_closed
+    assert second_client is not first_client
+    assert second_semaphore is not first_semaphore
+
+
+def test_aclose_closes_the_client_of_the_running_loop():
+    actor = make_actor(answer)
+
+    async def query_and_close():
+        await actor.subscan_main_graphql("query")
+        client = actor.client
+        await actor.aclose()
+        return client
+
+    assert asyncio.run(query_and_close()).is_closed
+    assert actor.client is None
+
+
+def test_rate_limited_query_is_deferred_and_retried():
+    responses = iter(
+        [
+            httpx.Response(429, headers={"retry-after": "0"}),
+            httpx.Response(200, json={"data": {}}),
+        ]
+    )
+    actor = make_actor(lambda request: next(responses))
+
+    assert asyncio.run(actor.subscan_explorer_graphql("query")) == {"data": {}}
+    limiter = actor.limiters[actor.subsquid_explorer_endpoint]
+    assert limiter.deferred == 1
+    assert limiter.acquired == 2
+
+
+def test_redirected_query_is_sent_again_to_the_new_location():
+    moved = "https://squid.subsquid.io/gs-main-polkadot/v/v2/graphql"
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        if str(request.url) != moved:
+            return httpx.Response(301, headers={"location": moved})
+        return answer(request)
+
+    actor = make_actor(handler)
+
+    assert asyncio.run(actor.subscan_main_graphql("query", {"n": 2})) == {"data": {"n": 2}}
+    assert requested == [actor.subsquid_main_endpoint, moved]
+
+
+def test_failed_query_returns_none():
+    actor = make_actor(lambda request: httpx.Response(500, text="down"))
+
+    assert asyncio.run(actor.subscan_main_graphql("query")) is None
+
+
+ROWS = [{"id": f"{i:04d}"} for i in range(10)]
+
+
+class Indexer:
+    # Serves ROWS under "rows" the way the indexer answers $where, $limit and $orderBy
+    def __init__(
+        self,
+        hold_after=None,
+    ):
+        self.requests = []
+        self.cancelled = []
+        self.hold_after = hold_after
+
+    async def __call__(
+        self,
+        request,
+    ):
+        variables = json.loads(request.content)["variables"]
+        self.requests.append(variables)
+        if self.hold_after is not None and len(self.requests) > self.hold_after:
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                self.cancelled.append(variables)
+                raise
+        where = variables["where"]
+        rows = ROWS[::-1] if variables["orderBy"] == ["id_DESC"] else ROWS
+        if "id_gt" in where:
+            rows = [row for row in rows if row["id"] > where["id_gt"]]
+        if "id_lt" in where:
+            rows = [row for row in rows if row["id"] < where["id_lt"]]
+        return httpx.Response(200, json={"data": {"rows": rows[: variables["limit"]]}})
+
+
+def paginate(actor, **kwargs):
+    return actor.subscan_main_graphql_paginate("query", "rows", {}, **kwargs)
+
+
+async def collect(pages):
+    return [[row["id"] for row in page] async for page in pages]
+
+
+def test_pages_continue_after_the_last_id_until_a_short_page():
+    indexer = Indexer()
+    actor = make_actor(indexer)
+
+    pages = asyncio.run(collect(paginate(actor, page_size=4)))
+    assert pages == [["0000", "0001", "0002", "0003"], ["0004", "0005", "0006", "0007"], ["0008", "0009"]]
+    assert [request["where"].get("id_gt") for request in indexer.requests] == [None, "0003", "0007"]
+
+
+def test_max_rows_shrinks_the_last_page():
+    indexer = Indexer()
+    actor = make_actor(indexer)
+
+    pages = asyncio.run(collect(paginate(actor, page_size=4, max_rows=6)))
+    assert [len(page) for page in pages] == [4, 2]
+    assert [request["limit"] for request in indexer.requests] == [4, 2]
+
+    # A full last page ends the paging without asking for more
+    indexer.requests.clear()
+    pages = asyncio.run(collect(paginate(actor, page_size=3, max_rows=6)))
+    assert [len(page) for page in pages] == [3, 3]
+    assert [request["limit"] for request in indexer.requests] == [3, 3]
+
+
+def test_newest_first_pages_backwards_from_after():
+    indexer = Indexer()
+    actor = make_actor(indexer)
+
+    pages = asyncio.run(collect(paginate(actor, page_size=3, after="0007", newest_first=True)))
+    assert pages == [["0006", "0005", "0004"], ["0003", "0002", "0001"], ["0000"]]
+    assert [request["orderBy"] for request in indexer.requests] == [["id_DESC"]] * 3
+    assert [request["where"]["id_lt"] for request in indexer.requests] == ["0007", "0004", "0001"]
+
+
+def test_next_page_is_requested_before_the_caller_asks_for_it():
+    indexer = Indexer()
+    actor = make_actor(indexer)
+
+    async def first_page():
+        pages = paginate(actor, page_size=4)
+        page = await pages.__anext__()
+        # The caller works on its page while the next one downloads
+        for _ in range(5):
+            await asyncio.sleep(0)
+        requested = len(indexer.requests)
+        await pages.aclose()
+        return page, requested
+
+    (
+        page,
+        requested,
+    ) = asyncio.run(first_page())
+    assert len(page) == 4
+    assert requested == 2
+
+
+def test_prefetched_page_is_cancelled_when_the_caller_stops():
+    indexer = Indexer(hold_after=1)
+    actor = make_actor(indexer)
+
+    async def first_page_only():
+        pages = paginate(actor, page_size=4)
+        async for page in pages:
+            for _ in range(5):
+                await asyncio.sleep(0)
+            break
+        await pages.aclose()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        # Still within the loop, before asyncio.run cancels whatever is left
+        return page, list(indexer.cancelled)
+
+    (
+        page,
+        cancelled,
+    ) = asyncio.run(first_page_only())
+    assert len(page) == 4
+    assert [request["where"].get("id_gt") for request in indexer.requests] == [None, "0003"]
+    assert cancelled == [indexer.requests[1]]
@@ -0,0 +1,134 @@
+import numpy as np
+import sqlite3
+import threading
+import time
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the tables change, results are cheap to compute again so an outdated file starts over
+STORE_VERSION = 2
+
+
+class BadgeStore:
+    # Local SQLite file with the latest features and badge states of every evaluated account
+    def __init__(
+        self,
+        path,
+        features,
+        badges,
+    ):
+        self.path = path
+        # Series like monthly activity are left out, every other feature is a column
+        self.features = [name for name, dtype in features.items() if np.dtype(dtype).shape == ()]
+        self._columns = [i for i, dtype in enumerate(features.values()) if np.dtype(dtype).shape == ()]
+        self.badges = list(badges)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+
+    def _migrate(
+        self,
+    ):
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            row = self._connection.execute("SELECT value FROM meta WHERE name = 'store_version'").fetchone()
+            version = int(row[0]) if row else None
+            if version != STORE_VERSION:
+                if version is not None:
+                    logger.info(f". [=] Badge store version {version} is outdated, starting over with {STORE_VERSION}")
+                self._connection.execute("DROP TABLE IF EXISTS features")
+                self._connection.execute("DROP TABLE IF EXISTS badges")
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO meta (name, value) VALUES ('store_version', ?)",
+                    (str(STORE_VERSION),),
+                )
+            # Features of sources that timed out are NULL
+            columns = ", ".join(f"{name} NUMERIC" for name in self.features)
+            self._connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS features (
+                    public_key TEXT PRIMARY KEY,
+                    {columns},
+                    evaluated_at REAL NOT NULL
+                )
+                """)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS badges (
+                    public_key TEXT NOT NULL,
+                    badge TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    evaluated_at REAL NOT NULL,
+                    PRIMARY KEY (public_key, badge)
+                )
+                """)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS badges_by_status ON badges (badge, status)")
+
+    def write(
+        self,
+        public_keys,
+        features,
+        earned,
+        unknown,
+        missing,
+    ):
+        # One row per account in features and one per account and badge in badges. missing holds the
+        # features each account could not load, earned and unknown are (accounts, badges) masks
+        now = time.time()
+        feature_rows = []
+        badge_rows = []
+        for i, public_key in enumerate(public_keys):
+            values = features[i].tolist()
+            feature_rows.append(
+                (
+                    public_key,
+                    *[None if missing[i, j] else values[j] for j in self._columns],
+                    now,
+                )
+            )
+            for j, badge in enumerate(self.badges):
+                if unknown[i, j]:
+                    status = "unknown"
+                else:
+                    status = "earned" if earned[i, j] else "not_earned"
+                badge_rows.append(
+                    (
+                        public_key,
+                        badge,
+                        status,
+                        now,
+                    )
+                )
+
+        placeholders = ", ".join("?" for _ in range(len(self.features) + 2))
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO features VALUES ({placeholders})",
+                feature_rows,
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO badges VALUES (?, ?, ?, ?)",
+                badge_rows,
+            )
+
+    def earned_counts(
+        self,
+    ):
+        # How many stored accounts earned each badge
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT badge, COUNT(*) FROM badges WHERE status = 'earned' GROUP BY badge"
+            ).fetchall()
+        return dict(rows)
+
+    def close(
+        self,
+    ):
+        with self._lock:
+            self._connection.close()
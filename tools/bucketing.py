@@ -0,0 +1,121 @@
+import numpy as np
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Chart intervals, the buckets end on the same days as pandas' D, W-MON, M and Y frequencies
+DAY = "DAY"
+WEEK = "WEEK"
+MONTH = "MONTH"
+YEAR = "YEAR"
+
+UNITS = {
+    MONTH: "M",
+    YEAR: "Y",
+}
+
+
+def bucket_ends(
+    days,
+    interval,
+):
+    # The day that labels the bucket of every day: itself, the next Monday, the month end or the year end
+    days = np.asarray(
+        days,
+        dtype="datetime64[D]",
+    )
+    if interval == DAY:
+        return days
+    if interval == WEEK:
+        # 1970-01-01 was a Thursday, this makes Monday 0
+        weekdays = (days.astype(np.int64) + 3) % 7
+        return days + (7 - weekdays) % 7
+    unit = UNITS[interval]
+    return (days.astype(f"datetime64[{unit}]") + 1).astype("datetime64[D]") - 1
+
+
+def bucket_range(
+    first,
+    last,
+    interval,
+):
+    # Every bucket end from first to last, both bucket ends themselves
+    if interval == DAY:
+        return np.arange(
+            first,
+            last + 1,
+        )
+    if interval == WEEK:
+        return np.arange(
+            first,
+            last + 1,
+            7,
+        )
+    unit = UNITS[interval]
+    starts = np.arange(
+        first.astype(f"datetime64[{unit}]"),
+        last.astype(f"datetime64[{unit}]") + 1,
+    )
+    return (starts + 1).astype("datetime64[D]") - 1
+
+
+def resample(
+    days,
+    values,
+    interval,
+    end=None,
+):
+    # Sums ascending daily values into the buckets of the interval. Without an end the buckets run to
+    # the last day's bucket, with one they run to the last bucket ending on or before it, filled with zeros
+    ends = bucket_ends(
+        days,
+        interval,
+    )
+    values = np.asarray(values)
+    if len(ends) == 0:
+        return (
+            ends,
+            values,
+        )
+    if end is None:
+        last = ends[-1]
+    else:
+        last = bucket_ends(
+            [end],
+            interval,
+        )[0]
+        if last > end:
+            # The bucket of the end day closes later, stop at the one before it
+            if interval == WEEK:
+                last = last - 7
+            else:
+                last = last.astype(f"datetime64[{UNITS[interval]}]").astype("datetime64[D]") - 1
+    labels = bucket_range(
+        ends[0],
+        last,
+        interval,
+    )
+    # Days after the last bucket are left out, like a reindex would
+    kept = ends <= last
+    totals = np.bincount(
+        np.searchsorted(labels, ends[kept]),
+        weights=values[kept],
+        minlength=len(labels),
+    )
+    return (
+        labels,
+        totals.astype(values.dtype),
+    )
+
+
+def format_labels(
+    labels,
+    interval=None,
+):
+    # Years are shown on their own, everything else as an ISO date
+    return np.datetime_as_string(
+        labels,
+        unit="Y" if interval == YEAR else "D",
+    ).tolist()
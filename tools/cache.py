@@ -0,0 +1,512 @@
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from collections import (
+    OrderedDict,
+)
+import asyncio
+import sys
+import threading
+import time
+from tools.single_flight import SingleFlight
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Large containers are measured on a sample of their items, this is an estimate and not an exact count
+SIZE_SAMPLE = 32
+# Entry field holding the write time of every other field
+WRITTEN_AT = "__written_at__"
+MAX_IDLE_LOCKS = 1024
+
+
+def estimate_size(
+    value,
+):
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return size
+
+    if isinstance(value, dict):
+        items = [item for pair in value.items() for item in pair]
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = list(value)
+    else:
+        return size
+
+    if len(items) <= 2 * SIZE_SAMPLE:
+        return size + sum(estimate_size(item) for item in items)
+
+    # Spread the sample over the whole container and extrapolate
+    step = len(items) / SIZE_SAMPLE
+    sample = [items[int(i * step)] for i in range(SIZE_SAMPLE)]
+    return size + int(sum(estimate_size(item) for item in sample) * len(items) / SIZE_SAMPLE)
+
+
+class CacheBackend(ABC):
+    # Storage behind WidgetCache. Entries are dicts of cached types, keyed by (namespace, public_key)
+    @abstractmethod
+    def get(
+        self,
+        key,
+    ):
+        pass
+
+    @abstractmethod
+    def peek(
+        self,
+        key,
+    ):
+        pass
+
+    @abstractmethod
+    def update(
+        self,
+        key,
+        fn,
+    ):
+        pass
+
+    @abstractmethod
+    def delete(
+        self,
+        key,
+    ):
+        pass
+
+    async def load(
+        self,
+        key,
+    ):
+        # Brings an entry up from slower storage ahead of the lookups, stores in memory have nothing to do
+        pass
+
+    def pin(
+        self,
+        key,
+    ):
+        pass
+
+    def unpin(
+        self,
+        key,
+    ):
+        pass
+
+    def stats(
+        self,
+    ):
+        return {}
+
+
+class LRUCache(CacheBackend):
+    def __init__(
+        self,
+        max_bytes,
+    ):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._pins = {}
+        self._lock = threading.RLock()
+
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def get(
+        self,
+        key,
+    ):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def peek(
+        self,
+        key,
+    ):
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(
+        self,
+        key,
+        value,
+    ):
+        size = estimate_size(value)
+        with self._lock:
+            self.current_bytes += size - self._sizes.get(key, 0)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self._evict()
+
+    def update(
+        self,
+        key,
+        fn,
+    ):
+        # Read-modify-write of one entry, the result is re-measured
+        with self._lock:
+            entry = fn(self._entries.get(key))
+            if entry is not None:
+                self.set(
+                    key,
+                    entry,
+                )
+
+    def delete(
+        self,
+        key,
+    ):
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+                self.current_bytes -= self._sizes.pop(key)
+
+    def is_pinned(
+        self,
+        key,
+    ):
+        with self._lock:
+            return key in self._pins
+
+    def discard(
+        self,
+        key,
+    ):
+        # Drops a copy that is outdated elsewhere, unless it is being worked on right now
+        with self._lock:
+            if key not in self._pins:
+                self.delete(key)
+
+    def pin(
+        self,
+        key,
+    ):
+        # Pinned entries are being worked on and are never evicted
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(
+        self,
+        key,
+    ):
+        with self._lock:
+            self._pins[key] -= 1
+            if self._pins[key] == 0:
+                del self._pins[key]
+            self._evict()
+
+    def _evict(
+        self,
+    ):
+        # Oldest first, the most recently used entry stays even if it alone is over budget
+        for key in list(self._entries)[:-1]:
+            if self.current_bytes <= self.max_bytes:
+                break
+            if key in self._pins:
+                continue
+            del self._entries[key]
+            size = self._sizes.pop(key)
+            self.current_bytes -= size
+            self.evictions += 1
+            self.evicted_bytes += size
+            logger.debug(f". [-] Evicted {key} from cache, {size} bytes")
+
+    def stats(
+        self,
+    ):
+        with self._lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "current_bytes": self.current_bytes,
+                "entries": len(self._entries),
+                "pinned": len(self._pins),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+
+class _KeyLock:
+    def __init__(
+        self,
+        cache,
+        public_key,
+        lock,
+    ):
+        self.cache = cache
+        self.public_key = public_key
+        self.lock = lock
+
+    async def __aenter__(
+        self,
+    ):
+        await self.lock.acquire()
+        self.cache.pin(self.public_key)
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type,
+        exc,
+        tb,
+    ):
+        self.cache.unpin(self.public_key)
+        self.lock.release()
+
+
+class WidgetCache:
+    # One widget's view on the shared store, every public key is a single entry holding all cached types
+    def __init__(
+        self,
+        namespace,
+        store=None,
+        ttls=None,
+        default_ttl=None,
+    ):
+        self.namespace = namespace
+        self.store = store or widget_store()
+        # Seconds after which a cached type is served stale and revalidated, None never expires
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._revalidating = {}
+        # Cold loads of the same key are fetched once and shared
+        self.flight = SingleFlight()
+
+    def _key(
+        self,
+        public_key,
+    ):
+        return (
+            self.namespace,
+            public_key,
+        )
+
+    def get(
+        self,
+        public_key,
+        cache_type,
+    ):
+        entry = self.store.peek(self._key(public_key))
+        if entry is None:
+            return None
+        return entry.get(cache_type, None)
+
+    async def load(
+        self,
+        public_key,
+    ):
+        # Reads from the tiers below block, so they happen here off the event loop and not in the lookups
+        if not self.is_local(public_key):
+            await self.store.load(self._key(public_key))
+
+    def contains(
+        self,
+        public_key,
+        cache_type,
+    ):
+        # Every read starts with a lookup, this is where hits and misses are counted
+        entry = self.store.get(self._key(public_key))
+        return entry is not None and cache_type in entry
+
+    def set(
+        self,
+        public_key,
+        cache_type,
+        data,
+    ):
+        def write(entry):
+            entry = entry or {WRITTEN_AT: {}}
+            entry[cache_type] = data
+            entry[WRITTEN_AT][cache_type] = time.time()
+            return entry
+
+        # Re-measured on every write, aggregates are updated in place
+        self.store.update(
+            self._key(public_key),
+            write,
+        )
+
+    def touch(
+        self,
+        public_key,
+    ):
+        # Everything cached for the key is up to date again, also what was updated in place
+        def write(entry):
+            if entry is not None:
+                now = time.time()
+                for cache_type in entry[WRITTEN_AT]:
+                    entry[WRITTEN_AT][cache_type] = now
+            return entry
+
+        self.store.update(
+            self._key(public_key),
+            write,
+        )
+
+    def written_at(
+        self,
+        public_key,
+        cache_type,
+    ):
+        # When the cached type was last written or touched, None if it is not cached
+        entry = self.store.peek(self._key(public_key))
+        if entry is None:
+            return None
+        return entry[WRITTEN_AT].get(cache_type)
+
+    def is_stale(
+        self,
+        public_key,
+        cache_type,
+    ):
+        ttl = self.ttls.get(
+            cache_type,
+            self.default_ttl,
+        )
+        entry = self.store.peek(self._key(public_key))
+        if ttl is None or entry is None or cache_type not in entry[WRITTEN_AT]:
+            return False
+        return time.time() - entry[WRITTEN_AT][cache_type] > ttl
+
+    def revalidate(
+        self,
+        key,
+        refresh,
+    ):
+        # Stale-while-revalidate: the caller keeps serving the stale value, one background refresh per key
+        if key in self._revalidating:
+            return
+
+        async def run():
+            try:
+                await refresh()
+            except Exception as e:
+                logger.error(f". [-] Failed to refresh {self.namespace} cache for {key}: {e}")
+            finally:
+                del self._revalidating[key]
+
+        self._revalidating[key] = asyncio.ensure_future(run())
+
+    def delete(
+        self,
+        public_key,
+    ):
+        self.store.delete(self._key(public_key))
+
+    def pin(
+        self,
+        public_key,
+    ):
+        self.store.pin(self._key(public_key))
+
+    def unpin(
+        self,
+        public_key,
+    ):
+        self.store.unpin(self._key(public_key))
+
+    def _local(
+        self,
+    ):
+        # The in-process tier, under any shared or disk tiers
+        store = self.store
+        while hasattr(store, "local"):
+            store = store.local
+        return store
+
+    def is_local(
+        self,
+        public_key,
+    ):
+        return self._local().peek(self._key(public_key)) is not None
+
+    def release(
+        self,
+        public_key,
+    ):
+        # Frees the in-process copy of a key that is not needed again soon, the tiers below keep theirs
+        self._local().discard(self._key(public_key))
+
+    def lock(
+        self,
+        public_key,
+    ):
+        # Serializes loads for one key and keeps its entry from being evicted halfway through
+        with self._locks_lock:
+            if public_key not in self._locks:
+                self._locks[public_key] = asyncio.Lock()
+            lock = self._locks[public_key]
+            # Locks nobody holds are dropped, acquiring a free lock never yields so this cannot split a key
+            if len(self._locks) > MAX_IDLE_LOCKS:
+                for key, key_lock in list(self._locks.items()):
+                    if key != public_key and not key_lock.locked():
+                        del self._locks[key]
+        return _KeyLock(
+            self,
+            public_key,
+            lock,
+        )
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def widget_store():
+    # One byte budget for every widget in the process
+    global _store
+    with _store_lock:
+        if _store is None:
+            local = LRUCache(int(os.environ.get("WIDGET_CACHE_MAX_BYTES", 512 * 1024 * 1024)))
+            if os.environ.get("WIDGET_CACHE_DISK_PATH"):
+                from tools.sqlite_cache import SqliteBackend
+
+                local = SqliteBackend(
+                    os.environ["WIDGET_CACHE_DISK_PATH"],
+                    local=local,
+                )
+            backend = os.environ.get("WIDGET_CACHE_BACKEND", "memory")
+            if backend == "memory":
+                _store = local
+            elif backend == "redis":
+                from tools.redis_cache import RedisBackend
+
+                _store = RedisBackend.from_url(
+                    os.environ.get("WIDGET_CACHE_REDIS_URL", "redis://localhost:6379/0"),
+                    local=local,
+                )
+            else:
+                raise ValueError(f"Unknown WIDGET_CACHE_BACKEND: {backend}")
+            logger.info(
+                f". [=] Widget cache backend: {backend}"
+                + (" with disk tier" if os.environ.get("WIDGET_CACHE_DISK_PATH") else "")
+            )
+        return _store
+
+
+def close_widget_store():
+    global _store
+    with _store_lock:
+        if _store is not None and hasattr(_store, "close"):
+            _store.close()
+        _store = None
+
+
+def cache_stats():
+    return widget_store().stats()
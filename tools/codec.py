@@ -0,0 +1,159 @@
+import msgpack
+import numpy as np
+import zstandard
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# msgpack extension types
+EXT_ENUM = 1
+EXT_BIGINT = 2
+EXT_NDARRAY = 3
+EXT_OBJECT = 4
+
+# Bump when the layout of cached entries changes, persisted tiers drop older entries
+SCHEMA_VERSION = 11
+
+# Header byte of every encoded value
+RAW = b"\x00"
+ZSTD = b"\x01"
+
+# Small values are not worth a compression frame
+COMPRESS_MIN_BYTES = 1024
+
+_enums = {}
+_classes = {}
+_compressor = zstandard.ZstdCompressor(level=int(os.environ.get("WIDGET_CACHE_ZSTD_LEVEL", 3)))
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def register_enum(
+    enum_class,
+):
+    # Only registered enums can be decoded, cache keys are the widget *Type enums
+    _enums[f"{enum_class.__module__}.{enum_class.__qualname__}"] = enum_class
+    return enum_class
+
+
+def register_class(
+    cls,
+):
+    # Registered classes are encoded through their to_state() and rebuilt with from_state()
+    _classes[f"{cls.__module__}.{cls.__qualname__}"] = cls
+    return cls
+
+
+def _default(
+    value,
+):
+    name = f"{type(value).__module__}.{type(value).__qualname__}"
+    if name in _classes:
+        return msgpack.ExtType(
+            EXT_OBJECT,
+            msgpack.packb(
+                [
+                    name,
+                    value.to_state(),
+                ],
+                default=_default,
+            ),
+        )
+    if isinstance(value, np.ndarray):
+        return msgpack.ExtType(
+            EXT_NDARRAY,
+            msgpack.packb(
+                [
+                    value.dtype.str,
+                    list(value.shape),
+                    np.ascontiguousarray(value).tobytes(),
+                ]
+            ),
+        )
+    if name in _enums:
+        return msgpack.ExtType(
+            EXT_ENUM,
+            msgpack.packb(
+                [
+                    name,
+                    value.value,
+                ]
+            ),
+        )
+    # Planck sums can be larger than 64 bits
+    if isinstance(value, int):
+        return msgpack.ExtType(
+            EXT_BIGINT,
+            str(value).encode(),
+        )
+    raise TypeError(f"Cannot encode {type(value)}")
+
+
+def _ext_hook(
+    code,
+    data,
+):
+    if code == EXT_ENUM:
+        (
+            name,
+            value,
+        ) = msgpack.unpackb(data)
+        return _enums[name](value)
+    if code == EXT_BIGINT:
+        return int(data.decode())
+    if code == EXT_NDARRAY:
+        (
+            dtype,
+            shape,
+            buffer,
+        ) = msgpack.unpackb(data)
+        # Copied so the array owns writable memory
+        return (
+            np.frombuffer(
+                buffer,
+                dtype=dtype,
+            )
+            .reshape(shape)
+            .copy()
+        )
+    if code == EXT_OBJECT:
+        (
+            name,
+            state,
+        ) = msgpack.unpackb(
+            data,
+            ext_hook=_ext_hook,
+            strict_map_key=False,
+        )
+        return _classes[name].from_state(state)
+    return msgpack.ExtType(
+        code,
+        data,
+    )
+
+
+def pack(
+    value,
+):
+    data = msgpack.packb(
+        value,
+        default=_default,
+    )
+    if len(data) < COMPRESS_MIN_BYTES:
+        return RAW + data
+    return ZSTD + _compressor.compress(data)
+
+
+def unpack(
+    data,
+):
+    if data[:1] == ZSTD:
+        payload = _decompressor.decompress(data[1:])
+    else:
+        payload = data[1:]
+    return msgpack.unpackb(
+        payload,
+        ext_hook=_ext_hook,
+        strict_map_key=False,
+    )
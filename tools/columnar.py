@@ -0,0 +1,523 @@
+import numpy as np
+from tools.codec import register_class
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+MS_PER_DAY = 24 * 3600 * 1000
+
+U64_MASK = (1 << 64) - 1
+DAY_MASK = (1 << 32) - 1
+U32_MASK = np.uint64((1 << 32) - 1)
+
+
+def parse_timestamps(
+    timestamps,
+):
+    # ISO-8601 UTC strings from the indexer to int64 milliseconds since epoch
+    if len(timestamps) == 0:
+        return np.empty(
+            0,
+            dtype=np.int64,
+        )
+    return np.char.rstrip(np.asarray(timestamps), "Z").astype("datetime64[ms]").astype(np.int64)
+
+
+def split_u128(
+    values,
+):
+    # Planck amounts are u128 on chain, kept exactly as two uint64 halves
+    values = np.array(
+        [int(value) for value in values],
+        dtype=object,
+    )
+    return (
+        (values >> 64).astype(np.uint64),
+        (values & U64_MASK).astype(np.uint64),
+    )
+
+
+def u128_limbs(
+    hi,
+    lo,
+):
+    # The four 32-bit limbs of u128 amounts, lowest first. Sums of a limb over less than 2**32 rows fit in uint64
+    return (
+        lo & U32_MASK,
+        lo >> np.uint64(32),
+        hi & U32_MASK,
+        hi >> np.uint64(32),
+    )
+
+
+def join_u128(
+    limbs,
+):
+    # Exact Python ints from per-limb sums, lowest limb first
+    totals = np.zeros(
+        len(limbs[0]),
+        dtype=object,
+    )
+    for shift, limb in zip(
+        (
+            0,
+            32,
+            64,
+            96,
+        ),
+        limbs,
+    ):
+        totals += limb.astype(object) << shift
+    return totals
+
+
+class Dictionary:
+    # Interns repeated strings (pallets, calls, accounts) to small integer codes
+    def __init__(
+        self,
+        values=None,
+    ):
+        self.values = list(values or [])
+        self.index = {value: code for code, value in enumerate(self.values)}
+
+    def __len__(
+        self,
+    ):
+        return len(self.values)
+
+    def encode(
+        self,
+        values,
+    ):
+        codes = np.empty(
+            len(values),
+            dtype=np.int32,
+        )
+        for i, value in enumerate(values):
+            code = self.index.get(value)
+            if code is None:
+                code = len(self.values)
+                self.index[value] = code
+                self.values.append(value)
+            codes[i] = code
+        return codes
+
+    def code(
+        self,
+        value,
+    ):
+        return self.index.get(value, -1)
+
+    def decode(
+        self,
+        codes,
+    ):
+        return [self.values[code] for code in codes]
+
+    def __sizeof__(
+        self,
+    ):
+        return sum(len(value) + 49 for value in self.values) * 2 + 64 * len(self.values)
+
+
+class ColumnTable:
+    # Equal-length NumPy columns plus the dictionaries their codes refer to.
+    # Subclasses declare `columns` as {name: dtype} and `dictionaries` as attribute names
+    columns = {}
+    dictionaries = ()
+
+    def __init__(
+        self,
+        **arrays,
+    ):
+        for name, dtype in self.columns.items():
+            setattr(
+                self,
+                name,
+                np.asarray(
+                    arrays.get(
+                        name,
+                        np.empty(0, dtype=dtype),
+                    ),
+                    dtype=dtype,
+                ),
+            )
+        for name in self.dictionaries:
+            setattr(
+                self,
+                name,
+                Dictionary(),
+            )
+
+    def __len__(
+        self,
+    ):
+        return len(getattr(self, next(iter(self.columns))))
+
+    def append(
+        self,
+        **arrays,
+    ):
+        for name in self.columns:
+            setattr(
+                self,
+                name,
+                np.concatenate(
+                    (
+                        getattr(self, name),
+                        np.asarray(arrays[name], dtype=self.columns[name]),
+                    )
+                ),
+            )
+
+    def rows(
+        self,
+        start,
+        end=None,
+    ):
+        # A table of the rows in [start, end) that shares the dictionaries
+        selected = type(self)(**{name: getattr(self, name)[start:end] for name in self.columns})
+        for name in self.dictionaries:
+            setattr(
+                selected,
+                name,
+                getattr(self, name),
+            )
+        return selected
+
+    def drop_head(
+        self,
+        count,
+    ):
+        # Returns the dropped rows as a table of their own
+        dropped = self.rows(
+            0,
+            count,
+        )
+        for name in self.columns:
+            setattr(
+                self,
+                name,
+                getattr(self, name)[count:].copy(),
+            )
+        return dropped
+
+    def __sizeof__(
+        self,
+    ):
+        return sum(getattr(self, name).nbytes for name in self.columns) + sum(
+            getattr(self, name).__sizeof__() for name in self.dictionaries
+        )
+
+    def to_state(
+        self,
+    ):
+        return {
+            "columns": {name: getattr(self, name) for name in self.columns},
+            "dictionaries": {name: getattr(self, name).values for name in self.dictionaries},
+        }
+
+    @classmethod
+    def from_state(
+        cls,
+        state,
+    ):
+        table = cls(**state["columns"])
+        for name, values in state["dictionaries"].items():
+            setattr(
+                table,
+                name,
+                Dictionary(values),
+            )
+        return table
+
+
+@register_class
+class DailyRollup:
+    # Per-day totals kept at ingest, so charts read buckets instead of rows. Every bucket is a
+    # (group, day) pair, e.g. one series per call, and holds one int64 total per name
+    def __init__(
+        self,
+        names,
+        keys=None,
+        totals=None,
+    ):
+        self.names = tuple(names)
+        self.keys = np.asarray(
+            keys if keys is not None else [],
+            dtype=np.int64,
+        )
+        self.totals = {
+            name: np.asarray(
+                (totals or {}).get(name, np.zeros(len(self.keys))),
+                dtype=np.int64,
+            )
+            for name in self.names
+        }
+
+    def __len__(
+        self,
+    ):
+        return len(self.keys)
+
+    def add(
+        self,
+        timestamps,
+        sign=1,
+        groups=None,
+        **values,
+    ):
+        # Rows are added with sign 1 and taken out again with sign -1, empty buckets are dropped
+        if len(timestamps) == 0:
+            return
+        keys = timestamps // MS_PER_DAY
+        if groups is not None:
+            keys = keys + (groups.astype(np.int64) << 32)
+        (
+            merged,
+            inverse,
+        ) = np.unique(
+            np.concatenate((self.keys, keys)),
+            return_inverse=True,
+        )
+        existing = len(self.keys)
+        nonzero = np.zeros(
+            len(merged),
+            dtype=bool,
+        )
+        for name in self.names:
+            totals = np.zeros(
+                len(merged),
+                dtype=np.int64,
+            )
+            totals[inverse[:existing]] = self.totals[name]
+            np.add.at(
+                totals,
+                inverse[existing:],
+                sign * np.asarray(values[name], dtype=np.int64),
+            )
+            self.totals[name] = totals
+            nonzero |= totals != 0
+        self.keys = merged[nonzero]
+        for name in self.names:
+            self.totals[name] = self.totals[name][nonzero]
+
+    def groups(
+        self,
+    ):
+        return np.unique(self.keys >> 32)
+
+    def series(
+        self,
+        name,
+        group=0,
+    ):
+        # Days with a non-empty bucket, ascending, and their totals. Several groups are added up
+        groups = np.atleast_1d(
+            np.asarray(
+                group,
+                dtype=np.int64,
+            )
+        )
+        starts = np.searchsorted(self.keys, groups << 32)
+        ends = np.searchsorted(self.keys, (groups + 1) << 32)
+        if len(groups) == 1:
+            return (
+                (self.keys[starts[0] : ends[0]] & DAY_MASK).astype("datetime64[D]"),
+                self.totals[name][starts[0] : ends[0]],
+            )
+
+        rows = np.concatenate(
+            [np.arange(start, end) for start, end in zip(starts, ends)] + [np.empty(0, dtype=np.int64)]
+        )
+        (
+            days,
+            inverse,
+        ) = np.unique(
+            self.keys[rows] & DAY_MASK,
+            return_inverse=True,
+        )
+        totals = np.zeros(
+            len(days),
+            dtype=np.int64,
+        )
+        np.add.at(
+            totals,
+            inverse,
+            self.totals[name][rows],
+        )
+        return (
+            days.astype("datetime64[D]"),
+            totals,
+        )
+
+    def __sizeof__(
+        self,
+    ):
+        return self.keys.nbytes + sum(totals.nbytes for totals in self.totals.values())
+
+    def to_state(
+        self,
+    ):
+        return {
+            "names": list(self.names),
+            "keys": self.keys,
+            "totals": self.totals,
+        }
+
+    @classmethod
+    def from_state(
+        cls,
+        state,
+    ):
+        return cls(
+            state["names"],
+            keys=state["keys"],
+            totals=state["totals"],
+        )
+
+
+@register_class
+class CodeTotals:
+    # Running totals per code, e.g. per counterparty, kept at ingest like the daily buckets so rankings never
+    # regroup the rows. Every code holds one total per name in that name's dtype and the latest timestamp
+    # it was seen at, which orders ties
+    def __init__(
+        self,
+        dtypes,
+        keys=None,
+        totals=None,
+        latest=None,
+    ):
+        self.dtypes = {name: np.dtype(dtype).str for name, dtype in dict(dtypes).items()}
+        self.keys = np.asarray(
+            keys if keys is not None else [],
+            dtype=np.int64,
+        )
+        self.totals = {
+            name: np.asarray(
+                (totals or {}).get(name, np.zeros(len(self.keys))),
+                dtype=dtype,
+            )
+            for name, dtype in self.dtypes.items()
+        }
+        self.latest = np.asarray(
+            latest if latest is not None else np.zeros(len(self.keys)),
+            dtype=np.int64,
+        )
+
+    def __len__(
+        self,
+    ):
+        return len(self.keys)
+
+    def add(
+        self,
+        codes,
+        timestamps,
+        sign=1,
+        **values,
+    ):
+        # Rows are added with sign 1 and taken out again with sign -1, codes without rows are dropped. Taking
+        # rows out never moves the latest timestamp back, the rows that leave are always the oldest
+        if len(codes) == 0:
+            return
+        (
+            merged,
+            inverse,
+        ) = np.unique(
+            np.concatenate((self.keys, codes)),
+            return_inverse=True,
+        )
+        existing = len(self.keys)
+        accumulate = np.add if sign > 0 else np.subtract
+        nonzero = np.zeros(
+            len(merged),
+            dtype=bool,
+        )
+        for name, dtype in self.dtypes.items():
+            totals = np.zeros(
+                len(merged),
+                dtype=dtype,
+            )
+            totals[inverse[:existing]] = self.totals[name]
+            accumulate.at(
+                totals,
+                inverse[existing:],
+                np.asarray(values[name], dtype=dtype),
+            )
+            self.totals[name] = totals
+            nonzero |= totals != 0
+        latest = np.zeros(
+            len(merged),
+            dtype=np.int64,
+        )
+        latest[inverse[:existing]] = self.latest
+        if sign > 0:
+            np.maximum.at(
+                latest,
+                inverse[existing:],
+                timestamps,
+            )
+
+        self.keys = merged[nonzero]
+        for name in self.dtypes:
+            self.totals[name] = self.totals[name][nonzero]
+        self.latest = latest[nonzero]
+
+    def top(
+        self,
+        values,
+        limit,
+        where=None,
+    ):
+        # Positions of the largest values, one per key, the most recently seen first among equal ones.
+        # where restricts the ranking to some of the keys
+        positions = np.arange(len(self.keys)) if where is None else np.flatnonzero(where)
+        if values.dtype == object:
+            # Exact u128 totals are Python ints
+            order = sorted(
+                positions.tolist(),
+                key=lambda position: (
+                    values[position],
+                    self.latest[position],
+                ),
+                reverse=True,
+            )
+            return order[:limit]
+        order = np.lexsort(
+            (
+                -self.latest[positions],
+                -values[positions],
+            )
+        )
+        return positions[order[:limit]].tolist()
+
+    def __sizeof__(
+        self,
+    ):
+        return self.keys.nbytes + self.latest.nbytes + sum(totals.nbytes for totals in self.totals.values())
+
+    def to_state(
+        self,
+    ):
+        return {
+            "dtypes": self.dtypes,
+            "keys": self.keys,
+            "totals": self.totals,
+            "latest": self.latest,
+        }
+
+    @classmethod
+    def from_state(
+        cls,
+        state,
+    ):
+        return cls(
+            state["dtypes"],
+            keys=state["keys"],
+            totals=state["totals"],
+            latest=state["latest"],
+        )
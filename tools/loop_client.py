@@ -0,0 +1,90 @@
+import asyncio
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def _close_on_shutdown(
+    client,
+):
+    # Suspended until its loop shuts down: asyncio closes the async generators of a loop before the loop
+    # itself, the last moment the connections of the client can still be closed
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def _close(
+    started,
+    closer,
+):
+    # The closer only runs its finally once it was started
+    await started
+    await closer.aclose()
+
+
+class LoopClient:
+    # The httpx.AsyncClient of the running event loop. Connections belong to the loop that opened them, so every
+    # loop gets a client of its own, which is closed on that loop when it shuts down or when another loop takes over
+    def __init__(
+        self,
+        factory,
+    ):
+        self.factory = factory
+        self.client = None
+        self.loop = None
+        self._closer = None
+        self._started = None
+
+    def get(
+        self,
+    ):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self._close_previous()
+            self.client = self.factory()
+            self.loop = loop
+            self._closer = _close_on_shutdown(self.client)
+            # Started here so the loop tracks it from now on
+            self._started = asyncio.ensure_future(self._closer.__anext__())
+        return self.client
+
+    def _close_previous(
+        self,
+    ):
+        if self._closer is None:
+            return
+        # A loop that already shut down closed its client with it
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(
+                _close(
+                    self._started,
+                    self._closer,
+                ),
+                self.loop,
+            )
+        self.client = None
+        self.loop = None
+        self._closer = None
+        self._started = None
+
+    async def aclose(
+        self,
+    ):
+        if self.loop is not asyncio.get_running_loop():
+            self._close_previous()
+            return
+        started = self._started
+        closer = self._closer
+        self.client = None
+        self.loop = None
+        self._closer = None
+        self._started = None
+        if closer is not None:
+            await _close(
+                started,
+                closer,
+            )
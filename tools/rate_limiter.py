@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        name,
+        rate,
+        burst=None,
+    ):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(1.0, self.rate)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.resume_at = 0.0
+        self._lock = threading.Lock()
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.acquired = 0
+        self.throttled = 0
+        self.deferred = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(
+        self,
+        now,
+    ):
+        self.tokens = min(
+            self.burst,
+            self.tokens + (now - self.updated_at) * self.rate,
+        )
+        self.updated_at = now
+
+    def _reserve(
+        self,
+    ):
+        # Tokens may go negative, the debt is the queue of callers already waiting for their turn
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if wait > 0:
+                self.queue_depth += 1
+                self.max_queue_depth = max(
+                    self.max_queue_depth,
+                    self.queue_depth,
+                )
+            return wait
+
+    def _release(
+        self,
+        wait,
+    ):
+        with self._lock:
+            self.acquired += 1
+            if wait > 0:
+                self.queue_depth -= 1
+                self.throttled += 1
+                self.total_wait += wait
+                self.max_wait = max(
+                    self.max_wait,
+                    wait,
+                )
+
+    def _log_wait(
+        self,
+        wait,
+    ):
+        log = logger.info if wait >= 1 else logger.debug
+        log(f". [~] {self.name} limiter: waiting {round(wait, 2)} seconds, {self.queue_depth} requests queued")
+
+    async def acquire(
+        self,
+    ):
+        wait = self._reserve()
+        if wait <= 0:
+            self._release(wait)
+            return
+
+        self._log_wait(wait)
+        waited = wait
+        try:
+            while wait > 0:
+                await asyncio.sleep(wait)
+                # A defer() while we slept holds us too, not just the callers that come after it
+                wait = self.resume_at - time.monotonic()
+                if wait > 0:
+                    waited += wait
+        finally:
+            self._release(waited)
+
+    def defer(
+        self,
+        seconds,
+    ):
+        # Upstream asked us to back off: new callers queue behind the debt, callers already asleep wait for resume_at
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(
+                self.tokens,
+                -seconds * self.rate,
+            )
+            self.resume_at = max(
+                self.resume_at,
+                now + seconds,
+            )
+            self.deferred += 1
+
+    def stats(
+        self,
+    ):
+        with self._lock:
+            return {
+                "name": self.name,
+                "rate": self.rate,
+                "burst": self.burst,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "deferred": self.deferred,
+                "total_wait": round(self.total_wait, 3),
+                "max_wait": round(self.max_wait, 3),
+                "avg_wait": round(self.total_wait / self.throttled, 3) if self.throttled else 0.0,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(
+    name,
+    rate,
+    burst=None,
+):
+    # One bucket per upstream endpoint for the whole process, the first caller configures it
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = TokenBucket(
+                name,
+                rate,
+                burst,
+            )
+        return _limiters[name]
+
+
+def subscan_limiter():
+    return get_limiter(
+        "subscan",
+        rate=float(os.environ.get("SUBSCAN_RPS", 5)),
+        burst=float(os.environ.get("SUBSCAN_BURST", 0)),
+    )
+
+
+def subsquid_limiter(
+    endpoint,
+):
+    return get_limiter(
+        endpoint,
+        rate=float(os.environ.get("SUBSQUID_RPS", 10)),
+        burst=float(os.environ.get("SUBSQUID_BURST", 0)),
+    )
+
+
+def limiter_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.stats() for limiter in limiters]
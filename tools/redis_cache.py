@@ -0,0 +1,108 @@
+from tools.tiered_cache import TieredBackend
+from tools.codec import SCHEMA_VERSION, pack, unpack
+import uuid
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RedisBackend(TieredBackend):
+    # Shared tier for several uvicorn workers: every worker keeps its local cache in front of Redis,
+    # writes its entries through and tells the other workers to drop their copy
+    name = "redis"
+
+    def __init__(
+        self,
+        client,
+        local=None,
+        prefix=None,
+        ttl=None,
+    ):
+        super().__init__(local)
+        self.client = client
+        # Versioned so workers with an older entry layout never read the newer one
+        self.prefix = prefix or f"dotly:widget:v{SCHEMA_VERSION}"
+        self.channel = f"{self.prefix}:invalidate"
+        # Shared entries are dropped by Redis after this many seconds without a write
+        self.ttl = ttl or int(os.environ.get("WIDGET_CACHE_REDIS_TTL", 7 * 24 * 3600))
+        self.worker_id = uuid.uuid4().hex
+        self.invalidations_received = 0
+
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel: self._on_invalidate})
+        self._listener = self._pubsub.run_in_thread(
+            sleep_time=0.1,
+            daemon=True,
+        )
+
+    @classmethod
+    def from_url(
+        cls,
+        url,
+        **kwargs,
+    ):
+        import redis
+
+        return cls(
+            redis.Redis.from_url(url),
+            **kwargs,
+        )
+
+    def _redis_key(
+        self,
+        key,
+    ):
+        return ":".join((self.prefix,) + tuple(key))
+
+    def _read(
+        self,
+        key,
+    ):
+        return self.client.get(self._redis_key(key))
+
+    def _write(
+        self,
+        key,
+        data,
+    ):
+        if data is None:
+            self.client.delete(self._redis_key(key))
+        else:
+            self.client.set(
+                self._redis_key(key),
+                data,
+                ex=self.ttl,
+            )
+        self.client.publish(
+            self.channel,
+            pack([self.worker_id] + list(key)),
+        )
+
+    def _on_invalidate(
+        self,
+        message,
+    ):
+        (
+            worker_id,
+            *key,
+        ) = unpack(message["data"])
+        if worker_id == self.worker_id:
+            return
+        self.invalidations_received += 1
+        self.discard(tuple(key))
+
+    def close(
+        self,
+    ):
+        super().close()
+        self._listener.stop()
+
+    def stats(
+        self,
+    ):
+        return {
+            **super().stats(),
+            "redis_invalidations_received": self.invalidations_received,
+        }
@@ -0,0 +1,94 @@
+from concurrent.futures import (
+    Future,
+)
+import asyncio
+import threading
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    # Concurrent calls for the same key share one execution, even across the event loops of different threads
+    def __init__(
+        self,
+    ):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def _join(
+        self,
+        key,
+    ):
+        with self._lock:
+            if key in self._calls:
+                self.coalesced += 1
+                return (
+                    self._calls[key],
+                    False,
+                )
+            future = Future()
+            # Running futures cannot be cancelled, a follower that gives up must not cancel it for the others
+            future.set_running_or_notify_cancel()
+            self._calls[key] = future
+            self.executed += 1
+            return (
+                future,
+                True,
+            )
+
+    def _finish(
+        self,
+        key,
+        future,
+        result=None,
+        exception=None,
+    ):
+        with self._lock:
+            del self._calls[key]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    async def do(
+        self,
+        key,
+        fn,
+    ):
+        (
+            future,
+            leader,
+        ) = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(
+                key,
+                future,
+                exception=e,
+            )
+            raise
+        self._finish(
+            key,
+            future,
+            result=result,
+        )
+        return result
+
+    def stats(
+        self,
+    ):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,145 @@
+from tools.tiered_cache import TieredBackend
+from tools.codec import SCHEMA_VERSION
+import sqlite3
+import threading
+import time
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteBackend(TieredBackend):
+    # On-disk tier that survives restarts, a new process serves from it and tops up incrementally
+    name = "disk"
+
+    def __init__(
+        self,
+        path,
+        local=None,
+        max_age=None,
+    ):
+        super().__init__(local)
+        self.path = path
+        # Accounts that were not updated for this many seconds are removed when the file is opened
+        self.max_age = max_age or int(os.environ.get("WIDGET_CACHE_DISK_MAX_AGE", 30 * 24 * 3600))
+        # Reads happen on the caller's thread, writes on the writer thread, each with its own connection
+        self._read_lock = threading.Lock()
+        self._reader = self._connect()
+        self._writer_connection = None
+        self._migrate()
+
+    def _connect(
+        self,
+    ):
+        connection = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _migrate(
+        self,
+    ):
+        with self._read_lock, self._reader:
+            self._reader.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            row = self._reader.execute("SELECT value FROM meta WHERE name = 'schema_version'").fetchone()
+            version = int(row[0]) if row else None
+            if version != SCHEMA_VERSION:
+                if version is not None:
+                    logger.info(f". [=] Disk cache schema {version} is outdated, starting over with {SCHEMA_VERSION}")
+                self._reader.execute("DROP TABLE IF EXISTS entries")
+                self._reader.execute("""
+                    CREATE TABLE entries (
+                        namespace TEXT NOT NULL,
+                        public_key TEXT NOT NULL,
+                        data BLOB NOT NULL,
+                        updated_at REAL NOT NULL,
+                        PRIMARY KEY (namespace, public_key)
+                    )
+                    """)
+                self._reader.execute(
+                    "INSERT OR REPLACE INTO meta (name, value) VALUES ('schema_version', ?)",
+                    (str(SCHEMA_VERSION),),
+                )
+            removed = self._reader.execute(
+                "DELETE FROM entries WHERE updated_at < ?",
+                (time.time() - self.max_age,),
+            ).rowcount
+        if removed:
+            logger.info(f". [=] Removed {removed} expired accounts from disk cache")
+
+    def _read(
+        self,
+        key,
+    ):
+        (
+            namespace,
+            public_key,
+        ) = key
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT data FROM entries WHERE namespace = ? AND public_key = ?",
+                (
+                    namespace,
+                    public_key,
+                ),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _write(
+        self,
+        key,
+        data,
+    ):
+        (
+            namespace,
+            public_key,
+        ) = key
+        if self._writer_connection is None:
+            self._writer_connection = self._connect()
+        with self._writer_connection:
+            if data is None:
+                self._writer_connection.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND public_key = ?",
+                    (
+                        namespace,
+                        public_key,
+                    ),
+                )
+            else:
+                self._writer_connection.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, public_key, data, updated_at) VALUES (?, ?, ?, ?)",
+                    (
+                        namespace,
+                        public_key,
+                        data,
+                        time.time(),
+                    ),
+                )
+
+    def discard(
+        self,
+        key,
+    ):
+        # Another worker has a newer copy, this one must not be served from disk either
+        self._forget_absent(key)
+        if not self.local.is_pinned(key):
+            self.local.discard(key)
+            self._writer.submit(
+                self._write_entry,
+                key,
+                None,
+            )
+
+    def close(
+        self,
+    ):
+        super().close()
+        if self._writer_connection is not None:
+            self._writer_connection.close()
+        with self._read_lock:
+            self._reader.close()
@@ -0,0 +1,281 @@
+from abc import (
+    abstractmethod,
+)
+from collections import (
+    OrderedDict,
+)
+from concurrent.futures import (
+    ThreadPoolExecutor,
+)
+from tools.cache import CacheBackend, LRUCache
+from tools.codec import pack, unpack
+import asyncio
+import threading
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TieredBackend(CacheBackend):
+    # A slower tier under a local one: reads fall through on a local miss, writes go through in the
+    # background. Subclasses store encoded entries in _read/_write
+    name = "tier"
+
+    def __init__(
+        self,
+        local=None,
+    ):
+        self.local = local or LRUCache(int(os.environ.get("WIDGET_CACHE_MAX_BYTES", 512 * 1024 * 1024)))
+        self._dirty = set()
+        self._lock = threading.Lock()
+        # Keys this tier does not have, looked up again only once something writes or invalidates them
+        self._absent = OrderedDict()
+        self._absent_generation = 0
+        self.max_absent = int(os.environ.get("WIDGET_CACHE_MAX_ABSENT", 100000))
+        # Writes happen off the event loop, one at a time so they stay in order
+        self._writer = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix=f"widget-cache-{self.name}",
+        )
+
+        self.hits = 0
+        self.misses = 0
+        self.absent_hits = 0
+        self.writes = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+    @abstractmethod
+    def _read(
+        self,
+        key,
+    ):
+        pass
+
+    @abstractmethod
+    def _write(
+        self,
+        key,
+        data,
+    ):
+        pass
+
+    def _is_absent(
+        self,
+        key,
+    ):
+        with self._lock:
+            if key not in self._absent:
+                return False
+            self._absent.move_to_end(key)
+            self.absent_hits += 1
+            return True
+
+    def _mark_absent(
+        self,
+        key,
+        generation,
+    ):
+        with self._lock:
+            # Something was written or invalidated while we were reading, the miss may be outdated already
+            if generation != self._absent_generation:
+                return
+            self._absent[key] = True
+            self._absent.move_to_end(key)
+            if len(self._absent) > self.max_absent:
+                self._absent.popitem(last=False)
+
+    def _forget_absent(
+        self,
+        key,
+    ):
+        with self._lock:
+            self._absent_generation += 1
+            self._absent.pop(key, None)
+
+    def _load(
+        self,
+        key,
+    ):
+        if self._is_absent(key):
+            return None
+        generation = self._absent_generation
+        try:
+            data = self._read(key)
+            entry = None if data is None else unpack(data)
+        except Exception as e:
+            # Unreadable entries, e.g. written by an older version, are fetched again
+            self.errors += 1
+            logger.error(f". [-] Failed to read {key} from {self.name} cache: {e}")
+            return None
+
+        if entry is None:
+            self.misses += 1
+            self._mark_absent(
+                key,
+                generation,
+            )
+            return None
+
+        self.hits += 1
+        # Keep a local copy that was written while we were reading
+        self.local.update(
+            key,
+            lambda current: current or entry,
+        )
+        return self.local.peek(key)
+
+    def get(
+        self,
+        key,
+    ):
+        entry = self.local.get(key)
+        if entry is None:
+            entry = self._load(key)
+        return entry
+
+    def peek(
+        self,
+        key,
+    ):
+        entry = self.local.peek(key)
+        if entry is None:
+            entry = self._load(key)
+        return entry
+
+    def update(
+        self,
+        key,
+        fn,
+    ):
+        if self.local.peek(key) is None:
+            # Start from what is already stored below
+            self._load(key)
+        self.local.update(
+            key,
+            fn,
+        )
+        self._forget_absent(key)
+        with self._lock:
+            self._dirty.add(key)
+        # Entries that are being loaded or refreshed are written once, when the work is done
+        if not self.local.is_pinned(key):
+            self._flush(key)
+
+    async def load(
+        self,
+        key,
+    ):
+        # The tiers below are read on a worker thread, the lookups that follow are then served locally
+        await asyncio.to_thread(
+            self.peek,
+            key,
+        )
+
+    def delete(
+        self,
+        key,
+    ):
+        self.local.delete(key)
+        self._forget_absent(key)
+        with self._lock:
+            self._dirty.discard(key)
+        self._writer.submit(
+            self._write_entry,
+            key,
+            None,
+        )
+
+    def discard(
+        self,
+        key,
+    ):
+        # Written elsewhere, the next lookup has to read it again
+        self._forget_absent(key)
+        self.local.discard(key)
+
+    def is_pinned(
+        self,
+        key,
+    ):
+        return self.local.is_pinned(key)
+
+    def pin(
+        self,
+        key,
+    ):
+        self.local.pin(key)
+
+    def unpin(
+        self,
+        key,
+    ):
+        self.local.unpin(key)
+        if not self.local.is_pinned(key):
+            self._flush(key)
+
+    def _flush(
+        self,
+        key,
+    ):
+        with self._lock:
+            if key not in self._dirty:
+                return
+            self._dirty.discard(key)
+        entry = self.local.peek(key)
+        if entry is None:
+            return
+        # Encoded here, while nothing else can change the entry
+        self._writer.submit(
+            self._write_entry,
+            key,
+            pack(entry),
+        )
+
+    def _write_entry(
+        self,
+        key,
+        data,
+    ):
+        try:
+            self._write(
+                key,
+                data,
+            )
+            if data is not None:
+                self.writes += 1
+                self.bytes_written += len(data)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f". [-] Failed to write {key} to {self.name} cache: {e}")
+
+    def flush(
+        self,
+    ):
+        # Waits for every queued write, mostly useful on shutdown and in tests
+        if hasattr(self.local, "flush"):
+            self.local.flush()
+        self._writer.submit(lambda: None).result()
+
+    def close(
+        self,
+    ):
+        self.flush()
+        self._writer.shutdown()
+        if hasattr(self.local, "close"):
+            self.local.close()
+
+    def stats(
+        self,
+    ):
+        return {
+            **self.local.stats(),
+            f"{self.name}_hits": self.hits,
+            f"{self.name}_misses": self.misses,
+            f"{self.name}_absent_hits": self.absent_hits,
+            f"{self.name}_writes": self.writes,
+            f"{self.name}_bytes_written": self.bytes_written,
+            f"{self.name}_errors": self.errors,
+        }
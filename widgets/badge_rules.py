@@ -0,0 +1,203 @@
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
+import re
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# name, description, metric, operator, threshold, window. Metrics are account features, a window like "3M" asks for
+# that many consecutive months anywhere in a monthly series and "last 3M" for the latest months
+RULES = [
+    ("Join the party!", "Sent a token transfer.", "sent", ">", 0, None),
+    ("Is this gift for me?", "Receive a token transfer.", "received", ">", 0, None),
+    ("First Dip in the Gold!", "Received your first reward.", "rewards", ">", 0, None),
+    ("Call Master 300!", "More than 300 extrinsic calls made.", "extrinsics", ">", 300, None),
+    ("Hat Trick Hero!", "Received rewards for 3 consecutive months.", "monthly_rewards", ">", 0, "3M"),
+    ("Trailblazer!", "Interacted with 5 or more different extrinsic modules.", "pallets", ">=", 5, None),
+    ("Golden Gatherer", "Collected over 100 rewards. Keep it up!", "rewards", ">", 100, None),
+    ("Thousand Thrills", "A thrill for every reward, and you've hit 1000 of them!", "rewards", ">", 1000, None),
+    (
+        "Elite Earner",
+        "You've accumulated over 10,000 in rewards. Elite status achieved!",
+        "reward_amount",
+        ">",
+        10000,
+        None,
+    ),
+    (
+        "Lavish Legend",
+        "You've accumulated over 1,000 in rewards. Truly legendary!",
+        "reward_amount",
+        ">",
+        1000,
+        None,
+    ),
+    ("Multiverse Traveler", "Have balances in more than one network.", "networks", ">", 1, None),
+    ("Locked & Loaded", "Have locked funds in any network.", "locked", ">", 0, None),
+    ("Democracy Defender", "Have funds locked in democratic processes.", "democracy_lock", ">", 0, None),
+    ("Nomination Knight", "Have nomination bonded funds in any network.", "nomination_bonded", ">", 0, None),
+    ("Identity Pioneer", "Established an identity on any network.", "identity", "==", True, None),
+    ("Webmaster", "Provided a website in the identity details.", "web", "==", True, None),
+    ("TweetHeart", "Linked a Twitter handle in identity details.", "twitter", "==", True, None),
+    ("Judgement Joker", "Received at least one judgement.", "judgements", "==", True, None),
+    (
+        "Consistent Growth",
+        "Your balance has grown consistently over the past three months.",
+        "balance_growing",
+        "==",
+        True,
+        None,
+    ),
+    ("Magnet Mogul", "Receive a total of more than 100 transactions.", "received", ">", 100, None),
+    (
+        "Equilibrium Expert",
+        "You've maintained your balance within a 10% range over the past three months.",
+        "balance_steady",
+        "==",
+        True,
+        None,
+    ),
+    ("Chatterbox Chieftain", "Send a total of more than 50 transactions.", "sent", ">", 50, None),
+    (
+        "Transfer Titan",
+        "Participate in a total of more than 150 transactions, combining both sent and received.",
+        "transfers",
+        ">",
+        150,
+        None,
+    ),
+    ("Consistent Conductor", "Had activity for at least three consecutive months.", "monthly_activity", ">", 0, "3M"),
+    (
+        "Consistent Creator",
+        "Had a minimum of 5 extrinsic activities every month for the past three months.",
+        "monthly_activity",
+        ">=",
+        5,
+        "last 3M",
+    ),
+    (
+        "One-Tap Wonder",
+        "Kudos for executing your first extrinsic! Every blockchain saga starts with a single tap.",
+        "extrinsics",
+        ">",
+        0,
+        None,
+    ),
+    ("Extrinsics Explorer", "Dive deep with over 10 extrinsics!", "extrinsics", ">", 10, None),
+    ("Extrinsics Enthusiast", "Show your passion with over 50 extrinsics!", "extrinsics", ">", 50, None),
+    ("Extrinsics Expert", "Elevate your status with over 100 extrinsics!", "extrinsics", ">", 100, None),
+    ("Extrinsics Emperor", "Rule the extrinsics world with over 200 actions!", "extrinsics", ">", 200, None),
+]
+
+OPERATORS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+}
+
+WINDOW = re.compile(r"(last )?(\d+)M")
+
+
+def window_values(
+    series,
+    window,
+    operator,
+):
+    # One value per account that passes a threshold exactly when every month of the window does: the lowest month
+    # for lower bounds, the highest for upper bounds. Windows anywhere in the series keep the best of them
+    (
+        latest,
+        months,
+    ) = window
+    worst = np.min if operator in (">", ">=") else np.max
+    best = np.max if operator in (">", ">=") else np.min
+    if latest:
+        return worst(series[:, -months:], axis=1)
+    return best(
+        worst(sliding_window_view(series, months, axis=1), axis=2),
+        axis=1,
+    )
+
+
+class BadgeRules:
+    # Rules compiled against the feature layout. Rules on the same metric, operator and window are one group,
+    # the metric is reduced once and compared with all of their thresholds together
+    def __init__(
+        self,
+        rules,
+        features,
+    ):
+        features = {name: np.dtype(dtype) for name, dtype in features.items()}
+        self.names = []
+        self.descriptions = []
+        groups = {}
+        for column, (name, description, metric, operator, threshold, window) in enumerate(rules):
+            if metric not in features:
+                raise ValueError(f"Badge {name} reads an unknown metric: {metric}")
+            if operator not in OPERATORS:
+                raise ValueError(f"Badge {name} uses an unknown operator: {operator}")
+            if (window is None) != (features[metric].shape == ()):
+                raise ValueError(f"Badge {name} needs a window exactly when {metric} is a series")
+            if window is not None:
+                match = WINDOW.fullmatch(window)
+                if match is None or operator == "==":
+                    raise ValueError(f"Badge {name} has an invalid window: {window}")
+                if not 0 < int(match.group(2)) <= features[metric].shape[0]:
+                    raise ValueError(f"Badge {name} has a window longer than its series: {window}")
+                window = (
+                    match.group(1) is not None,
+                    int(match.group(2)),
+                )
+
+            self.names.append(name)
+            self.descriptions.append(description)
+            groups.setdefault((metric, operator, window), []).append((column, threshold))
+
+        self.groups = [
+            (
+                metric,
+                operator,
+                window,
+                np.array([column for column, threshold in group]),
+                np.array([threshold for column, threshold in group], dtype=np.float64),
+            )
+            for (metric, operator, window), group in groups.items()
+        ]
+        # (badges, features) mask of the feature every badge reads
+        metrics = [rule[2] for rule in rules]
+        self.mask = np.array([[name == metric for name in features] for metric in metrics]).reshape(
+            len(rules),
+            len(features),
+        )
+
+    def __len__(
+        self,
+    ):
+        return len(self.names)
+
+    def evaluate(
+        self,
+        features,
+    ):
+        # (accounts, badges) mask of the earned badges of every account in the feature matrix
+        earned = np.zeros(
+            (
+                len(features),
+                len(self.names),
+            ),
+            dtype=bool,
+        )
+        for metric, operator, window, columns, thresholds in self.groups:
+            values = features[metric]
+            if window is not None:
+                values = window_values(
+                    values,
+                    window,
+                    operator,
+                )
+            earned[:, columns] = OPERATORS[operator](values[:, np.newaxis], thresholds)
+        return earned
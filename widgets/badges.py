@@ -24,14 +24,19 @@ from dateutil.relativedelta import (
     relativedelta,
 )
 from tools.helpers import dot_string_to_float
-import pandas as pd
 from datetime import date
 from api.api import STATS_CONTEXT, StatsType
 from api.api import OVERVIEW_CONTEXT, OverviewType
 from api.api import REWARDS_CONTEXT, RewardsType
 from api.api import EXTRINSICS_CONTEXT, ExtrinsicsType
-from api.routers import rewards, stats, overview, extrinsics
 from tools.helpers import encode
+from tools import bucketing
+from tools.cache import WidgetCache
+from tools.codec import register_enum
+from widgets.badge_rules import RULES, BadgeRules
+import asyncio
+import numpy as np
+import time
 import tools.log_config as log_config
 import os
 import logging
@@ -41,8 +46,113 @@ base_dir = os.path.dirname(current_file_path)
 logger = logging.getLogger(__name__)
 
 
+@register_enum
 class BadgesType(Enum):
     CHECK_BADGES = "CHECK_BADGES"
+    FEATURES = "FEATURES"
+    WATERMARKS = "WATERMARKS"
+
+
+# Months of activity and rewards the badges can look back on
+MONTHS = 120
+
+# Everything the badges look at, gathered once per account. Monthly series end with the last closed month
+FEATURES = {
+    "sent": np.int64,
+    "received": np.int64,
+    "transfers": np.int64,
+    "extrinsics": np.int64,
+    "pallets": np.int64,
+    "monthly_activity": (np.int64, (MONTHS,)),
+    "rewards": np.int64,
+    "reward_amount": np.float64,
+    "monthly_rewards": (np.int64, (MONTHS,)),
+    "networks": np.int64,
+    "locked": np.float64,
+    "democracy_lock": np.float64,
+    "nomination_bonded": np.float64,
+    "identity": np.bool_,
+    "web": np.bool_,
+    "twitter": np.bool_,
+    "judgements": np.bool_,
+    "balance_growing": np.bool_,
+    "balance_steady": np.bool_,
+}
+FEATURE_DTYPE = np.dtype(list(FEATURES.items()))
+
+# The features each upstream source fills in
+SOURCES = {
+    "transfers": ("sent", "received", "transfers"),
+    "extrinsics": ("extrinsics",),
+    "activity": ("pallets", "monthly_activity"),
+    "rewards": ("rewards", "reward_amount"),
+    "reward_history": ("monthly_rewards",),
+    "balances": ("networks", "locked", "democracy_lock", "nomination_bonded"),
+    "identity": ("identity", "web", "twitter", "judgements"),
+    "balance_history": ("balance_growing", "balance_steady"),
+}
+# (sources, features) mask of what every source fills in
+SOURCE_MASK = np.array([[name in SOURCES[source] for name in FEATURES] for source in SOURCES])
+
+# Compiled once, every request only evaluates them
+BADGE_RULES = BadgeRules(
+    RULES,
+    FEATURES,
+)
+# (badges, sources) mask of the sources every badge has to wait for
+BADGE_SOURCES = (BADGE_RULES.mask.astype(np.int64) @ SOURCE_MASK.T.astype(np.int64)) > 0
+
+
+def missing_features(
+    timed_out,
+):
+    # (accounts, features) mask of what the sources that timed out for each account would have filled in
+    sources = list(SOURCES)
+    missing = np.zeros(
+        (
+            len(timed_out),
+            len(FEATURES),
+        ),
+        dtype=bool,
+    )
+    for i, account_timed_out in enumerate(timed_out):
+        for source in account_timed_out:
+            missing[i] |= SOURCE_MASK[sources.index(source)]
+    return missing
+
+
+def badge_states(
+    features,
+    missing,
+):
+    # (accounts, badges) masks of the earned badges and of those that cannot be decided, every badge is
+    # checked for all accounts at once
+    earned = BADGE_RULES.evaluate(features)
+    unknown = (missing.astype(np.int64) @ BADGE_RULES.mask.T.astype(np.int64)) > 0
+    return (
+        earned & ~unknown,
+        unknown,
+    )
+
+
+def monthly_series(
+    days,
+    counts,
+):
+    # The last MONTHS closed months up to today, like the charts show them, oldest first and zero-padded
+    (
+        labels,
+        totals,
+    ) = bucketing.resample(
+        days,
+        counts,
+        bucketing.MONTH,
+        end=np.datetime64(datetime.utcnow().date()),
+    )
+    series = np.zeros(MONTHS, dtype=np.int64)
+    totals = totals[-MONTHS:]
+    series[MONTHS - len(totals) :] = totals
+    return series
 
 
 class Badges:
@@ -51,554 +161,564 @@ class Badges:
     ):
         self.subscan_actor = SubscanActor()
         self.subsquid_actor = SubSquidActor()
+        # Every upstream the features come from, each loaded once per evaluation
+        self.sources = {
+            "transfers": self._transfer_features,
+            "extrinsics": self._extrinsic_features,
+            "activity": self._activity_features,
+            "rewards": self._reward_features,
+            "reward_history": self._reward_history_features,
+            "balances": self._balance_features,
+            "identity": self._identity_features,
+            "balance_history": self._balance_history_features,
+        }
+        # Cheap markers that change whenever the data of a source does
+        self.watermark_sources = {
+            "transfers": self._transfer_watermark,
+            "extrinsics": self._extrinsic_watermark,
+            "activity": self._activity_watermark,
+            "rewards": self._reward_watermark,
+            "reward_history": self._reward_history_watermark,
+            "balances": self._overview_watermark(OverviewType.BALANCE_DISTRIBUTION),
+            "identity": self._overview_watermark(OverviewType.MULTI_CHAIN_IDENTITY),
+            "balance_history": self._overview_watermark(OverviewType.BALANCE_HISTORY),
+        }
+        # Seconds a badge check waits for its sources, badges of the late ones are reported as unknown
+        self.time_budget = float(os.environ.get("BADGES_TIME_BUDGET", 20))
+        self._late_loads = set()
+        # Results are kept with the watermarks they were computed at, they never expire on their own
+        self.cache = WidgetCache("badges")
+
+    async def _transfer_features(self, public_key, address):
+        total_transfers = await STATS_CONTEXT.total_transfers(public_key)
+        if not total_transfers:
+            return {}
+        return {
+            "sent": total_transfers["sent"],
+            "received": total_transfers["received"],
+            "transfers": total_transfers["sent"] + total_transfers["received"],
+        }
+
+    async def _extrinsic_features(self, public_key, address):
+        total_extrinsics = await EXTRINSICS_CONTEXT.total_extrinsics(public_key)
+        if not total_extrinsics:
+            return {}
+        return {
+            "extrinsics": total_extrinsics["total_count"],
+        }
+
+    async def _activity_features(self, public_key, address):
+        # Both come from the same extrinsics load
+        activity = await EXTRINSICS_CONTEXT.activity(public_key)
+        distribution = await EXTRINSICS_CONTEXT.distribution(public_key)
+        if activity is None or distribution is None:
+            return {}
+        return {
+            "pallets": len(distribution["pallets"]),
+            "monthly_activity": monthly_series(*activity),
+        }
+
+    async def _reward_features(self, public_key, address):
+        total_rewards = await REWARDS_CONTEXT.total_rewards(public_key)
+        if not total_rewards:
+            return {}
+        return {
+            "rewards": total_rewards["total_count"],
+            "reward_amount": total_rewards["total_amount"],
+        }
+
+    async def _reward_history_features(self, public_key, address):
+        reward_history = await REWARDS_CONTEXT.reward_history(public_key)
+        if reward_history is None:
+            return {}
+        return {
+            "monthly_rewards": monthly_series(*reward_history),
+        }
+
+    async def _balance_features(self, public_key, address):
+        balances = await OVERVIEW_CONTEXT.balance_distribution(public_key, address)
+        if balances is None:
+            # The overview caches nothing it could not load, failing keeps these results from being kept either
+            raise ValueError("Balances could not be loaded")
+        if not balances:
+            return {}
+
+        def column(key):
+            return np.array([float(entry.get(key, 0)) for entry in balances])
+
+        return {
+            "networks": int((column("balance") > 0).sum()),
+            "locked": column("locked").sum(),
+            "democracy_lock": column("democracy_lock").sum(),
+            "nomination_bonded": column("nomination_bonded").sum(),
+        }
+
+    async def _identity_features(self, public_key, address):
+        identities = await OVERVIEW_CONTEXT.identity(public_key, address)
+        if identities is None:
+            raise ValueError("Identities could not be loaded")
+        if not identities:
+            return {}
+        return {
+            key: any(entry.get(key) for entry in identities) for key in ("identity", "web", "twitter", "judgements")
+        }
+
+    async def _balance_history_features(self, public_key, address):
+        balance_history = await OVERVIEW_CONTEXT.balance_history(public_key, address)
+        if balance_history is None:
+            raise ValueError("Balance history could not be loaded")
+        three_months_ago = date.today() - timedelta(days=90)
+        values = np.array(
+            [
+                float(entry["value"])
+                for entry in balance_history
+                if date.fromisoformat(entry["date"]) >= three_months_ago
+            ]
+        )
+        # Like the original checks, fewer than two balances never contradict growth or a steady balance
+        return {
+            "balance_growing": bool((np.diff(values) > 0).all()),
+            "balance_steady": len(values) == 0 or bool(values.max() <= 1.1 * values.min()),
+        }
+
+    async def _transfer_watermark(self, public_key, address):
+        total_transfers = await STATS_CONTEXT.total_transfers(public_key)
+        if not total_transfers:
+            return None
+        return [
+            total_transfers["sent"],
+            total_transfers["received"],
+        ]
 
-    def _check_join_party_badge(self, public_key):
-        total_transfers = STATS_CONTEXT.total_transfers(public_key)
-        if total_transfers["sent"] > 0:
-            return True
-        else:
-            return False
-
-    def _check_is_this_gift_for_me(self, public_key):
-        total_transfers = STATS_CONTEXT.total_transfers(public_key)
-        if total_transfers["received"] > 0:
-            return True
-        else:
-            return False
-
-    def _check_call_master_300(self, public_key):
-        tatal_extrinsics = EXTRINSICS_CONTEXT.total_extrinsics(public_key)
-        if tatal_extrinsics["total_count"] > 300:
-            return True
-        else:
-            return False
-
-    def _check_hat_trick_hero(self, public_key):
-        try:
-            reward_history = rewards.reward_history(public_key=public_key, interval=rewards.HistoryInterval.MONTH)
-        except:
-            return False
-        consecutive_months = 0
-        for reward in reward_history["series"][0]["data"]:
-            if reward > 0:
-                consecutive_months += 1
-                if consecutive_months >= 3:
-                    return True
-            else:
-                consecutive_months = 0
-        return False
-
-    def _check_first_dip_in_the_gold(self, public_key):
-        total_reward = rewards.total_rewards(public_key=public_key)
-        if total_reward.get("total_count", 0) > 0:
-            return True
-        return False
-
-    def _check_trailblazer(self, public_key):
-        interacted_modules = EXTRINSICS_CONTEXT.top_interacted(public_key)
-        if interacted_modules:
-            number_of_modules_interacted_with = len(interacted_modules.get("pallets", []))
-            if number_of_modules_interacted_with >= 5:
-                return True
-        return False
-
-    def _check_multiverse_traveler(self, public_key, address):
-        balances = OVERVIEW_CONTEXT.balance_distribution(public_key, address)
-        if balances:
-            networks_with_balance = [entry["network"] for entry in balances if float(entry["balance"]) > 0]
-
-            if len(networks_with_balance) > 1:
-                return True
-        return False
-
-    def _check_locked_and_loaded(self, public_key, address):
-        balances = OVERVIEW_CONTEXT.balance_distribution(public_key, address)
-        if balances:
-            for entry in balances:
-                if float(entry.get("locked", 0)) > 0:
-                    return True
-        return False
-
-    def _check_democracy_defender(self, public_key, address):
-        balances = OVERVIEW_CONTEXT.balance_distribution(public_key, address)
-        if balances:
-            for entry in balances:
-                if float(entry.get("democracy_lock", 0)) > 0:
-                    return True
-        return False
-
-    def _check_reliable_rainmaker(self, public_key, address):
-        try:
-            data = OVERVIEW_CONTEXT.balance_history(public_key, address)
-        except:
-            return False
-        last_three_months_data = self._filter_last_three_months(data)
-
-        for i in range(1, len(last_three_months_data)):
-            if float(last_three_months_data[i]["value"]) <= float(last_three_months_data[i - 1]["value"]):
-                return False
-        return True
-
-    def _check_equilibrium_expert(self, public_key, address):
-        try:
-            data = OVERVIEW_CONTEXT.balance_history(public_key, address)
-        except:
-            return False
-
-        last_three_months_data = self._filter_last_three_months(data)
-
-        min_balance = float("inf")
-        max_balance = float("-inf")
-
-        for entry in last_three_months_data:
-            balance = float(entry["value"])
-            min_balance = min(min_balance, balance)
-            max_balance = max(max_balance, balance)
-
-        return max_balance <= 1.1 * min_balance
+    async def _extrinsic_watermark(self, public_key, address):
+        total_extrinsics = await EXTRINSICS_CONTEXT.total_extrinsics(public_key)
+        if not total_extrinsics:
+            return None
+        return [total_extrinsics["total_count"]]
 
-    def _filter_last_three_months(self, data):
-        today = datetime.date.today()
-        three_months_ago = today - datetime.timedelta(days=90)
-        return [entry for entry in data if datetime.date.fromisoformat(entry["date"]) >= three_months_ago]
+    async def _activity_watermark(self, public_key, address):
+        # Monthly series also move on when a month closes
+        extrinsic_watermark = await self._extrinsic_watermark(public_key, address)
+        if extrinsic_watermark is None:
+            return None
+        return extrinsic_watermark + [date.today().strftime("%Y-%m")]
+
+    async def _reward_watermark(self, public_key, address):
+        return [await REWARDS_CONTEXT.last_era(public_key)]
+
+    async def _reward_history_watermark(self, public_key, address):
+        reward_watermark = await self._reward_watermark(public_key, address)
+        return reward_watermark + [date.today().strftime("%Y-%m")]
+
+    def _overview_watermark(self, overview_type):
+        # The overview has no cheap change marker, the time it was written stands in for one. Once it expires the
+        # source is loaded again, which also revalidates the overview
+        async def watermark(public_key, address):
+            await OVERVIEW_CONTEXT.cache.load(public_key)
+            if OVERVIEW_CONTEXT.cache.is_stale(
+                public_key,
+                overview_type,
+            ):
+                return None
+            written_at = OVERVIEW_CONTEXT.cache.written_at(
+                public_key,
+                overview_type,
+            )
+            if written_at is None:
+                return None
+            return [written_at]
+
+        return watermark
+
+    async def watermarks(
+        self,
+        public_key,
+        address,
+        time_budget=None,
+    ):
+        # The watermark of every source, None where it could not be read in time
+        async def read(source):
+            try:
+                return await self.watermark_sources[source](public_key, address)
+            except Exception as e:
+                logger.error(f"Error while reading badge watermark {source}: {e}")
+                return None
+
+        reads = {source: asyncio.ensure_future(read(source)) for source in self.watermark_sources}
+        (
+            done,
+            pending,
+        ) = await asyncio.wait(
+            reads.values(),
+            timeout=self.time_budget if time_budget is None else time_budget,
+        )
+        for task in pending:
+            self._late_loads.add(task)
+            task.add_done_callback(self._late_loads.discard)
+        return {source: task.result() if task in done else None for source, task in reads.items()}
+
+    def _start_loads(
+        self,
+        public_key,
+        address,
+        sources,
+        costs,
+        failed,
+    ):
+        # A running load per source, each records its seconds in costs. A failed one is added to failed and
+        # leaves its features at zero, which fails the badges depending on it
+        async def load(source):
+            started = time.perf_counter()
+            try:
+                values = await self.sources[source](public_key, address)
+            except Exception as e:
+                logger.error(f"Error while loading badge source {source}: {e}")
+                failed.append(source)
+                values = {}
+            costs[source] = time.perf_counter() - started
+            return values
 
-    def _check_nomination_knight(self, public_key, address):
-        balances = OVERVIEW_CONTEXT.balance_distribution(public_key, address)
-        if balances:
-            for entry in balances:
-                if float(entry.get("nomination_bonded", 0)) > 0:
-                    return True
-        return False
+        return {source: asyncio.ensure_future(load(source)) for source in sources}
 
-    def _safe_get_identity(self, public_key, address):
-        try:
-            identities = OVERVIEW_CONTEXT.identity(public_key, address)
-            if not identities:
-                return []
-            return identities
-        except:
-            return []
-
-    def _check_identity_pioneer(self, public_key, address):
-        identities = self._safe_get_identity(public_key, address)
-        for entry in identities:
-            if entry.get("identity"):
-                return True
-        return False
-
-    def _check_webmaster(self, public_key, address):
-        identities = self._safe_get_identity(public_key, address)
-        for entry in identities:
-            if entry.get("web"):
-                return True
-        return False
-
-    def _check_tweetheart(self, public_key, address):
-        identities = self._safe_get_identity(public_key, address)
-        for entry in identities:
-            if entry.get("twitter"):
-                return True
-        return False
-
-    def _check_judgement_joker(self, public_key, address):
-        identities = self._safe_get_identity(public_key, address)
-        for entry in identities:
-            if entry.get("judgements"):
-                return True
-        return False
-
-    def _safe_get_total_transfers(self, public_key):
-        try:
-            return STATS_CONTEXT.total_transfers(public_key)
-        except:
-            return None
+    def _keep_loading(
+        self,
+        tasks,
+    ):
+        # Late sources keep loading so the widget caches are warm for the next request
+        for task in tasks:
+            self._late_loads.add(task)
+            task.add_done_callback(self._late_loads.discard)
 
-    def _check_chatterbox_chieftain(self, public_key):
-        data = self._safe_get_total_transfers(public_key)
-        if data and data.get("sent", 0) > 50:
-            return True
-        return False
+    def _log_costs(
+        self,
+        public_key,
+        costs,
+        timed_out,
+    ):
+        logger.info(
+            f". [=] Badge sources for {public_key}: "
+            + ", ".join(f"{source} {cost * 1000:.0f}ms" for source, cost in costs.items())
+        )
+        if timed_out:
+            logger.warning(f". [-] Badge sources for {public_key} missed the time budget: {', '.join(timed_out)}")
+
+    async def features(
+        self,
+        public_key,
+        address,
+        time_budget=None,
+        sources=None,
+        keep_loading=True,
+    ):
+        # The feature vector of the account, the seconds spent on each source, the sources that missed the
+        # time budget and those that failed. All sources, or the given ones, load at once. Late sources keep
+        # loading in the background, or are cancelled without keep_loading
+        features = np.zeros((), dtype=FEATURE_DTYPE)
+        costs = {}
+        failed = []
+        loads = self._start_loads(
+            public_key,
+            address,
+            sources or self.sources,
+            costs,
+            failed,
+        )
+        (
+            done,
+            pending,
+        ) = await asyncio.wait(
+            loads.values(),
+            timeout=self.time_budget if time_budget is None else time_budget,
+        )
+        timed_out = [source for source, task in loads.items() if task in pending]
+        for task in done:
+            for name, value in task.result().items():
+                features[name] = value
+        if keep_loading:
+            self._keep_loading(pending)
+        else:
+            for task in pending:
+                task.cancel()
+            # Only returns once the cancelled loads have let go of the account
+            await asyncio.gather(
+                *pending,
+                return_exceptions=True,
+            )
+
+        self._log_costs(
+            public_key,
+            costs,
+            timed_out,
+        )
+        return (
+            features,
+            costs,
+            timed_out,
+            failed,
+        )
+
+    def evaluate(
+        self,
+        features,
+        timed_out=(),
+    ):
+        # Badges reading a feature of a source that timed out can be neither earned nor missed
+        (
+            earned,
+            unknown,
+        ) = badge_states(
+            features[np.newaxis],
+            missing_features([timed_out]),
+        )
+        user_badges = []
+        for i, (name, description) in enumerate(zip(BADGE_RULES.names, BADGE_RULES.descriptions)):
+            if unknown[0, i]:
+                success = None
+                status = "unknown"
+            else:
+                success = bool(earned[0, i])
+                status = "earned" if success else "not_earned"
+            user_badges.append(
+                {
+                    "name": name,
+                    "description": description,
+                    "success": success,
+                    "status": status,
+                }
+            )
+        return user_badges
 
-    def _safe_get_extrinsics_activity(self, public_key, interval):
+    async def check_many(
+        self,
+        public_keys,
+        concurrency=8,
+        time_budget=None,
+    ):
+        # Badges of many accounts, at most concurrency of them loading at a time. Returns the valid public keys
+        # with their feature matrix, the mask of missing features and the earned and unknown badge masks
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(concurrency)
+        contexts = (
+            STATS_CONTEXT,
+            EXTRINSICS_CONTEXT,
+            REWARDS_CONTEXT,
+            OVERVIEW_CONTEXT,
+        )
+
+        async def check(public_key):
+            try:
+                address = encode(public_key)
+            except:
+                logger.warning(f". [-] Skipping invalid public key {public_key}")
+                return None
+
+            async with semaphore:
+                # Accounts only the batch needs are not kept in memory, they would push out the ones users look at
+                resident = [context.cache.is_local(public_key) for context in contexts]
+                try:
+                    (
+                        features,
+                        costs,
+                        timed_out,
+                        failed,
+                    ) = await self.features(
+                        public_key,
+                        address,
+                        time_budget,
+                        # A late load would outlive the slot and fill the cache again after the release
+                        keep_loading=False,
+                    )
+                finally:
+                    for context, is_resident in zip(contexts, resident):
+                        if not is_resident:
+                            context.cache.release(public_key)
+            return (
+                public_key,
+                features,
+                timed_out,
+            )
+
+        results = [result for result in await asyncio.gather(*[check(key) for key in public_keys]) if result]
+        checked = [public_key for public_key, features, timed_out in results]
+        features = np.zeros(len(results), dtype=FEATURE_DTYPE)
+        for i, (public_key, account_features, timed_out) in enumerate(results):
+            features[i] = account_features
+        missing = missing_features([timed_out for public_key, account_features, timed_out in results])
+        (
+            earned,
+            unknown,
+        ) = badge_states(
+            features,
+            missing,
+        )
+
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f". [=] Checked the badges of {len(checked)} accounts in {elapsed:.1f}s, "
+            f"{len(checked) / elapsed:.1f} accounts/sec"
+        )
+        return (
+            checked,
+            features,
+            missing,
+            earned,
+            unknown,
+        )
+
+    async def _decide(
+        self,
+        public_key,
+        address,
+    ):
+        # Yields the badges decided at each step, by index, with the sources that missed the time budget. A badge
+        # is decided as soon as every source it reads has loaded, only sources whose watermark moved since the
+        # stored result are loaded again and the others are read from the stored features. The last step holds
+        # the badges of the late sources as unknown
+        started = time.perf_counter()
+        watermarks = await self.watermarks(
+            public_key,
+            address,
+        )
+        stored_watermarks = {}
+        await self.cache.load(public_key)
+        if self.cache.contains(
+            public_key,
+            BadgesType.WATERMARKS,
+        ):
+            stored_watermarks = self.cache.get(public_key, BadgesType.WATERMARKS)
+        changed = [
+            source
+            for source, watermark in watermarks.items()
+            if watermark is None or stored_watermarks.get(source) != watermark
+        ]
+        if not changed:
+            yield (
+                dict(enumerate(self.cache.get(public_key, BadgesType.CHECK_BADGES))),
+                [],
+            )
+            return
+
+        features = np.zeros((), dtype=FEATURE_DTYPE)
+        for name, value in (self.cache.get(public_key, BadgesType.FEATURES) or {}).items():
+            if name in FEATURES:
+                features[name] = value
+        sources = list(SOURCES)
+        costs = {}
+        failed = []
+        loads = self._start_loads(
+            public_key,
+            address,
+            changed,
+            costs,
+            failed,
+        )
+        waiting = list(changed)
+        pending = set(loads.values())
+        decided = np.zeros(len(BADGE_RULES), dtype=bool)
+        deadline = started + self.time_budget
         try:
-            return extrinsics.extrinsics_activity(public_key, interval)
-        except:
-            return None
-
-    def _check_consistent_conductor(self, public_key):
-        data = self._safe_get_extrinsics_activity(public_key, extrinsics.ActivityInterval.MONTH)
-        if not data:
-            return False
-        activity_data = data.get("series", [{}])[0].get("data", [])
-
-        for i in range(len(activity_data) - 2):
-            if activity_data[i] > 0 and activity_data[i + 1] > 0 and activity_data[i + 2] > 0:
-                return True
-        return False
-
-    def _check_consistent_creator(self, public_key):
-        THRESHOLD = 5
-        data = self._safe_get_extrinsics_activity(public_key, extrinsics.ActivityInterval.MONTH)
-        if not data:
-            return False
-        last_three_months = data.get("series", [{}])[0].get("data", [])[-3:]
-
-        if all(value >= THRESHOLD for value in last_three_months):
-            return True
-        return False
-
-    def _safe_get_data(self, func, public_key, key):
+            while True:
+                ready = ~decided & ~BADGE_SOURCES[:, [sources.index(source) for source in waiting]].any(axis=1)
+                if ready.any():
+                    user_badges = self.evaluate(
+                        features,
+                        waiting,
+                    )
+                    decided |= ready
+                    yield (
+                        {i: user_badges[i] for i in np.flatnonzero(ready).tolist()},
+                        [],
+                    )
+                if not pending:
+                    break
+                (
+                    done,
+                    pending,
+                ) = await asyncio.wait(
+                    pending,
+                    timeout=max(deadline - time.perf_counter(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    break
+                for source, task in loads.items():
+                    if task in done:
+                        values = task.result()
+                        for name in SOURCES[source]:
+                            features[name] = values.get(name, 0)
+                        waiting.remove(source)
+        finally:
+            self._keep_loading(pending)
+
+        timed_out = waiting
+        self._log_costs(
+            public_key,
+            costs,
+            timed_out,
+        )
+        # Sources that did not load are read again next time
+        for source in timed_out + failed:
+            watermarks[source] = None
+
+        user_badges = self.evaluate(
+            features,
+            timed_out,
+        )
+        self.cache.set(
+            public_key,
+            BadgesType.FEATURES,
+            {name: features[name].tolist() for name in FEATURES},
+        )
+        self.cache.set(
+            public_key,
+            BadgesType.WATERMARKS,
+            watermarks,
+        )
+        self.cache.set(
+            public_key,
+            BadgesType.CHECK_BADGES,
+            user_badges,
+        )
+        yield (
+            {i: user_badges[i] for i in np.flatnonzero(~decided).tolist()},
+            timed_out,
+        )
+
+    async def check_badges(self, public_key):
+        # The badges of the account and the sources that timed out, None for an invalid public key
         try:
-            data = func(public_key)
+            address = encode(public_key)
         except:
             return None
-        return data.get(key, None)
-
-    def _check_magnet_mogul(self, public_key):
-        data_received = self._safe_get_data(STATS_CONTEXT.total_transfers, public_key, "received")
-        return data_received is not None and data_received > 100
-
-    def _check_transfer_titan(self, public_key):
-        data = self._safe_get_data(STATS_CONTEXT.total_transfers, public_key, None)
-        total_transactions = (data.get("received", 0) if data else 0) + (data.get("sent", 0) if data else 0)
-        return total_transactions > 150
-
-    def _check_extrinsics_explorer(self, public_key):
-        total_count = self._safe_get_data(EXTRINSICS_CONTEXT.total_extrinsics, public_key, "total_count")
-        return total_count is not None and total_count > 10
-
-    def _check_extrinsics_enthusiast(self, public_key):
-        total_count = self._safe_get_data(EXTRINSICS_CONTEXT.total_extrinsics, public_key, "total_count")
-        return total_count is not None and total_count > 50
-
-    def _check_extrinsics_expert(self, public_key):
-        total_count = self._safe_get_data(EXTRINSICS_CONTEXT.total_extrinsics, public_key, "total_count")
-        return total_count is not None and total_count > 100
-
-    def _check_extrinsics_emperor(self, public_key):
-        total_count = self._safe_get_data(EXTRINSICS_CONTEXT.total_extrinsics, public_key, "total_count")
-        return total_count is not None and total_count > 200
-
-    def _check_golden_gatherer(self, public_key):
-        total_count = self._safe_get_data(REWARDS_CONTEXT.total_rewards, public_key, "total_count")
-        return total_count is not None and total_count > 100
-
-    def _check_thousand_thrills(self, public_key):
-        total_count = self._safe_get_data(REWARDS_CONTEXT.total_rewards, public_key, "total_count")
-        return total_count is not None and total_count > 1000
 
-    def _check_elite_earner(self, public_key):
-        total_amount = self._safe_get_data(REWARDS_CONTEXT.total_rewards, public_key, "total_amount")
-        return total_amount is not None and total_amount > 10000
-
-    def _check_one_tap_wonder(self, public_key):
-        total_count = self._safe_get_data(EXTRINSICS_CONTEXT.total_extrinsics, public_key, "total_count")
-        return total_count is not None and total_count > 0
-
-    def _check_lavish_legend(self, public_key):
-        total_amount = self._safe_get_data(REWARDS_CONTEXT.total_rewards, public_key, "total_amount")
-        return total_amount is not None and total_amount > 1000
-
-    def check_badges(self, public_key):
+        user_badges = [None] * len(BADGE_RULES)
+        timed_out = []
+        async for decided, timed_out in self._decide(public_key, address):
+            for i, badge in decided.items():
+                user_badges[i] = badge
+        return (
+            user_badges,
+            timed_out,
+        )
+
+    def stream_badges(self, public_key):
+        # Every badge of the account as soon as it is decided, then the sources that timed out. None for an
+        # invalid public key, so it can be refused before anything is streamed
         try:
             address = encode(public_key)
         except:
             return None
 
-        badges = [
-            {
-                "name": "Join the party!",
-                "description": "Sent a token transfer.",
-                "success": False,
-                "function": self._check_join_party_badge,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Is this gift for me?",
-                "description": "Receive a token transfer.",
-                "success": False,
-                "function": self._check_is_this_gift_for_me,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "First Dip in the Gold!",
-                "description": "Received your first reward.",
-                "success": False,
-                "function": self._check_first_dip_in_the_gold,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Call Master 300!",
-                "description": "More than 300 extrinsic calls made.",
-                "success": False,
-                "function": self._check_call_master_300,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Hat Trick Hero!",
-                "description": "Received rewards for 3 consecutive months.",
-                "success": False,
-                "function": self._check_hat_trick_hero,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Trailblazer!",
-                "description": "Interacted with 5 or more different extrinsic modules.",
-                "success": False,
-                "function": self._check_trailblazer,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Golden Gatherer",
-                "description": "Collected over 100 rewards. Keep it up!",
-                "success": False,
-                "function": self._check_golden_gatherer,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Thousand Thrills",
-                "description": "A thrill for every reward, and you've hit 1000 of them!",
-                "success": False,
-                "function": self._check_thousand_thrills,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Elite Earner",
-                "description": "You've accumulated over 10,000 in rewards. Elite status achieved!",
-                "success": False,
-                "function": self._check_elite_earner,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Lavish Legend",
-                "description": "You've accumulated over 1,000 in rewards. Truly legendary!",
-                "success": False,
-                "function": self._check_lavish_legend,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Multiverse Traveler",
-                "description": "Have balances in more than one network.",
-                "success": False,
-                "function": self._check_multiverse_traveler,
-                "args": {
-                    "public_key": public_key,
-                    "address": address,
-                },
-            },
-            {
-                "name": "Locked & Loaded",
-                "description": "Have locked funds in any network.",
-                "success": False,
-                "function": self._check_locked_and_loaded,
-                "args": {
-                    "public_key": public_key,
-                    "address": address,
-                },
-            },
-            {
-                "name": "Democracy Defender",
-                "description": "Have funds locked in democratic processes.",
-                "success": False,
-                "function": self._check_democracy_defender,
-                "args": {
-                    "public_key": public_key,
-                    "address": address,
-                },
-            },
-            {
-                "name": "Nomination Knight",
-                "description": "Have nomination bonded funds in any network.",
-                "success": False,
-                "function": self._check_nomination_knight,
-                "args": {
-                    "public_key": public_key,
-                    "address": address,
-                },
-            },
-            {
-                "name": "Identity Pioneer",
-                "description": "Established an identity on any network.",
-                "success": False,
-                "function": self._check_identity_pioneer,
-                "args": {
-                    "public_key": public_key,
-                    "address": address,
-                },
-            },
-            {
-                "name": "Webmaster",
-                "description": "Provided a website in the identity details.",
-                "success": False,
-                "function": self._check_webmaster,
-                "args": {"public_key": public_key, "address": address},
-            },
-            {
-                "name": "TweetHeart",
-                "description": "Linked a Twitter handle in identity details.",
-                "success": False,
-                "function": self._check_tweetheart,
-                "args": {
-                    "public_key": public_key,
-                    "address": address,
-                },
-            },
-            {
-                "name": "Judgement Joker",
-                "description": "Received at least one judgement.",
-                "success": False,
-                "function": self._check_judgement_joker,
-                "args": {
-                    "public_key": public_key,
-                    "address": address,
-                },
-            },
-            {
-                "name": "Consistent Growth",
-                "description": "Your balance has grown consistently over the past three months.",
-                "success": False,
-                "function": self._check_reliable_rainmaker,
-                "args": {
-                    "public_key": public_key,
-                    "address": address,
-                },
-            },
-            {
-                "name": "Magnet Mogul",
-                "description": "Receive a total of more than 100 transactions.",
-                "success": False,
-                "function": self._check_magnet_mogul,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Equilibrium Expert",
-                "description": "You've maintained your balance within a 10% range over the past three months.",
-                "success": False,
-                "function": self._check_equilibrium_expert,
-                "args": {
-                    "public_key": public_key,
-                    "address": address,
-                },
-            },
-            {
-                "name": "Chatterbox Chieftain",
-                "description": "Send a total of more than 50 transactions.",
-                "success": False,
-                "function": self._check_chatterbox_chieftain,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Transfer Titan",
-                "description": "Participate in a total of more than 150 transactions, combining both sent and received.",
-                "success": False,
-                "function": self._check_transfer_titan,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Consistent Conductor",
-                "description": "Had activity for at least three consecutive months.",
-                "success": False,
-                "function": self._check_consistent_conductor,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Consistent Creator",
-                "description": "Had a minimum of 5 extrinsic activities every month for the past three months.",
-                "success": False,
-                "function": self._check_consistent_creator,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "One-Tap Wonder",
-                "description": "Kudos for executing your first extrinsic! Every blockchain saga starts with a single tap.",
-                "success": False,
-                "function": self._check_one_tap_wonder,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Extrinsics Explorer",
-                "description": "Dive deep with over 10 extrinsics!",
-                "success": False,
-                "function": self._check_extrinsics_explorer,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Extrinsics Enthusiast",
-                "description": "Show your passion with over 50 extrinsics!",
-                "success": False,
-                "function": self._check_extrinsics_enthusiast,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Extrinsics Expert",
-                "description": "Elevate your status with over 100 extrinsics!",
-                "success": False,
-                "function": self._check_extrinsics_expert,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-            {
-                "name": "Extrinsics Emperor",
-                "description": "Rule the extrinsics world with over 200 actions!",
-                "success": False,
-                "function": self._check_extrinsics_emperor,
-                "args": {
-                    "public_key": public_key,
-                },
-            },
-        ]
-
-        for badge in badges:
-            try:
-                badge["success"] = badge["function"](**badge["args"])
-            except Exception as e:
-                logger.error(f"Error while checking badge {badge['name']}: {e}")
-                badge["success"] = False
-
-        # return without args and function
-        user_badges = [
-            {
-                "name": badge["name"],
-                "description": badge["description"],
-                "success": badge["success"],
-            }
-            for badge in badges
-        ]
-        return user_badges
+        async def stream():
+            async for decided, timed_out in self._decide(public_key, address):
+                for badge in decided.values():
+                    yield (
+                        "badge",
+                        badge,
+                    )
+            yield (
+                "done",
+                {"timed_out": timed_out},
+            )
+
+        return stream()
@@ -7,9 +7,6 @@ from actors.subscan_actor import (
 from enum import (
     Enum,
 )
-from collections import (
-    deque,
-)
 from collections import (
     Counter,
 )
@@ -19,14 +16,17 @@ from collections import (
 from datetime import (
     datetime,
     timedelta,
+    timezone,
 )
 from dateutil.relativedelta import (
     relativedelta,
 )
-import pandas as pd
-import threading
-from collections import deque
-import threading
+import asyncio
+import numpy as np
+from tools.cache import WidgetCache
+from widgets.history_widget import HistoryWidget
+from tools.codec import register_class, register_enum
+from tools.columnar import CodeTotals, ColumnTable, DailyRollup, parse_timestamps
 import tools.log_config as log_config
 import os
 import logging
@@ -36,287 +36,408 @@ base_dir = os.path.dirname(current_file_path)
 logger = logging.getLogger(__name__)
 
 
+@register_enum
 class ExtrinsicsType(Enum):
     EXTRINSICS = "EXTRINSICS"
-    DISTRIBUTION = "DISTRIBUTION"
-    WEEKLY_TRANSACTION_RATE = "WEEKLY_TRANSACTION_RATE"
     TOTAL_EXTRINSICS = "TOTAL_EXTRINSICS"
     RECENT_EXTRINSICS = "RECENT_EXTRINSICS"
+    DAILY_ACTIVITY = "DAILY_ACTIVITY"
+    WEEKLY_TRANSACTION_RATE = "WEEKLY_TRANSACTION_RATE"
+    CALLS = "CALLS"
+    CURSOR = "CURSOR"
+
+
+# Daily activity of all extrinsics is kept in group 0, every (pallet, call) in a group of its own
+ALL_CALLS = 0
+CALL_BITS = 16
+CALL_MASK = (1 << CALL_BITS) - 1
+
+
+def call_group(
+    pallet,
+    call,
+):
+    return ((np.asarray(pallet, dtype=np.int64) << CALL_BITS) | call) + 1
+
+
+@register_class
+class ExtrinsicsColumns(ColumnTable):
+    # One row per extrinsic in chronological order, timestamps in UTC milliseconds,
+    # pallet and call names as codes into the two dictionaries
+    columns = {
+        "timestamp": np.int64,
+        "success": np.bool_,
+        "pallet": np.int32,
+        "call": np.int32,
+    }
+    dictionaries = (
+        "pallets",
+        "calls",
+    )
+
+    def extend(
+        self,
+        rows,
+    ):
+        self.append(
+            timestamp=parse_timestamps([row["timestamp"] for row in rows]),
+            success=[row["success"] for row in rows],
+            pallet=self.pallets.encode([row["mainCall"]["palletName"] for row in rows]),
+            call=self.calls.encode([row["mainCall"]["callName"] for row in rows]),
+        )
 
+    def roll_up(
+        self,
+        daily_activity,
+        sign=1,
+    ):
+        # Count these extrinsics into the daily buckets, once for all calls and once for their (pallet, call)
+        for groups in (
+            None,
+            call_group(
+                self.pallet,
+                self.call,
+            ),
+        ):
+            daily_activity.add(
+                self.timestamp,
+                sign=sign,
+                groups=groups,
+                count=np.ones(len(self)),
+                success=self.success,
+            )
+
+    def count_into(
+        self,
+        calls,
+        sign=1,
+    ):
+        # Every extrinsic into the running count of its (pallet, call)
+        calls.add(
+            call_group(
+                self.pallet,
+                self.call,
+            ),
+            self.timestamp,
+            sign=sign,
+            count=np.ones(len(self)),
+        )
 
-class Extrinsics:
-    def __init__(self):
-        self.subscan_actor = SubscanActor()
-        self.subsquid_actor = SubSquidActor()
-        self.cache_limit = 10
-        self.cache = {}
-        # queue now stores tuples of (public_key, lock)
-        self.locks_dict = {}
-        self.queue = deque(maxlen=10)  # This will only store public_keys now
-
-    def _get_lock_for_key(self, key):
-        if key not in self.locks_dict:
-            self.locks_dict[key] = threading.Lock()
-
-            # If the queue is full, pop the oldest key and delete its lock
-            if len(self.queue) == self.queue.maxlen:
-                oldest_key = self.queue.popleft()
-                del self.locks_dict[oldest_key]
-
-            self.queue.append(key)
+    def distribution(
+        self,
+        calls,
+    ):
+        # Pallets and their calls ordered by count from the running (pallet, call) totals, the most
+        # recently used first among equal counts
+        pairs = calls.keys - 1
+        pallet = pairs >> CALL_BITS
+        counts = calls.totals["count"]
+        pallet_counts = np.bincount(
+            pallet,
+            weights=counts,
+            minlength=len(self.pallets),
+        ).astype(np.int64)
+        pallet_latest = np.zeros(
+            len(self.pallets),
+            dtype=np.int64,
+        )
+        np.maximum.at(
+            pallet_latest,
+            pallet,
+            calls.latest,
+        )
 
-            # If a new key is being added, ensure its presence in the cache
-            if key not in self.cache:
-                self.cache[key] = {}
+        pallets = {}
+        pallet_calls = {}
+        for code in np.lexsort((-pallet_latest, -pallet_counts)):
+            if pallet_counts[code] == 0:
+                break
+            name = self.pallets.values[code]
+            pallets[name] = int(pallet_counts[code])
+            pallet_calls[name] = {
+                self.calls.values[pairs[position] & CALL_MASK]: int(counts[position])
+                for position in calls.top(
+                    counts,
+                    len(calls),
+                    where=pallet == code,
+                )
+            }
+        return {
+            "pallets": pallets,
+            "calls": pallet_calls,
+        }
 
-        return self.locks_dict[key]
 
-    def _save_to_cache(self, public_key, stats_type: ExtrinsicsType, data):
-        self.cache[public_key][stats_type] = data
+class Extrinsics(HistoryWidget):
+    cursor_type = ExtrinsicsType.CURSOR
+    rows_type = ExtrinsicsType.EXTRINSICS
+    rollup_type = ExtrinsicsType.DAILY_ACTIVITY
+    totals_type = ExtrinsicsType.CALLS
+    recent_type = ExtrinsicsType.RECENT_EXTRINSICS
+    total_type = ExtrinsicsType.TOTAL_EXTRINSICS
 
-    def _check_cache(self, public_key, stats_type: ExtrinsicsType):
-        if public_key in self.cache and stats_type in self.cache[public_key]:
-            return True
-        return False
+    def __init__(self):
+        self.subscan_actor = SubscanActor()
+        self.subsquid_actor = SubSquidActor()
+        self.cache = WidgetCache(
+            "extrinsics",
+            ttls={
+                ExtrinsicsType.RECENT_EXTRINSICS: 120,
+                ExtrinsicsType.TOTAL_EXTRINSICS: 120,
+            },
+            default_ttl=600,
+        )
 
-    def total_extrinsics(
+    async def total_extrinsics(
         self,
         public_key,
     ):
-        return self._extrinsics(
+        async def fetch():
+            total_count = await self._count(public_key)
+            if total_count is None:
+                return None
+            return {
+                "total_count": total_count,
+            }
+
+        return await self._metric(
             public_key,
             ExtrinsicsType.TOTAL_EXTRINSICS,
+            fetch,
         )
 
-    def recent_extrinsics(
+    async def recent_extrinsics(
         self,
         public_key,
     ):
-        all_extrinsics = self._extrinsics(
+        recent_extrinsics = await self._history(
             public_key,
-            ExtrinsicsType.EXTRINSICS,
+            ExtrinsicsType.RECENT_EXTRINSICS,
         )
 
-        if all_extrinsics:
-            # Extracting the latest 10 transfers
-            latest_10_extrinsics = []
-            if len(all_extrinsics) > 10:
-                latest_10_extrinsics = all_extrinsics[-10:][::-1]
-            else:
-                latest_10_extrinsics = all_extrinsics[::-1]
-            return latest_10_extrinsics
+        if recent_extrinsics:
+            return recent_extrinsics[::-1]
 
-    def weekly_transaction_rate(
+    async def weekly_transaction_rate(
         self,
         public_key,
     ):
-        return self._extrinsics(
+        async def fetch():
+            last_week_transaction_count = await self._count(
+                public_key,
+                since=self._one_week_ago().isoformat(),
+            )
+            if last_week_transaction_count is None:
+                return None
+            return {
+                "last_week_transaction_count": last_week_transaction_count,
+            }
+
+        return await self._metric(
             public_key,
             ExtrinsicsType.WEEKLY_TRANSACTION_RATE,
+            fetch,
         )
 
-    def extrinsics(
+    async def extrinsics(
         self,
         public_key,
     ):
-        return self._extrinsics(
+        return await self._history(
             public_key,
             ExtrinsicsType.EXTRINSICS,
         )
 
-    def distribution(
+    async def activity(
         self,
         public_key,
+        call_name=None,
+        pallet_name=None,
     ):
-        return self._extrinsics(
+        # Days with extrinsics and how many there were, of one call if given
+        daily_activity = await self._history(
             public_key,
-            ExtrinsicsType.DISTRIBUTION,
+            ExtrinsicsType.DAILY_ACTIVITY,
+        )
+        if daily_activity is None:
+            return None
+
+        group = ALL_CALLS
+        if call_name is not None:
+            all_extrinsics = self.cache.get(public_key, ExtrinsicsType.EXTRINSICS)
+            call = all_extrinsics.calls.code(call_name)
+            if pallet_name is not None:
+                pallet = all_extrinsics.pallets.code(pallet_name)
+                group = [call_group(pallet, call)] if pallet >= 0 and call >= 0 else []
+            else:
+                # The call name alone may exist in several pallets, their series are added up
+                groups = daily_activity.groups()
+                groups = groups[groups != ALL_CALLS]
+                group = groups[((groups - 1) & CALL_MASK) == call]
+        return daily_activity.series(
+            "count",
+            group,
         )
 
-    def _extrinsics(
+    async def success_count(
         self,
         public_key,
-        stats_type: ExtrinsicsType,
     ):
-        # Get the lock associated with the public_key
-        key_lock = self._get_lock_for_key(public_key)
-
-        with key_lock:
-            if not self._check_cache(
-                public_key,
-                stats_type,
-            ):
-                all_extrinsics = []
-                extrinsics_limit = 50000
-                max_fetch = 3
-
-                # Fetch total count
-                total_count_query = """
-                        query ($public_key: String!) {
-                        extrinsicsConnection(orderBy: id_ASC, where: {signerPublicKey_eq: $public_key}) {
-                            totalCount
-                        }
-                    }
-                    """
-                total_count_result = self.subsquid_actor.subscan_explorer_graphql(
-                    total_count_query,
-                    {"public_key": public_key},
-                )
-                total_count = (
-                    total_count_result.get(
-                        "data",
-                        {},
-                    )
-                    .get(
-                        "extrinsicsConnection",
-                        {},
-                    )
-                    .get(
-                        "totalCount",
-                        0,
-                    )
-                )
+        daily_activity = await self._history(
+            public_key,
+            ExtrinsicsType.DAILY_ACTIVITY,
+        )
+        if daily_activity is None:
+            return None
 
-                # Saving the top 5 senders and receivers to the cache
-                self._save_to_cache(
-                    public_key,
-                    ExtrinsicsType.TOTAL_EXTRINSICS,
-                    {
-                        "total_count": total_count,
-                    },
-                )
+        return {
+            "success": int(daily_activity.series("success")[1].sum()),
+            "total": int(daily_activity.series("count")[1].sum()),
+        }
 
-                if total_count == 0:
-                    return self.cache[public_key].get(stats_type, None)
+    async def distribution(
+        self,
+        public_key,
+    ):
+        all_extrinsics = await self._history(
+            public_key,
+            ExtrinsicsType.EXTRINSICS,
+        )
+        if all_extrinsics is None:
+            return None
+        return all_extrinsics.distribution(self.cache.get(public_key, ExtrinsicsType.CALLS))
 
-                # Calculate starting offset
-                extrinsics_offset = max(
-                    0,
-                    total_count - (max_fetch * extrinsics_limit),
-                )
+    def _pages(
+        self,
+        public_key,
+        cursor=None,
+        **paging,
+    ):
+        return self.subsquid_actor.subscan_explorer_graphql_paginate(
+            self._extrinsics_query,
+            "extrinsics",
+            {"signerPublicKey_eq": public_key},
+            **paging,
+        )
 
-                pages_fetched = 0
-                while pages_fetched < max_fetch:
-                    variables = {
-                        "public_key": public_key,
-                        "extrinsics_limit": extrinsics_limit,
-                        "extrinsics_offset": extrinsics_offset,
+    _extrinsics_query = """
+            query ($where: ExtrinsicWhereInput!, $limit: Int!, $orderBy: [ExtrinsicOrderByInput!]) {
+                extrinsics(orderBy: $orderBy, limit: $limit, where: $where) {
+                    id
+                    success
+                    timestamp
+                    mainCall {
+                    callName
+                    palletName
                     }
+                }
+                }
+        """
+
+    _total_count_query = """
+        query ($public_key: String!) {
+            extrinsicsConnection(orderBy: id_ASC, where: {signerPublicKey_eq: $public_key}) {
+                totalCount
+            }
+        }
+    """
+
+    _since_count_query = """
+        query ($public_key: String!, $since: DateTime!) {
+            extrinsicsConnection(orderBy: id_ASC, where: {signerPublicKey_eq: $public_key, timestamp_gt: $since}) {
+                totalCount
+            }
+        }
+    """
+
+    def _one_week_ago(
+        self,
+    ):
+        return datetime.now(timezone.utc) - timedelta(days=7)
 
-                    query = """
-                            query MyQuery($public_key: String!, $extrinsics_limit: Int!, $extrinsics_offset: Int!) {
-                                extrinsics(orderBy:timestamp_ASC, offset: $extrinsics_offset, limit: $extrinsics_limit, where: {signerPublicKey_eq: $public_key}) {
-                                    id
-                                    success
-                                    timestamp
-                                    mainCall {
-                                    callName
-                                    palletName
-                                    }
-                                }
-                                }
-                        """
-
-                    result = self.subsquid_actor.subscan_explorer_graphql(
-                        query,
-                        variables,
-                    )
-                    extrinsics = result.get("data", {}).get(
-                        "extrinsics",
-                        [],
-                    )
-                    if not extrinsics:
-                        break
-
-                    all_extrinsics.extend(extrinsics)
-
-                    pages_fetched += 1
-                    extrinsics_offset += extrinsics_limit
-
-                self._save_to_cache(
-                    public_key,
-                    ExtrinsicsType.EXTRINSICS,
-                    all_extrinsics,
-                )
-
-                # ----------------------------
-
-                # Convert data to a dataframe
-                df = pd.DataFrame(all_extrinsics)
-
-                # Convert timestamp to datetime type
-                df["timestamp"] = pd.to_datetime(df["timestamp"])
-
-                # Keep only the year, month, and day
-                df["timestamp"] = pd.to_datetime(df["timestamp"].dt.strftime("%Y-%m-%d"))
-
-                # Get the current timestamp
-                now = datetime.now()
-
-                # Filter for the transactions within the last week
-                one_week_ago = now - timedelta(days=7)
-                last_week_transactions = df[df["timestamp"] > one_week_ago]
-
-                # Get the transaction count for the last week
-                last_week_transaction_count = len(last_week_transactions)
+    async def _count(
+        self,
+        public_key,
+        since=None,
+    ):
+        # All extrinsics of the account, or only those after since
+        if since is None:
+            total_count_result = await self.subsquid_actor.subscan_explorer_graphql(
+                self._total_count_query,
+                {"public_key": public_key},
+            )
+        else:
+            total_count_result = await self.subsquid_actor.subscan_explorer_graphql(
+                self._since_count_query,
+                {
+                    "public_key": public_key,
+                    "since": since,
+                },
+            )
+        return (
+            (total_count_result or {})
+            .get(
+                "data",
+                {},
+            )
+            .get(
+                "extrinsicsConnection",
+                {},
+            )
+            .get("totalCount")
+        )
 
-                self._save_to_cache(
-                    public_key,
-                    ExtrinsicsType.WEEKLY_TRANSACTION_RATE,
-                    {
-                        "last_week_transaction_count": last_week_transaction_count,
-                    },
+    def _tables(
+        self,
+    ):
+        return {
+            ExtrinsicsType.EXTRINSICS: ExtrinsicsColumns(),
+            ExtrinsicsType.RECENT_EXTRINSICS: [],
+            ExtrinsicsType.DAILY_ACTIVITY: DailyRollup(
+                (
+                    "count",
+                    "success",
                 )
+            ),
+            ExtrinsicsType.CALLS: CodeTotals({"count": np.int64}),
+        }
 
-                pallet_call_data = {}
-                for entry in all_extrinsics:
-                    pallet = entry["mainCall"]["palletName"]
-                    call = entry["mainCall"]["callName"]
-
-                    if pallet not in pallet_call_data:
-                        pallet_call_data[pallet] = {
-                            "total": 0,
-                            "callNames": {},
-                        }
-
-                    pallet_call_data[pallet]["total"] += 1
-
-                    if call not in pallet_call_data[pallet]["callNames"]:
-                        pallet_call_data[pallet]["callNames"][call] = 0
-
-                    pallet_call_data[pallet]["callNames"][call] += 1
+    def _total(
+        self,
+        rows,
+        counted,
+    ):
+        return {
+            "total_count": len(rows) if counted is None else counted,
+        }
 
-                # Getting the top interacted pallets with counts
-                top_pallets = sorted(
-                    pallet_call_data.items(),
-                    key=lambda x: x[1]["total"],
-                    reverse=True,
-                )
-                top_pallets_counts = {pallet[0]: pallet[1]["total"] for pallet in top_pallets}
-
-                # Getting the top calls for each pallet
-                top_calls_counts = {}
-                for (
-                    pallet,
-                    details,
-                ) in top_pallets:
-                    calls = details["callNames"]
-                    sorted_calls = sorted(
-                        calls.items(),
-                        key=lambda x: x[1],
-                        reverse=True,
-                    )
-                    top_calls_counts[pallet] = dict(sorted_calls)
-
-                top_interacted = {
-                    "pallets": top_pallets_counts,
-                    "calls": top_calls_counts,
-                }
+    def _derive(
+        self,
+        public_key,
+        all_extrinsics,
+        calls,
+        added,
+        count_total,
+    ):
+        if count_total:
+            self.cache.get(public_key, ExtrinsicsType.TOTAL_EXTRINSICS)["total_count"] += len(added)
 
-                self._save_to_cache(
-                    public_key,
-                    ExtrinsicsType.DISTRIBUTION,
-                    top_interacted,
-                )
+        # With the history cached the weekly count follows from its timestamps on every refresh
+        one_week_ago = int(self._one_week_ago().timestamp() * 1000)
+        self._save_to_cache(
+            public_key,
+            ExtrinsicsType.WEEKLY_TRANSACTION_RATE,
+            {
+                "last_week_transaction_count": int(np.count_nonzero(all_extrinsics.timestamp > one_week_ago)),
+            },
+        )
 
-            return self.cache[public_key].get(stats_type, None)
+    def _cursor(
+        self,
+        public_key,
+        new_extrinsics,
+    ):
+        return {
+            "id": new_extrinsics[-1]["id"],
+            "timestamp": new_extrinsics[-1]["timestamp"],
+        }
@@ -0,0 +1,335 @@
+from abc import (
+    ABC,
+    abstractmethod,
+)
+import tools.log_config as log_config
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWidget(ABC):
+    # A widget over the history of one account: a cold load downloads it once, refreshes only merge in what is newer
+    # than the cached cursor. Subclasses set self.cache and the cached types below, and map their rows
+    cursor_type = None
+    # The table of rows, the daily rollup and running totals kept from it, the last rows and the total count
+    rows_type = None
+    rollup_type = None
+    totals_type = None
+    recent_type = None
+    total_type = None
+    page_size = 50000
+    max_fetch = 3
+
+    def _save_to_cache(self, public_key, stats_type, data):
+        self.cache.set(public_key, stats_type, data)
+
+    def _check_cache(self, public_key, stats_type):
+        return self.cache.contains(public_key, stats_type)
+
+    @abstractmethod
+    def _pages(
+        self,
+        public_key,
+        cursor=None,
+        **paging,
+    ):
+        # Pages of the rows of the account from the indexer, only those after the cursor if given
+        pass
+
+    @abstractmethod
+    async def _count(
+        self,
+        public_key,
+    ):
+        # The total count upstream, as the total type holds it
+        pass
+
+    @abstractmethod
+    def _tables(
+        self,
+    ):
+        # The empty value of every cached type a cold load starts from, by cached type
+        pass
+
+    @abstractmethod
+    def _total(
+        self,
+        rows,
+        counted,
+    ):
+        # The total of a cold load from its rows, or from the upstream count when the history is longer
+        pass
+
+    @abstractmethod
+    def _derive(
+        self,
+        public_key,
+        table,
+        totals,
+        added,
+        count_total,
+    ):
+        # Updates what else is cached from the table and its running totals after rows were added
+        pass
+
+    @abstractmethod
+    def _cursor(
+        self,
+        public_key,
+        new_rows,
+    ):
+        # The cursor after the newest of the new rows
+        pass
+
+    async def _fetch(
+        self,
+        public_key,
+        **paging,
+    ):
+        rows = []
+        async for page in self._pages(
+            public_key,
+            page_size=self.page_size,
+            max_rows=self.max_fetch * self.page_size,
+            **paging,
+        ):
+            rows.extend(page)
+        return rows
+
+    async def _load(
+        self,
+        public_key,
+    ):
+        # Walk back from the newest row, the cap keeps the most recent ones
+        rows = await self._fetch(
+            public_key,
+            newest_first=True,
+        )
+        rows.reverse()
+
+        # Only a history longer than what we keep needs the real count
+        counted = await self._count(public_key) if len(rows) == self.max_fetch * self.page_size else None
+        total = self._total(
+            rows,
+            counted,
+        )
+        if total is not None:
+            self._save_to_cache(
+                public_key,
+                self.total_type,
+                total,
+            )
+        if not rows:
+            return
+
+        # The cold load is just one big increment to empty tables
+        for cache_type, data in self._tables().items():
+            self._save_to_cache(
+                public_key,
+                cache_type,
+                data,
+            )
+        self._apply(
+            public_key,
+            rows,
+            count_total=False,
+        )
+
+    async def _refresh(
+        self,
+        public_key,
+        cursor,
+    ):
+        # Pull only the rows newer than the cached cursor and apply them as deltas
+        new_rows = await self._fetch(
+            public_key,
+            cursor=cursor,
+            after=cursor["id"],
+        )
+
+        logger.info(f". [+] {len(new_rows)} new {self.rows_type.value.lower()} since {cursor['timestamp']}")
+        self._apply(
+            public_key,
+            new_rows,
+        )
+
+    def _apply(
+        self,
+        public_key,
+        new_rows,
+        count_total=True,
+    ):
+        # Append chronologically ordered rows to the cached table, converted once here
+        table = self.cache.get(public_key, self.rows_type)
+        rollup = self.cache.get(public_key, self.rollup_type)
+        totals = self.cache.get(public_key, self.totals_type)
+        table.extend(new_rows)
+        added = table.rows(len(table) - len(new_rows))
+        added.roll_up(rollup)
+        added.count_into(totals)
+
+        # Keep the table capped, the oldest rows leave the rollup and running totals as well
+        overflow = len(table) - self.max_fetch * self.page_size
+        if overflow > 0:
+            dropped = table.drop_head(overflow)
+            dropped.roll_up(
+                rollup,
+                sign=-1,
+            )
+            dropped.count_into(
+                totals,
+                sign=-1,
+            )
+
+        for cache_type, data in (
+            (self.rows_type, table),
+            (self.rollup_type, rollup),
+            (self.totals_type, totals),
+            (self.recent_type, (self.cache.get(public_key, self.recent_type) + new_rows)[-10:]),
+        ):
+            self._save_to_cache(
+                public_key,
+                cache_type,
+                data,
+            )
+        self._derive(
+            public_key,
+            table,
+            totals,
+            added,
+            count_total,
+        )
+
+        if new_rows:
+            self._save_to_cache(
+                public_key,
+                self.cursor_type,
+                self._cursor(
+                    public_key,
+                    new_rows,
+                ),
+            )
+
+    async def refresh(
+        self,
+        public_key,
+    ):
+        await self.cache.load(public_key)
+        async with self.cache.lock(public_key):
+            if not self._check_cache(
+                public_key,
+                self.cursor_type,
+            ):
+                await self._load(public_key)
+                return
+
+            await self._refresh(
+                public_key,
+                self.cache.get(public_key, self.cursor_type),
+            )
+            self.cache.touch(public_key)
+
+    async def _history(
+        self,
+        public_key,
+        stats_type,
+    ):
+        await self.cache.load(public_key)
+        if not self._check_cache(
+            public_key,
+            stats_type,
+        ):
+            # Concurrent requests for a cold account share one load
+            await self.cache.flight.do(
+                public_key,
+                lambda: self._cold_load(
+                    public_key,
+                    stats_type,
+                ),
+            )
+        elif self.cache.is_stale(
+            public_key,
+            stats_type,
+        ):
+            # Serve what we have and top it up in the background
+            self.cache.revalidate(
+                public_key,
+                lambda: self.refresh(public_key),
+            )
+
+        return self.cache.get(public_key, stats_type)
+
+    async def _metric(
+        self,
+        public_key,
+        stats_type,
+        fetch,
+    ):
+        # A metric with a query of its own, it never waits for the history to be downloaded
+        async def load():
+            if self._check_cache(
+                public_key,
+                self.cursor_type,
+            ):
+                # The history is cached, its incremental refresh keeps the metric current too
+                await self.refresh(public_key)
+                return
+            data = await fetch()
+            # A history load that finished meanwhile has the better value
+            if data is not None and not self._check_cache(
+                public_key,
+                self.cursor_type,
+            ):
+                self._save_to_cache(
+                    public_key,
+                    stats_type,
+                    data,
+                )
+
+        await self.cache.load(public_key)
+        if not self._check_cache(
+            public_key,
+            stats_type,
+        ):
+            # Concurrent requests for the same account and metric share one upstream call
+            await self.cache.flight.do(
+                (
+                    public_key,
+                    stats_type,
+                ),
+                load,
+            )
+        elif self.cache.is_stale(
+            public_key,
+            stats_type,
+        ):
+            self.cache.revalidate(
+                (
+                    public_key,
+                    stats_type,
+                ),
+                lambda: self.cache.flight.do(
+                    (
+                        public_key,
+                        stats_type,
+                    ),
+                    load,
+                ),
+            )
+
+        return self.cache.get(public_key, stats_type)
+
+    async def _cold_load(
+        self,
+        public_key,
+        stats_type,
+    ):
+        async with self.cache.lock(public_key):
+            # A refresh may have filled the cache while we waited for the lock
+            if not self._check_cache(
+                public_key,
+                stats_type,
+            ):
+                await self._load(public_key)
@@ -7,9 +7,6 @@ from actors.subscan_actor import (
 from enum import (
     Enum,
 )
-from collections import (
-    deque,
-)
 from collections import (
     Counter,
 )
@@ -23,7 +20,8 @@ from datetime import (
 from dateutil.relativedelta import (
     relativedelta,
 )
-import threading
+from tools.cache import WidgetCache
+from tools.codec import register_enum
 import tools.log_config as log_config
 import os
 import logging
@@ -33,6 +31,7 @@ base_dir = os.path.dirname(current_file_path)
 logger = logging.getLogger(__name__)
 
 
+@register_enum
 class OverviewType(Enum):
     ACCOUNT = "ACCOUNT"
     MULTI_CHAIN_IDENTITY = "MULTI_CHAIN_IDENTITY"
@@ -46,46 +45,68 @@ class Overview:
     def __init__(self):
         self.subscan_actor = SubscanActor()
         self.subsquid_actor = SubSquidActor()
-        self.cache_limit = 10
-        self.cache = {}
-        # queue now stores tuples of (public_key, lock)
-        self.locks_dict = {}
-        self.queue = deque(maxlen=10)  # This will only store public_keys now
-
-    def _get_lock_for_key(self, key):
-        if key not in self.locks_dict:
-            self.locks_dict[key] = threading.Lock()
-
-            # If the queue is full, pop the oldest key and delete its lock
-            if len(self.queue) == self.queue.maxlen:
-                oldest_key = self.queue.popleft()
-                del self.locks_dict[oldest_key]
-
-            self.queue.append(key)
-
-            # If a new key is being added, ensure its presence in the cache
-            if key not in self.cache:
-                self.cache[key] = {}
-
-        return self.locks_dict[key]
+        self.cache = WidgetCache(
+            "overview",
+            ttls={
+                OverviewType.ACCOUNT: 60,
+                OverviewType.BALANCE_STATS: 60,
+                OverviewType.BALANCE_DISTRIBUTION: 300,
+                OverviewType.MULTI_CHAIN_IDENTITY: 3600,
+                OverviewType.BALANCE_HISTORY: 3600,
+            },
+            default_ttl=300,
+        )
 
     def _save_to_cache(self, public_key, stats_type: OverviewType, data):
-        key_lock = self._get_lock_for_key(public_key)
-        with key_lock:
-            self.cache[public_key][stats_type] = data
+        self.cache.set(public_key, stats_type, data)
 
     def _check_cache(self, public_key, stats_type: OverviewType):
-        key_lock = self._get_lock_for_key(public_key)
-        with key_lock:
-            return public_key in self.cache and stats_type in self.cache[public_key]
+        return self.cache.contains(public_key, stats_type)
 
-    def account(self, public_key, address):
+    async def _cached(
+        self,
+        public_key,
+        stats_type: OverviewType,
+        fetch,
+    ):
+        await self.cache.load(public_key)
         if not self._check_cache(
             public_key,
-            OverviewType.ACCOUNT,
+            stats_type,
         ):
+            # Concurrent requests for the same account and type share one upstream call
+            return await self.cache.flight.do(
+                (
+                    public_key,
+                    stats_type,
+                ),
+                fetch,
+            )
+
+        # An expired value is still served, the fresh one replaces it in the background
+        if self.cache.is_stale(
+            public_key,
+            stats_type,
+        ):
+            self.cache.revalidate(
+                (
+                    public_key,
+                    stats_type,
+                ),
+                lambda: self.cache.flight.do(
+                    (
+                        public_key,
+                        stats_type,
+                    ),
+                    fetch,
+                ),
+            )
+        return self.cache.get(public_key, stats_type)
+
+    async def account(self, public_key, address):
+        async def fetch():
             request_data = {"key": address}
-            account = self.subscan_actor.subscan_rest_make_request("v2/scan/search", data=request_data)
+            account = await self.subscan_actor.subscan_rest_make_request("v2/scan/search", data=request_data)
 
             if account is None or not account.get("data", None):
                 return None
@@ -95,19 +116,24 @@ class Overview:
                 OverviewType.ACCOUNT,
                 account["data"]["account"],
             )
-        return self.cache[public_key].get(OverviewType.ACCOUNT, None)
+            return account["data"]["account"]
 
-    def balance_distribution(
+        return await self._cached(
+            public_key,
+            OverviewType.ACCOUNT,
+            fetch,
+        )
+
+    async def balance_distribution(
         self,
         public_key,
         address,
     ):
-        if not self._check_cache(
-            public_key,
-            OverviewType.BALANCE_DISTRIBUTION,
-        ):
+        async def fetch():
             request_data = {"address": address}
-            balance_list = self.subscan_actor.subscan_rest_make_request("scan/multiChain/account", data=request_data)
+            balance_list = await self.subscan_actor.subscan_rest_make_request(
+                "scan/multiChain/account", data=request_data
+            )
 
             if balance_list is None or not balance_list.get("data", None):
                 return None
@@ -117,20 +143,22 @@ class Overview:
                 OverviewType.BALANCE_DISTRIBUTION,
                 balance_list["data"],
             )
+            return balance_list["data"]
 
-        return self.cache[public_key].get(OverviewType.BALANCE_DISTRIBUTION, None)
+        return await self._cached(
+            public_key,
+            OverviewType.BALANCE_DISTRIBUTION,
+            fetch,
+        )
 
-    def identity(
+    async def identity(
         self,
         public_key,
         address,
     ):
-        if not self._check_cache(
-            public_key,
-            OverviewType.MULTI_CHAIN_IDENTITY,
-        ):
+        async def fetch():
             request_data = {"address": address}
-            multi_chain_identity = self.subscan_actor.subscan_rest_make_request(
+            multi_chain_identity = await self.subscan_actor.subscan_rest_make_request(
                 "scan/multiChain/identities", data=request_data
             )
 
@@ -142,16 +170,18 @@ class Overview:
                 OverviewType.MULTI_CHAIN_IDENTITY,
                 multi_chain_identity["data"],
             )
+            return multi_chain_identity["data"]
 
-        return self.cache[public_key].get(OverviewType.MULTI_CHAIN_IDENTITY, None)
-
-    def balance_stats(self, public_key, address):
-        if not self._check_cache(
+        return await self._cached(
             public_key,
-            OverviewType.BALANCE_STATS,
-        ):
+            OverviewType.MULTI_CHAIN_IDENTITY,
+            fetch,
+        )
+
+    async def balance_stats(self, public_key, address):
+        async def fetch():
             request_data = {"address": address}
-            balance_stats = self.subscan_actor.subscan_rest_make_request(
+            balance_stats = await self.subscan_actor.subscan_rest_make_request(
                 "scan/multiChain/balance_value_stat", data=request_data
             )
 
@@ -163,21 +193,23 @@ class Overview:
                 OverviewType.BALANCE_STATS,
                 balance_stats["data"],
             )
+            return balance_stats["data"]
 
-        return self.cache[public_key].get(OverviewType.BALANCE_STATS, None)
-
-    def balance_history(self, public_key, address):
-        if not self._check_cache(
+        return await self._cached(
             public_key,
-            OverviewType.BALANCE_HISTORY,
-        ):
+            OverviewType.BALANCE_STATS,
+            fetch,
+        )
+
+    async def balance_history(self, public_key, address):
+        async def fetch():
             # today's date
             request_data = {
                 "address": address,
                 "end": datetime.now().strftime("%Y-%m-%d"),
                 "start": (datetime.now() - relativedelta(months=12)).strftime("%Y-%m-%d"),
             }
-            balance_stats = self.subscan_actor.subscan_rest_make_request(
+            balance_stats = await self.subscan_actor.subscan_rest_make_request(
                 "scan/multiChain/balance_value_history", data=request_data
             )
 
@@ -189,5 +221,10 @@ class Overview:
                 OverviewType.BALANCE_HISTORY,
                 balance_stats["data"],
             )
+            return balance_stats["data"]
 
-        return self.cache[public_key].get(OverviewType.BALANCE_HISTORY, None)
+        return await self._cached(
+            public_key,
+            OverviewType.BALANCE_HISTORY,
+            fetch,
+        )
@@ -7,9 +7,6 @@ from actors.subscan_actor import (
 from enum import (
     Enum,
 )
-from collections import (
-    deque,
-)
 from collections import (
     Counter,
 )
@@ -24,7 +21,12 @@ from dateutil.relativedelta import (
     relativedelta,
 )
 from tools.helpers import dot_string_to_float
-import threading
+import asyncio
+import numpy as np
+from tools.cache import WidgetCache
+from widgets.history_widget import HistoryWidget
+from tools.codec import register_class, register_enum
+from tools.columnar import CodeTotals, ColumnTable, DailyRollup, parse_timestamps
 import tools.log_config as log_config
 import os
 import logging
@@ -34,246 +36,375 @@ base_dir = os.path.dirname(current_file_path)
 logger = logging.getLogger(__name__)
 
 
+@register_enum
 class RewardsType(Enum):
     REWARDS = "REWARDS"
     REWARD_RELATIONSHIP = "REWARD_RELATIONSHIP"
     RECENT_REWARDS = "RECENT_REWARDS"
     REWARD_HISTORY = "REWARD_HISTORY"
     TOTAL_REWARDS = "TOTAL_REWARDS"
+    LAST_ERA = "LAST_ERA"
+    VALIDATORS = "VALIDATORS"
+    CURSOR = "CURSOR"
 
 
-class Rewards:
-    def __init__(self):
-        self.subscan_actor = SubscanActor()
-        self.subsquid_actor = SubSquidActor()
-        self.cache_limit = 10
-        self.cache = {}
-        # queue now stores tuples of (public_key, lock)
-        self.locks_dict = {}
-        self.queue = deque(maxlen=10)  # This will only store public_keys now
+# Planck per DOT
+PLANCK = 10**10
 
-    def _get_lock_for_key(self, key):
-        if key not in self.locks_dict:
-            self.locks_dict[key] = threading.Lock()
 
-            # If the queue is full, pop the oldest key and delete its lock
-            if len(self.queue) == self.queue.maxlen:
-                oldest_key = self.queue.popleft()
-                del self.locks_dict[oldest_key]
+@register_class
+class RewardsColumns(ColumnTable):
+    # One row per payout in chronological order, amounts in planck and validators as codes
+    columns = {
+        "era": np.int32,
+        "timestamp": np.int64,
+        "validator": np.int32,
+        "amount": np.int64,
+    }
+    dictionaries = ("validators",)
 
-            self.queue.append(key)
+    def extend(
+        self,
+        rows,
+    ):
+        self.append(
+            era=[row["era"] for row in rows],
+            timestamp=parse_timestamps([row["timestamp"] for row in rows]),
+            validator=self.validators.encode([row["validatorId"] for row in rows]),
+            # A single payout is far below 2**63 planck
+            amount=np.array(
+                [row["amount"] for row in rows],
+                dtype=np.int64,
+            ),
+        )
 
-            # If a new key is being added, ensure its presence in the cache
-            if key not in self.cache:
-                self.cache[key] = {}
+    def count_into(
+        self,
+        validators,
+        sign=1,
+    ):
+        # Every payout into the running count and planck amount of its validator
+        validators.add(
+            self.validator,
+            self.timestamp,
+            sign=sign,
+            count=np.ones(len(self)),
+            amount=self.amount,
+        )
+
+    def roll_up(
+        self,
+        reward_history,
+        sign=1,
+    ):
+        reward_history.add(
+            self.timestamp,
+            sign=sign,
+            count=np.ones(len(self)),
+            amount=self.amount,
+        )
 
-        return self.locks_dict[key]
 
-    def _save_to_cache(self, public_key, stats_type: RewardsType, data):
-        self.cache[public_key][stats_type] = data
+class Rewards(HistoryWidget):
+    cursor_type = RewardsType.CURSOR
+    rows_type = RewardsType.REWARDS
+    rollup_type = RewardsType.REWARD_HISTORY
+    totals_type = RewardsType.VALIDATORS
+    recent_type = RewardsType.RECENT_REWARDS
+    total_type = RewardsType.TOTAL_REWARDS
 
-    def _check_cache(self, public_key, stats_type: RewardsType):
-        if public_key in self.cache and stats_type in self.cache[public_key]:
-            return True
-        return False
+    def __init__(self):
+        self.subscan_actor = SubscanActor()
+        self.subsquid_actor = SubSquidActor()
+        self.cache = WidgetCache(
+            "rewards",
+            ttls={
+                RewardsType.TOTAL_REWARDS: 900,
+            },
+            # Payouts only arrive once per era
+            default_ttl=3600,
+        )
+        # Payouts can be claimed for any era still within the chain's history depth
+        self.history_depth = 84
 
-    def total_rewards(
+    async def total_rewards(
         self,
         public_key,
     ):
-        return self._rewards(
+        return await self._history(
             public_key,
             RewardsType.TOTAL_REWARDS,
         )
 
-    def recent_rewards(
+    async def recent_rewards(
         self,
         public_key,
     ):
-        all_rewards = self._rewards(
+        recent_rewards = await self._history(
             public_key,
-            RewardsType.REWARDS,
+            RewardsType.RECENT_REWARDS,
         )
-        if all_rewards:
-            latest_10_rewards = []
-            if len(all_rewards) > 10:
-                latest_10_rewards = all_rewards[-10:][::-1]
+        if recent_rewards:
+            return self._convert_rewards(recent_rewards[::-1])
 
-            else:
-                latest_10_rewards = all_rewards[::-1]
-            return latest_10_rewards
-
-    def rewards(
+    async def rewards(
         self,
         public_key,
     ):
-        return self._rewards(
+        return await self._history(
             public_key,
             RewardsType.REWARDS,
         )
 
-    def reward_relationship(
+    async def reward_history(
         self,
         public_key,
     ):
-        return self._rewards(
+        reward_history = await self._history(
             public_key,
-            RewardsType.REWARD_RELATIONSHIP,
+            RewardsType.REWARD_HISTORY,
         )
+        if reward_history is None:
+            return None
+        # Days and the number of payouts on each
+        return reward_history.series("count")
 
-    def _rewards(
+    async def reward_relationship(
         self,
         public_key,
-        stats_type: RewardsType,
     ):
-        # Get the lock associated with the public_key
-        key_lock = self._get_lock_for_key(public_key)
+        return await self._history(
+            public_key,
+            RewardsType.REWARD_RELATIONSHIP,
+        )
 
-        with key_lock:
-            if not self._check_cache(
+    async def last_era(
+        self,
+        public_key,
+    ):
+        # Era of the newest payout, None for an account without rewards
+        await self.cache.load(public_key)
+        if not self._check_cache(
+            public_key,
+            RewardsType.CURSOR,
+        ):
+            await self._metric(
                 public_key,
-                stats_type,
-            ):
-                all_rewards = []
-                reward_limit = 50000
-                max_fetch = 3
-
-                # Fetch total count
-                total_count_query = """
-                    query ($public_key: String!) {
-                    stakingRewardsConnection(orderBy: id_ASC, where: {account: {id_eq: $public_key}}) {
-                        totalCount
-                    }
-                }
-                """
-                total_count_result = self.subsquid_actor.subscan_main_graphql(
-                    total_count_query,
-                    {"public_key": public_key},
-                )
-                total_count = (
-                    total_count_result.get(
-                        "data",
-                        {},
-                    )
-                    .get(
-                        "stakingRewardsConnection",
-                        {},
-                    )
-                    .get(
-                        "totalCount",
-                        0,
-                    )
-                )
+                RewardsType.LAST_ERA,
+                lambda: self._fetch_last_era(public_key),
+            )
+        # With the history cached its cursor is the one kept current by the refreshes, a stale one in the background
+        if self._check_cache(
+            public_key,
+            RewardsType.CURSOR,
+        ):
+            cursor = await self._history(
+                public_key,
+                RewardsType.CURSOR,
+            )
+            return cursor["era"]
+        last_era = self.cache.get(public_key, RewardsType.LAST_ERA)
+        if last_era is None:
+            return None
+        return last_era["era"]
+
+    def _pages(
+        self,
+        public_key,
+        cursor=None,
+        **paging,
+    ):
+        where = {"account": {"publicKey_eq": public_key}}
+        if cursor is not None:
+            # A late claim for an older era lands after the cursor id, so the era bound only has to
+            # reach back as far as a payout can still be claimed
+            where["era_gt"] = cursor["era"] - self.history_depth
+        return self.subsquid_actor.subscan_main_graphql_paginate(
+            self._rewards_query,
+            "stakingRewards",
+            where,
+            **paging,
+        )
 
-                if total_count == 0:
-                    return self.cache[public_key].get(stats_type, None)
+    _rewards_query = """
+        query ($where: StakingRewardWhereInput!, $limit: Int!, $orderBy: [StakingRewardOrderByInput!]) {
+        stakingRewards(orderBy: $orderBy, limit: $limit, where: $where)
+        {
+            id
+            timestamp
+            amount
+            validatorId
+            era
+
+        }
+        }
+        """
+
+    _total_count_query = """
+        query ($public_key: String!) {
+            stakingRewardsConnection(orderBy: id_ASC, where: {account: {id_eq: $public_key}}) {
+                totalCount
+            }
+        }
+    """
+
+    _last_era_query = """
+        query ($public_key: String!) {
+            stakingRewards(orderBy: era_DESC, limit: 1, where: {account: {publicKey_eq: $public_key}}) {
+                era
+            }
+        }
+    """
+
+    async def _fetch_last_era(
+        self,
+        public_key,
+    ):
+        last_era_result = await self.subsquid_actor.subscan_main_graphql(
+            self._last_era_query,
+            {"public_key": public_key},
+        )
+        rewards = (
+            (last_era_result or {})
+            .get(
+                "data",
+                {},
+            )
+            .get("stakingRewards")
+        )
+        if rewards is None:
+            return None
+        return {
+            "era": rewards[0]["era"] if rewards else None,
+        }
 
-                # Calculate starting offset
-                reward_offset = max(
-                    0,
-                    total_count - (max_fetch * reward_limit),
-                )
+    def _convert_rewards(
+        self,
+        rewards,
+    ):
+        # Only the few rows that are served as they are get a float amount
+        return [
+            {
+                "amount": dot_string_to_float(reward["amount"]),
+                **{k: v for k, v in reward.items() if k != "amount"},
+            }
+            for reward in rewards
+        ]
+
+    async def _count(
+        self,
+        public_key,
+    ):
+        total_count_result = await self.subsquid_actor.subscan_main_graphql(
+            self._total_count_query,
+            {"public_key": public_key},
+        )
+        return (
+            (total_count_result or {})
+            .get(
+                "data",
+                {},
+            )
+            .get(
+                "stakingRewardsConnection",
+                {},
+            )
+            .get("totalCount")
+        )
 
-                pages_fetched = 0
-                while pages_fetched < max_fetch:
-                    variables = {
-                        "public_key": public_key,
-                        "reward_limit": reward_limit,
-                        "reward_offset": reward_offset,
-                    }
-
-                    query = """
-                    query ($public_key: String! $reward_limit: Int!, $reward_offset: Int!) {
-                    stakingRewards(limit: $reward_limit, offset: $reward_offset, where: {account: {publicKey_eq: $public_key}})
-                    {
-                        id
-                        timestamp
-                        amount
-                        validatorId
-                        era
-
-                    }
-                    }
-                    """
-
-                    result = self.subsquid_actor.subscan_main_graphql(
-                        query,
-                        variables,
-                    )
-                    rewards = result.get("data", {}).get(
-                        "stakingRewards",
-                        [],
-                    )
-                    if not rewards:
-                        break
-
-                    all_rewards.extend(rewards)
-
-                    pages_fetched += 1
-                    reward_offset += reward_limit
-
-                    all_rewards = [
-                        {
-                            "amount": dot_string_to_float(reward["amount"]),
-                            **{k: v for k, v in reward.items() if k != "amount"},
-                        }
-                        for reward in all_rewards
-                    ]
-
-                self._save_to_cache(
-                    public_key,
-                    RewardsType.REWARDS,
-                    all_rewards,
+    def _tables(
+        self,
+    ):
+        return {
+            RewardsType.REWARDS: RewardsColumns(),
+            RewardsType.RECENT_REWARDS: [],
+            RewardsType.REWARD_HISTORY: DailyRollup(
+                (
+                    "count",
+                    "amount",
                 )
+            ),
+            RewardsType.VALIDATORS: CodeTotals(
+                {
+                    "count": np.int64,
+                    "amount": np.int64,
+                }
+            ),
+        }
 
-                self._save_to_cache(
-                    public_key,
-                    RewardsType.TOTAL_REWARDS,
-                    {"total_amount": sum([reward["amount"] for reward in all_rewards]), "total_count": total_count},
-                )
-                # -----------------------------------------------------------
-
-                validators = [reward["validatorId"] for reward in all_rewards]
-
-                # Count occurrences
-                validator_counts = Counter(validators)
-
-                top_5_validators_by_count = [
-                    {
-                        "validator_id": public_id,
-                        "count": count,
-                    }
-                    for public_id, count in validator_counts.most_common(10)
-                ]
-
-                # -----------------------------------------------------------
-                # Dictionaries to hold total amount for each sender and receiver
-                validator_amount = defaultdict(float)
-
-                for reward in all_rewards:
-                    validator_id = reward["validatorId"]
-                    validator_amount[validator_id] += reward["amount"]
-
-                # Sort and extract top 5 senders and receivers by amount
-                top_5_rewards_by_amount = sorted(
-                    validator_amount.items(),
-                    key=lambda x: x[1],
-                    reverse=True,
-                )[:5]
-
-                # Convert to desired format
-                top_5_validators_by_amount = [
-                    {
-                        "validator_id": validator_id,
-                        "amount": amount,
-                    }
-                    for validator_id, amount in top_5_rewards_by_amount
-                ]
-
-                self._save_to_cache(
-                    public_key,
-                    RewardsType.REWARD_RELATIONSHIP,
-                    data={"count": top_5_validators_by_count, "amount": top_5_validators_by_amount},
-                )
+    def _total(
+        self,
+        rewards,
+        counted,
+    ):
+        # The amount is summed up from the validator totals as the rewards are applied
+        if not rewards:
+            return None
+        return {
+            "total_amount": 0.0,
+            "total_count": len(rewards) if counted is None else counted,
+        }
+
+    def _derive(
+        self,
+        public_key,
+        all_rewards,
+        validators,
+        added,
+        count_total,
+    ):
+        counts = validators.totals["count"]
+        amounts = validators.totals["amount"]
+        total_rewards = self.cache.get(public_key, RewardsType.TOTAL_REWARDS)
+        total_rewards["total_amount"] = int(amounts.sum()) / PLANCK
+        if count_total:
+            total_rewards["total_count"] += len(added)
+
+        # Top validators are ranked from the running totals, the most recent one first among equals
+        top_5_validators_by_count = [
+            {
+                "validator_id": all_rewards.validators.values[validators.keys[position]],
+                "count": int(counts[position]),
+            }
+            for position in validators.top(
+                counts,
+                10,
+            )
+        ]
+        top_5_validators_by_amount = [
+            {
+                "validator_id": all_rewards.validators.values[validators.keys[position]],
+                "amount": float(amounts[position] / PLANCK),
+            }
+            for position in validators.top(
+                amounts,
+                5,
+            )
+        ]
+
+        self._save_to_cache(
+            public_key,
+            RewardsType.REWARD_RELATIONSHIP,
+            data={"count": top_5_validators_by_count, "amount": top_5_validators_by_amount},
+        )
 
-            return self.cache[public_key].get(stats_type, None)
+    def _cursor(
+        self,
+        public_key,
+        new_rewards,
+    ):
+        # The era high-water mark never moves back, even when a late claim for an older era arrives
+        last_era = max(reward["era"] for reward in new_rewards)
+        if self._check_cache(
+            public_key,
+            RewardsType.CURSOR,
+        ):
+            last_era = max(
+                last_era,
+                self.cache.get(public_key, RewardsType.CURSOR)["era"],
+            )
+        return {
+            "id": new_rewards[-1]["id"],
+            "era": last_era,
+            "timestamp": new_rewards[-1]["timestamp"],
+        }
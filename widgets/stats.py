@@ -7,9 +7,6 @@ from actors.subscan_actor import (
 from enum import (
     Enum,
 )
-from collections import (
-    deque,
-)
 from collections import (
     Counter,
 )
@@ -24,9 +21,13 @@ from dateutil.relativedelta import (
     relativedelta,
 )
 from tools.helpers import dot_string_to_float
-import pandas as pd
 from datetime import date
-import threading
+import asyncio
+import numpy as np
+from tools.cache import WidgetCache
+from widgets.history_widget import HistoryWidget
+from tools.codec import register_class, register_enum
+from tools.columnar import CodeTotals, ColumnTable, DailyRollup, join_u128, parse_timestamps, split_u128, u128_limbs
 import tools.log_config as log_config
 import os
 import logging
@@ -36,354 +37,411 @@ base_dir = os.path.dirname(current_file_path)
 logger = logging.getLogger(__name__)
 
 
+@register_enum
 class StatsType(Enum):
     # TOP_TRANSFERS_BY_COUNT = "TOP_TRANSFERS_BY_COUNT"
     RECENT_TRANSFERS = "RECENT_TRANSFERS"
     TRANSFER_RELATIONSHIP = "TRANSFER_RELATIONSHIP"
-    TRANSFER_HISTORY = "TRANSFER_HISTORY"
     TOTAL_TRANSFERS = "TOTAL_TRANSFERS"
     # TRANSFER_SUCCESS_RATE = "TRANSFER_SUCCESS_RATE"
+    TRANSFERS = "TRANSFERS"
+    DAILY_TRANSFERS = "DAILY_TRANSFERS"
+    COUNTERPARTIES = "COUNTERPARTIES"
+    CURSOR = "CURSOR"
+
+
+# Running totals per counterparty and direction, amounts as the sums of their four u128 limbs
+COUNTERPARTY_TOTALS = {
+    "count": np.int64,
+    "amount_0": np.uint64,
+    "amount_1": np.uint64,
+    "amount_2": np.uint64,
+    "amount_3": np.uint64,
+}
+
+
+@register_class
+class TransfersColumns(ColumnTable):
+    # One row per transfer in chronological order, seen from the cached account: incoming is the
+    # "To" direction, counterparties are codes into accounts and amounts are u128 split in two halves
+    columns = {
+        "incoming": np.bool_,
+        "timestamp": np.int64,
+        "block": np.int64,
+        "counterparty": np.int32,
+        "amount_hi": np.uint64,
+        "amount_lo": np.uint64,
+    }
+    dictionaries = ("accounts",)
+
+    def extend(
+        self,
+        rows,
+    ):
+        incoming = [row["direction"] == "To" for row in rows]
+        (
+            amount_hi,
+            amount_lo,
+        ) = split_u128([row["transfer"]["amount"] for row in rows])
+        self.append(
+            incoming=incoming,
+            timestamp=parse_timestamps([row["transfer"]["timestamp"] for row in rows]),
+            block=[row["transfer"]["blockNumber"] for row in rows],
+            counterparty=self.accounts.encode(
+                [
+                    row["transfer"]["from" if is_incoming else "to"]["publicKey"]
+                    for row, is_incoming in zip(rows, incoming)
+                ]
+            ),
+            amount_hi=amount_hi,
+            amount_lo=amount_lo,
+        )
 
+    def count_into(
+        self,
+        counterparties,
+        sign=1,
+    ):
+        # Every transfer into the totals of its counterparty and direction, keyed by code * 2 + incoming
+        counterparties.add(
+            self.counterparty.astype(np.int64) * 2 + self.incoming,
+            self.timestamp,
+            sign=sign,
+            count=np.ones(len(self)),
+            **{
+                f"amount_{i}": limb
+                for i, limb in enumerate(
+                    u128_limbs(
+                        self.amount_hi,
+                        self.amount_lo,
+                    )
+                )
+            },
+        )
 
-class Stats:
-    def __init__(self):
-        self.subscan_actor = SubscanActor()
-        self.subsquid_actor = SubSquidActor()
-        self.cache_limit = 10
-        self.cache = {}
-        # queue now stores tuples of (public_key, lock)
-        self.locks_dict = {}
-        self.queue = deque(maxlen=10)  # This will only store public_keys now
-
-    def _get_lock_for_key(self, key):
-        if key not in self.locks_dict:
-            self.locks_dict[key] = threading.Lock()
-
-            # If the queue is full, pop the oldest key and delete its lock
-            if len(self.queue) == self.queue.maxlen:
-                oldest_key = self.queue.popleft()
-                del self.locks_dict[oldest_key]
-
-            self.queue.append(key)
-
-            # If a new key is being added, ensure its presence in the cache
-            if key not in self.cache:
-                self.cache[key] = {}
+    def top_by_count(
+        self,
+        counterparties,
+        incoming,
+        limit,
+    ):
+        counts = counterparties.totals["count"]
+        return [
+            {
+                "public_id": self.accounts.values[counterparties.keys[position] >> 1],
+                "count": int(counts[position]),
+            }
+            for position in counterparties.top(
+                counts,
+                limit,
+                where=(counterparties.keys & 1) == incoming,
+            )
+        ]
+
+    def top_by_amount(
+        self,
+        counterparties,
+        incoming,
+        limit,
+    ):
+        # Exact amounts are only joined from their limbs for the keys being ranked
+        where = (counterparties.keys & 1) == incoming
+        amounts = np.zeros(
+            len(counterparties),
+            dtype=object,
+        )
+        amounts[where] = join_u128([counterparties.totals[f"amount_{i}"][where] for i in range(4)])
+        return [
+            {
+                "public_id": self.accounts.values[counterparties.keys[position] >> 1],
+                "amount": amounts[position],
+            }
+            for position in counterparties.top(
+                amounts,
+                limit,
+                where=where,
+            )
+        ]
+
+    def roll_up(
+        self,
+        daily_transfers,
+        sign=1,
+    ):
+        daily_transfers.add(
+            self.timestamp,
+            sign=sign,
+            incoming=self.incoming,
+            outgoing=~self.incoming,
+        )
 
-        return self.locks_dict[key]
 
-    def _save_to_cache(self, public_key, stats_type: StatsType, data):
-        self.cache[public_key][stats_type] = data
+class Stats(HistoryWidget):
+    cursor_type = StatsType.CURSOR
+    rows_type = StatsType.TRANSFERS
+    rollup_type = StatsType.DAILY_TRANSFERS
+    totals_type = StatsType.COUNTERPARTIES
+    recent_type = StatsType.RECENT_TRANSFERS
+    total_type = StatsType.TOTAL_TRANSFERS
 
-    def _check_cache(self, public_key, stats_type: StatsType):
-        if public_key in self.cache and stats_type in self.cache[public_key]:
-            return True
-        return False
+    def __init__(self):
+        self.subscan_actor = SubscanActor()
+        self.subsquid_actor = SubSquidActor()
+        self.cache = WidgetCache(
+            "stats",
+            ttls={
+                StatsType.RECENT_TRANSFERS: 120,
+                StatsType.TOTAL_TRANSFERS: 120,
+            },
+            default_ttl=600,
+        )
 
-    def transfer_relationship(
+    async def transfer_relationship(
         self,
         public_key,
     ):
-        return self._transfers(
+        return await self._history(
             public_key,
             StatsType.TRANSFER_RELATIONSHIP,
         )
 
-    def recent_transfers(
+    async def recent_transfers(
         self,
         public_key,
     ):
-        return self._transfers(
+        recent_transfers = await self._history(
             public_key,
             StatsType.RECENT_TRANSFERS,
         )
+        if recent_transfers:
+            return recent_transfers[::-1]
 
-    def transfer_history(
+    async def transfer_history(
         self,
         public_key,
     ):
-        return self._transfers(
+        daily_transfers = await self._history(
             public_key,
-            StatsType.TRANSFER_HISTORY,
+            StatsType.DAILY_TRANSFERS,
+        )
+        if not daily_transfers:
+            return None
+
+        # Span the entire period from the earliest transfer to today, filling in missing dates with zero
+        (
+            days,
+            incoming,
+        ) = daily_transfers.series("incoming")
+        (
+            _,
+            outgoing,
+        ) = daily_transfers.series("outgoing")
+        timestamps = np.arange(
+            days[0],
+            np.datetime64(date.today()) + 1,
+        )
+        positions = (days - days[0]).astype(np.int64)
+        in_range = positions < len(timestamps)
+        incoming_counts = np.zeros(
+            len(timestamps),
+            dtype=np.int64,
         )
+        outgoing_counts = np.zeros(
+            len(timestamps),
+            dtype=np.int64,
+        )
+        incoming_counts[positions[in_range]] = incoming[in_range]
+        outgoing_counts[positions[in_range]] = outgoing[in_range]
+
+        return {
+            "timestamps": timestamps,
+            "incoming_counts": incoming_counts,
+            "outgoing_counts": outgoing_counts,
+        }
 
-    def total_transfers(
+    async def total_transfers(
         self,
         public_key,
     ):
-        return self._transfers(
+        return await self._metric(
             public_key,
             StatsType.TOTAL_TRANSFERS,
+            lambda: self._count(public_key),
         )
 
-    def _transfers(
+    def _pages(
         self,
         public_key,
-        stats_type: StatsType,
+        cursor=None,
+        **paging,
     ):
-        # Get the lock associated with the public_key
-        key_lock = self._get_lock_for_key(public_key)
+        return self.subsquid_actor.subscan_main_graphql_paginate(
+            self._transfers_query,
+            "transfers",
+            {"account": {"publicKey_eq": public_key}},
+            **paging,
+        )
 
-        with key_lock:
-            if not self._check_cache(
-                public_key,
-                stats_type,
-            ):
-                all_transfers = []
-                transfer_limit = 50000
-                max_fetch = 3
+    _transfers_query = """
+        query ($where: TransferWhereInput!, $limit: Int!, $orderBy: [TransferOrderByInput!]) {
+            transfers(orderBy: $orderBy, limit: $limit, where: $where) {
+            id
+            transfer {
+                blockNumber
+                timestamp
+                extrinsicHash
+                from {
+                    publicKey
+                }
+                amount
+                success
+                to {
+                    publicKey
+                }
+            }
+            direction
+            }
+        }
+    """
+
+    _total_count_queries = {
+        direction: """
+            query ($public_key: String!) {
+                transfersConnection(orderBy: id_ASC, where: {account: {id_eq: $public_key}, direction_eq: %s}) {
+                    totalCount
+                }
+            }
+        """
+        % direction
+        for direction in (
+            "To",
+            "From",
+        )
+    }
 
-                # Fetch total count
-                total_to_count_query = """
-                    query ($public_key: String!) {
-                        transfersConnection(orderBy: id_ASC, where: {account: {id_eq: $public_key}, direction_eq: To}) {
-                            totalCount
-                        }
-                    }            
-                """
-                total_to_count_result = self.subsquid_actor.subscan_main_graphql(
-                    total_to_count_query,
-                    {"public_key": public_key},
-                )
-                total_to_count = (
-                    total_to_count_result.get(
-                        "data",
-                        {},
-                    )
-                    .get(
-                        "transfersConnection",
-                        {},
-                    )
-                    .get(
-                        "totalCount",
-                        0,
-                    )
-                )
-                total_from_count_query = """
-                    query ($public_key: String!) {
-                        transfersConnection(orderBy: id_ASC, where: {account: {id_eq: $public_key}, direction_eq: From}) {
-                            totalCount
-                        }
-                    }            
-                """
-                total_from_count_result = self.subsquid_actor.subscan_main_graphql(
-                    total_from_count_query,
+    async def _count(
+        self,
+        public_key,
+    ):
+        # Both directions are counted concurrently
+        results = await asyncio.gather(
+            *(
+                self.subsquid_actor.subscan_main_graphql(
+                    self._total_count_queries[direction],
                     {"public_key": public_key},
                 )
-                total_from_count = (
-                    total_from_count_result.get(
-                        "data",
-                        {},
-                    )
-                    .get(
-                        "transfersConnection",
-                        {},
-                    )
-                    .get(
-                        "totalCount",
-                        0,
-                    )
-                )
-
-                total_count = total_to_count + total_from_count
-
-                # Saving the top 5 senders and receivers to the cache
-                self._save_to_cache(
-                    public_key,
-                    StatsType.TOTAL_TRANSFERS,
-                    {
-                        "total_count": total_count,
-                        "received": total_to_count,
-                        "sent": total_from_count,
-                    },
-                )
-                if total_count == 0:
-                    return self.cache[public_key][stats_type]
-
-                # Calculate starting offset
-                transfer_offset = max(
-                    0,
-                    total_count - (max_fetch * transfer_limit),
+                for direction in (
+                    "To",
+                    "From",
                 )
-                pages_fetched = 0
-                while pages_fetched < max_fetch:
-                    variables = {
-                        "public_key": public_key,
-                        "transfer_limit": transfer_limit,
-                        "transfer_offset": transfer_offset,
-                    }
-
-                    query = """
-                        query ($public_key: String!, $transfer_limit:Int!, $transfer_offset:Int!) {
-                            transfers(limit: $transfer_limit, offset: $transfer_offset, where: {account: {publicKey_eq: $public_key}}) {
-                            id
-                            transfer {
-                                blockNumber
-                                timestamp
-                                extrinsicHash
-                                from {
-                                    publicKey
-                                }
-                                amount
-                                success
-                                to {
-                                    publicKey
-                                }
-                            }
-                            direction
-                            }
-                        }
-                    """
-
-                    result = self.subsquid_actor.subscan_main_graphql(
-                        query,
-                        variables,
-                    )
-                    transfers = result.get("data", {}).get(
-                        "transfers",
-                        [],
-                    )
-                    if not transfers:
-                        break
-
-                    all_transfers.extend(transfers)
-
-                    pages_fetched += 1
-                    transfer_offset += transfer_limit
-
-                # Extracting the latest 10 transfers
-                latest_10_transfers = []
-                if len(all_transfers) > 10:
-                    latest_10_transfers = all_transfers[-10:][::-1]
-                else:
-                    latest_10_transfers = all_transfers[::-1]
-
-                # Saving the latest 10 transfers to the cache
-                self._save_to_cache(
-                    public_key,
-                    StatsType.RECENT_TRANSFERS,
-                    latest_10_transfers,
-                )
-
-                # -----------------------------------------------------------
-
-                # Extract sender and receiver data
-                # me receives
-                all_senders = [
-                    transfer["transfer"]["from"]["publicKey"]
-                    for transfer in all_transfers
-                    if transfer["direction"] == "To"
-                ]
-
-                # me sent
-                all_receivers = [
-                    transfer["transfer"]["to"]["publicKey"]
-                    for transfer in all_transfers
-                    if transfer["direction"] == "From"
-                ]
-
-                # Count occurrences
-                sender_counts = Counter(all_senders)
-                receiver_counts = Counter(all_receivers)
-
-                # Extract top 5 senders and receivers
-                top_5_senders_by_count = [
-                    {
-                        "public_id": public_id,
-                        "count": count,
-                    }
-                    for public_id, count in sender_counts.most_common(10)
-                ]
-                top_5_receivers_by_count = [
-                    {
-                        "public_id": public_id,
-                        "count": count,
-                    }
-                    for public_id, count in receiver_counts.most_common(10)
-                ]
-
-                # -----------------------------------------------------------
-                # Dictionaries to hold total amount for each sender and receiver
-                sender_amounts = defaultdict(int)
-                receiver_amounts = defaultdict(int)
-
-                for transfer in all_transfers:
-                    if transfer["direction"] == "To":
-                        receiver = transfer["transfer"]["from"]["publicKey"]
-                        receiver_amounts[receiver] += int(transfer["transfer"]["amount"])
-
-                    elif transfer["direction"] == "From":
-                        sender = transfer["transfer"]["to"]["publicKey"]
-                        sender_amounts[sender] += int(transfer["transfer"]["amount"])
-
-                # Sort and extract top 5 senders and receivers by amount
-                top_5_senders_by_amount = sorted(
-                    sender_amounts.items(),
-                    key=lambda x: x[1],
-                    reverse=True,
-                )[:5]
-                top_5_receivers_by_amount = sorted(
-                    receiver_amounts.items(),
-                    key=lambda x: x[1],
-                    reverse=True,
-                )[:5]
-
-                # Convert to desired format
-                top_5_senders_by_amount = [
-                    {
-                        "public_id": public_id,
-                        "amount": amount,
-                    }
-                    for public_id, amount in top_5_senders_by_amount
-                ]
-                top_5_receivers_by_amount = [
-                    {
-                        "public_id": public_id,
-                        "amount": amount,
-                    }
-                    for public_id, amount in top_5_receivers_by_amount
-                ]
-
-                self._save_to_cache(
-                    public_key,
-                    StatsType.TRANSFER_RELATIONSHIP,
-                    data={
-                        "count": {
-                            "senders": top_5_senders_by_count,
-                            "receivers": top_5_receivers_by_count,
-                        },
-                        "amount": {
-                            "senders": top_5_senders_by_amount,
-                            "receivers": top_5_receivers_by_amount,
-                        },
-                    },
+            )
+        )
+        (
+            total_to_count,
+            total_from_count,
+        ) = (
+            (result or {})
+            .get(
+                "data",
+                {},
+            )
+            .get(
+                "transfersConnection",
+                {},
+            )
+            .get("totalCount")
+            for result in results
+        )
+        if total_to_count is None or total_from_count is None:
+            return None
+        return {
+            "total_count": total_to_count + total_from_count,
+            "received": total_to_count,
+            "sent": total_from_count,
+        }
+
+    def _tables(
+        self,
+    ):
+        return {
+            StatsType.TRANSFERS: TransfersColumns(),
+            StatsType.RECENT_TRANSFERS: [],
+            StatsType.DAILY_TRANSFERS: DailyRollup(
+                (
+                    "incoming",
+                    "outgoing",
                 )
+            ),
+            StatsType.COUNTERPARTIES: CodeTotals(COUNTERPARTY_TOTALS),
+        }
 
-                # Convert the timestamps into 'YYYY-MM-DD' format and then count occurrences for incoming and outgoing transfers
-                all_transfers_df = pd.DataFrame(all_transfers)
-
-                # Extract timestamp from the nested 'transfer' dictionary and then convert to date format
-                all_transfers_df["transfer_date"] = all_transfers_df["transfer"].apply(lambda x: x["timestamp"])
-                all_transfers_df["transfer_date"] = pd.to_datetime(all_transfers_df["transfer_date"]).dt.date
-
-                incoming_df = all_transfers_df[all_transfers_df["direction"] == "To"].groupby("transfer_date").size()
-                outgoing_df = all_transfers_df[all_transfers_df["direction"] == "From"].groupby("transfer_date").size()
-
-                # Create a date range spanning the entire period from the earliest transfer to today
-                full_date_range = pd.date_range(start=min(all_transfers_df["transfer_date"]), end=date.today()).date
-
-                # Reindex the dataframes to this range, filling in missing dates with zero
-                incoming_df = incoming_df.reindex(full_date_range, fill_value=0)
-                outgoing_df = outgoing_df.reindex(full_date_range, fill_value=0)
-
-                self._save_to_cache(
-                    public_key,
-                    StatsType.TRANSFER_HISTORY,
-                    data={
-                        "timestamps": incoming_df.index,  # DatetimeIndex directly
-                        "incoming_counts": incoming_df,  # Series directly
-                        "outgoing_counts": outgoing_df,  # Series directly
-                    },
-                )
+    def _total(
+        self,
+        transfers,
+        counted,
+    ):
+        if counted is not None:
+            return counted
+        received = sum(1 for transfer in transfers if transfer["direction"] == "To")
+        return {
+            "total_count": len(transfers),
+            "received": received,
+            "sent": len(transfers) - received,
+        }
+
+    def _derive(
+        self,
+        public_key,
+        all_transfers,
+        counterparties,
+        added,
+        count_total,
+    ):
+        if count_total:
+            received = int(np.count_nonzero(added.incoming))
+            total_transfers = self.cache.get(public_key, StatsType.TOTAL_TRANSFERS)
+            total_transfers["received"] += received
+            total_transfers["sent"] += len(added) - received
+            total_transfers["total_count"] += len(added)
+
+        # Top senders and receivers are ranked from the running counterparty totals
+        self._save_to_cache(
+            public_key,
+            StatsType.TRANSFER_RELATIONSHIP,
+            data={
+                "count": {
+                    "senders": all_transfers.top_by_count(
+                        counterparties,
+                        True,
+                        10,
+                    ),
+                    "receivers": all_transfers.top_by_count(
+                        counterparties,
+                        False,
+                        10,
+                    ),
+                },
+                "amount": {
+                    "senders": all_transfers.top_by_amount(
+                        counterparties,
+                        False,
+                        5,
+                    ),
+                    "receivers": all_transfers.top_by_amount(
+                        counterparties,
+                        True,
+                        5,
+                    ),
+                },
+            },
+        )
 
-            return self.cache[public_key].get(stats_type, None)
+    def _cursor(
+        self,
+        public_key,
+        new_transfers,
+    ):
+        return {
+            "id": new_transfers[-1]["id"],
+            "timestamp": new_transfers[-1]["transfer"]["timestamp"],
+        }